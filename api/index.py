@@ -1,66 +1,174 @@
-import sys, os, shutil
+import sys, os, shutil, time
+# Đo thời gian từng giai đoạn khởi động nguội; đặt STARTUP_TIMING=1 để in ra khi nạp xong
+_STARTUP_CLOCK = [time.perf_counter()]
+STARTUP_TIMINGS = {}
+
+
+def mark_startup_phase(name):
+    """Ghi lại thời gian (ms) của giai đoạn khởi động vừa kết thúc."""
+    now = time.perf_counter()
+    STARTUP_TIMINGS[name] = round((now - _STARTUP_CLOCK[0]) * 1000, 1)
+    _STARTUP_CLOCK[0] = now
+
 # Bảo đảm thư mục gốc có trong PYTHONPATH để import module nội bộ khi deploy (Vercel/Unix)
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-from data.thongbao import notifications as ptit_notifications
+from Data.thongbao import notifications as ptit_notifications
 
 # -*- coding: utf-8 -*-
-# === Đặt hàm helper classify_gpa_10 ra ngoài ===
+# === THANG ĐIỂM: ĐỊNH NGHĨA MỘT LẦN, DÙNG CHUNG CHO PYTHON, NUMPY VÀ SQL ===
+import bisect
+
+# (điểm hệ 10 tối thiểu, điểm chữ, điểm hệ 4) - theo ngưỡng tăng dần
+GRADE_SCALE = (
+    (0.0, 'F', 0.0),
+    (4.0, 'D', 1.0),
+    (5.0, 'D+', 1.5),
+    (5.5, 'C', 2.0),
+    (6.5, 'C+', 2.5),
+    (7.0, 'B', 3.0),
+    (8.0, 'B+', 3.5),
+    (8.5, 'A', 4.0),
+)
+# (GPA hệ 10 tối thiểu, xếp loại học lực) - theo ngưỡng tăng dần
+GPA_CLASSES = (
+    (0.0, 'Yếu'),
+    (5.0, 'Trung bình'),
+    (6.5, 'Khá'),
+    (8.0, 'Giỏi'),
+    (9.0, 'Xuất sắc'),
+)
+LETTER_GRADES = tuple(row[1] for row in reversed(GRADE_SCALE)) # A -> F, thứ tự hiển thị
+GPA_CLASS_LABELS = tuple(row[1] for row in GPA_CLASSES)         # Yếu -> Xuất sắc
+
+_GRADE_THRESHOLDS = tuple(row[0] for row in GRADE_SCALE[1:])
+_GPA_CLASS_THRESHOLDS = tuple(row[0] for row in GPA_CLASSES[1:])
+
+
+def _is_missing(value):
+    return value is None or value != value # None hoặc NaN
+
+
 def classify_gpa_10(gpa):
-    if gpa >= 9.0:
-        return "Xuất sắc"
-    elif gpa >= 8.0:
-        return "Giỏi"
-    elif gpa >= 6.5:
-        return "Khá"
-    elif gpa >= 5.0:
-        return "Trung bình"
-    # Kiểm tra None trước khi so sánh
-    elif gpa is None or gpa < 5.0:
-        return "Yếu"
-    else:
-        return "Yếu" # Mặc định
-# ===============================================
+    """Xếp loại học lực theo GPA hệ 10 (chưa có GPA -> Yếu)."""
+    if _is_missing(gpa):
+        return GPA_CLASSES[0][1]
+    return GPA_CLASSES[bisect.bisect_right(_GPA_CLASS_THRESHOLDS, gpa)][1]
+
 
 def convert_10_to_4_scale(diem_10):
+    """Chuyển điểm 10 sang điểm 4 theo GRADE_SCALE (chưa có điểm -> 0.0)."""
+    if _is_missing(diem_10):
+        return 0.0
+    return GRADE_SCALE[bisect.bisect_right(_GRADE_THRESHOLDS, diem_10)][2]
+
+
+def convert_10_to_letter(diem_10):
+    """Chuyển điểm 10 sang điểm chữ theo GRADE_SCALE (chưa có điểm -> None)."""
+    if _is_missing(diem_10):
+        return None
+    return GRADE_SCALE[bisect.bisect_right(_GRADE_THRESHOLDS, diem_10)][1]
+
+
+def convert_scores_bulk(scores):
     """
-    Hàm trợ giúp đề xuất: Chuyển điểm 10 sang điểm 4.
-    (Dựa trên thang điểm tín chỉ thông thường)
-    """
-    # Kiểm tra None trước khi so sánh
-    if diem_10 is None:
-        return 0.0 # Hoặc giá trị mặc định khác
-    if diem_10 >= 8.5:
-        return 4.0  # A
-    elif diem_10 >= 8.0:
-        return 3.5  # B+
-    elif diem_10 >= 7.0:
-        return 3.0  # B
-    elif diem_10 >= 6.5:
-        return 2.5  # C+
-    elif diem_10 >= 5.5:
-        return 2.0  # C
-    elif diem_10 >= 5.0:
-        return 1.5  # D+
-    elif diem_10 >= 4.0:
-        return 1.0  # D
-    else:
-        return 0.0  # F
+    Chuyển hàng loạt điểm hệ 10 bằng np.searchsorted (None/NaN = chưa có điểm).
+    Trả về (điểm chữ: mảng object, None nếu chưa có điểm; điểm hệ 4: mảng float, 0.0 nếu chưa có điểm),
+    khớp từng phần tử với convert_10_to_letter / convert_10_to_4_scale.
+    """
+    import numpy as np # Nạp khi cần để không làm chậm khởi động nguội
+    values = np.asarray(scores, dtype=float)
+    missing = np.isnan(values)
+    bands = np.searchsorted(_GRADE_THRESHOLDS, values, side='right')
+    bands[missing] = 0
+    letters = np.array([row[1] for row in GRADE_SCALE], dtype=object)[bands]
+    letters[missing] = None
+    points_4 = np.array([row[2] for row in GRADE_SCALE], dtype=float)[bands]
+    return letters, points_4
+
+
+def count_letter_grades(scores):
+    """Đếm số điểm theo từng điểm chữ (thứ tự LETTER_GRADES), bỏ qua điểm trống."""
+    import numpy as np
+    values = np.asarray(scores, dtype=float)
+    values = values[~np.isnan(values)]
+    counts = np.bincount(np.searchsorted(_GRADE_THRESHOLDS, values, side='right'), minlength=len(GRADE_SCALE))
+    return {GRADE_SCALE[band][1]: int(counts[band]) for band in reversed(range(len(GRADE_SCALE)))}
+
+
+def count_gpa_classes(gpas):
+    """Đếm số SV theo xếp loại học lực (thứ tự GPA_CLASS_LABELS), bỏ qua GPA trống."""
+    import numpy as np
+    values = np.asarray(gpas, dtype=float)
+    values = values[~np.isnan(values)]
+    counts = np.bincount(np.searchsorted(_GPA_CLASS_THRESHOLDS, values, side='right'), minlength=len(GPA_CLASSES))
+    return {label: int(counts[band]) for band, (_, label) in enumerate(GPA_CLASSES)}
+
+
+def grade_scale_case(diem_10, field):
+    """Biểu thức SQL CASE sinh từ GRADE_SCALE; field = 1 (điểm chữ) hoặc 2 (điểm hệ 4)."""
+    return case(
+        *[(diem_10 >= row[0], row[field]) for row in reversed(GRADE_SCALE[1:])],
+        else_=GRADE_SCALE[0][field]
+    )
+
+
+def diem_he_4_case(diem_10):
+    """Biểu thức SQL CASE chuyển điểm hệ 10 sang hệ 4 (khớp convert_10_to_4_scale, NULL -> 0.0)."""
+    return grade_scale_case(diem_10, 2)
+
+
+def diem_chu_case(diem_10):
+    """Biểu thức SQL CASE chuyển điểm hệ 10 sang điểm chữ (khớp convert_10_to_letter, NULL -> NULL)."""
+    return case((diem_10.is_(None), None), else_=grade_scale_case(diem_10, 1))
+
+
+def gpa_class_count_columns(gpa_10):
+    """Các cột COUNT số SV theo từng xếp loại (thứ tự GPA_CLASSES) để đếm ngay trong câu GROUP BY; GPA NULL không được đếm."""
+    columns = []
+    for band, (lower, _) in enumerate(GPA_CLASSES):
+        conditions = []
+        if band > 0:
+            conditions.append(gpa_10 >= lower)
+        if band + 1 < len(GPA_CLASSES):
+            conditions.append(gpa_10 < GPA_CLASSES[band + 1][0])
+        columns.append(func.count(case((and_(*conditions), 1))).label(f'xep_loai_{band}'))
+    return columns
+# ===============================================
 
 import enum
-import pandas as pd
+import re
+import random
+import datetime
+import unicodedata
+import json
+import uuid
+import tempfile
+import threading
+import hmac
+from collections import OrderedDict, deque
 import io
+import csv
 from flask import send_file
-from flask import Flask, render_template, request, redirect, url_for, flash, abort
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, jsonify
+from flask import g, has_request_context, Response, before_render_template, template_rendered
+from werkzeug.datastructures import FileStorage
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
 from sqlalchemy.sql import func, case, literal_column
-from sqlalchemy import select, and_, text, inspect as sa_inspect
-from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy import select, and_, or_, text, column, inspect as sa_inspect, insert, delete, event, bindparam, exists, true
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import NoSuchTableError, OperationalError, ProgrammingError
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, accumulate
+import click
+
+mark_startup_phase('imports')
 
 # --- 1. CẤU HÌNH ỨNG DỤNG ---
 
@@ -72,7 +180,8 @@ def resolve_database_uri():
     """
     Build a database URI that works locally and on Vercel.
     - Prefer DATABASE_URL when provided (for hosted DBs).
-    - For SQLite on Vercel, copy qlsv.db into /tmp so it is writable.
+    - For SQLite on Vercel, copy qlsv.db into /tmp so it is writable, unless the
+      bundled directory is already writable (then the copy is skipped).
     """
     env_db_url = os.getenv('DATABASE_URL')
     if env_db_url:
@@ -82,7 +191,7 @@ def resolve_database_uri():
 
     sqlite_path = os.path.join(project_root, 'qlsv.db')
     running_on_vercel = os.getenv('VERCEL') or os.getenv('VERCEL_URL')
-    if running_on_vercel:
+    if running_on_vercel and not os.access(project_root, os.W_OK):
         tmp_sqlite_path = os.path.join('/tmp', 'qlsv.db')
         if not os.path.exists(tmp_sqlite_path):
             try:
@@ -106,6 +215,49 @@ app.config['SECRET_KEY'] = 'mot-khoa-bi-mat-rat-manh-theo-yeu-cau-bao-mat'
 app.config['SQLALCHEMY_DATABASE_URI'] = resolve_database_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"pool_pre_ping": True}
+# Hàng đợi công việc nền (nhập/xuất file lớn)
+app.config['JOB_STORAGE_DIR'] = os.getenv('JOB_STORAGE_DIR', os.path.join(tempfile.gettempdir(), 'qlsv_jobs'))
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', '2'))
+# Tắt (JOB_INLINE_WORKER=0) khi chạy worker riêng bằng `flask jobs-worker`
+app.config['JOB_INLINE_WORKER'] = os.getenv('JOB_INLINE_WORKER', '1') == '1'
+# Công việc DANG_CHAY không cập nhật tiến độ quá số phút này (tiến trình chạy nó đã dừng, ví dụ
+# khi reloader khởi động lại) được trả về hàng đợi
+app.config['JOB_STALE_MINUTES'] = int(os.getenv('JOB_STALE_MINUTES', '15'))
+# Độ khó bcrypt cho mật khẩu mặc định khi nhập SV hàng loạt (thấp hơn mặc định 12 của Flask-Bcrypt)
+app.config['BULK_BCRYPT_LOG_ROUNDS'] = int(os.getenv('BULK_BCRYPT_LOG_ROUNDS', '10'))
+# Cache danh tính người dùng đăng nhập (trong tiến trình): số phần tử tối đa và thời gian sống (giây)
+app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', '2048'))
+app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', '60'))
+# Cache dữ liệu dashboard sinh viên (biểu đồ điểm theo SV, thông báo theo lớp)
+app.config['DASHBOARD_CACHE_SIZE'] = int(os.getenv('DASHBOARD_CACHE_SIZE', '4096'))
+app.config['DASHBOARD_CACHE_TTL'] = int(os.getenv('DASHBOARD_CACHE_TTL', '300'))
+# Phân trang danh sách SV: số dòng mặc định/tối đa mỗi trang, thời gian cache tổng số (giây)
+app.config['STUDENT_PAGE_SIZE'] = int(os.getenv('STUDENT_PAGE_SIZE', '50'))
+app.config['STUDENT_PAGE_SIZE_MAX'] = int(os.getenv('STUDENT_PAGE_SIZE_MAX', '500'))
+app.config['STUDENT_COUNT_CACHE_TTL'] = int(os.getenv('STUDENT_COUNT_CACHE_TTL', '60'))
+# Thời gian sống (giây) của cache danh sách lớp/khoa/môn học (giới hạn độ trễ giữa các tiến trình)
+app.config['REFERENCE_CACHE_TTL'] = int(os.getenv('REFERENCE_CACHE_TTL', '300'))
+# Cache kết quả báo cáo (khóa gồm phiên bản dữ liệu nên ghi điểm/SV/môn học làm mục cũ hết hiệu lực)
+app.config['REPORT_CACHE_SIZE'] = int(os.getenv('REPORT_CACHE_SIZE', '256'))
+app.config['REPORT_CACHE_TTL'] = int(os.getenv('REPORT_CACHE_TTL', '300'))
+app.config['MISSING_GRADE_PAGE_SIZE'] = int(os.getenv('MISSING_GRADE_PAGE_SIZE', '100'))
+# Ngưỡng GPA (hệ 10) mặc định của báo cáo xếp hạng / học bổng
+app.config['HIGH_GPA_THRESHOLD'] = float(os.getenv('HIGH_GPA_THRESHOLD', '8.0'))
+# File xuất được giữ trong RAM tới kích thước này (byte) rồi tự chuyển xuống file tạm trên đĩa
+app.config['EXPORT_SPOOL_MAX_SIZE'] = int(os.getenv('EXPORT_SPOOL_MAX_SIZE', str(8 * 1024 * 1024)))
+# Tự áp dụng migration còn thiếu khi khởi động (tắt để chỉ cảnh báo và chạy `flask migrate` thủ công)
+app.config['AUTO_MIGRATE'] = os.getenv('AUTO_MIGRATE', '1') == '1'
+# Đo số truy vấn SQL / thời gian theo route (/admin/metrics, /metrics cho Prometheus)
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '1') == '1'
+# Ghi log truy vấn chậm hơn ngưỡng này (ms); 0 = tắt
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', '200'))
+# Ghi cả giá trị tham số của truy vấn chậm (có thể chứa thông tin cá nhân SV, mã băm mật khẩu);
+# mặc định chỉ ghi số lượng và kiểu tham số
+app.config['SLOW_QUERY_LOG_PARAMS'] = os.getenv('SLOW_QUERY_LOG_PARAMS', '0') == '1'
+# Token cho Prometheus gọi /metrics (header "Authorization: Bearer <token>"); để trống = chỉ giáo viên đã đăng nhập
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+# Thêm header Server-Timing (sql / render / total) vào mọi phản hồi, tiện đo bằng trình duyệt hoặc benchmark
+app.config['METRICS_SERVER_TIMING'] = os.getenv('METRICS_SERVER_TIMING', '0') == '1'
 # =====================
 
 db = SQLAlchemy(app)
@@ -148,20 +300,129 @@ def ensure_teacher_profile_columns():
     db.session.commit()
 
 
+def ensure_course_weight_columns():
+    """Thêm cột trọng số điểm thành phần cho bảng mon_hoc của CSDL cũ (mặc định 20/20/60)."""
+    try:
+        existing_columns = {col['name'] for col in sa_inspect(db.engine).get_columns('mon_hoc')}
+    except NoSuchTableError:
+        return
+    for column_name, default in zip(('trong_so_cc', 'trong_so_gk', 'trong_so_ck'), DEFAULT_GRADE_WEIGHTS):
+        if column_name not in existing_columns:
+            db.session.execute(text(
+                f"ALTER TABLE mon_hoc ADD COLUMN {column_name} FLOAT NOT NULL DEFAULT {default}"
+            ))
+    db.session.commit()
+
+
+def ensure_model_indexes():
+    """Create indexes declared on the models that older databases are missing."""
+    inspector = sa_inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+        existing_indexes = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(db.engine)
+            except Exception as exc:
+                print(f"[Schema update] Could not create index '{index.name}': {exc}")
+
+
 def initialize_database():
-    """Ensure tables exist on cold start (needed for serverless/Vercel)."""
+    """Check the schema version on cold start; migrate only when the database is behind.
+
+    An up-to-date database costs a single ``SELECT MAX(version)``; no table
+    reflection happens on the request path.
+    """
     with app.app_context():
-        db.create_all()
-        ensure_teacher_profile_columns()
+        version = current_schema_version()
+        if version is not None and version >= LATEST_SCHEMA_VERSION:
+            return
+        if not app.config['AUTO_MIGRATE']:
+            print(f"[Schema] CSDL đang ở phiên bản {version or 0}, cần {LATEST_SCHEMA_VERSION}. "
+                  "Chạy `flask --app api.index migrate`.")
+            return
+        for version, name in apply_migrations():
+            print(f"[Schema] Đã áp dụng migration {version}: {name}")
+
+
+class TTLCache:
+    """
+    Bộ nhớ đệm trong tiến trình, an toàn với nhiều thread: giới hạn số phần tử (bỏ
+    phần tử ít dùng nhất) và thời gian sống của mỗi phần tử. Đếm hit/miss để theo dõi.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
 
 
-initialize_database()
 login_manager.login_message = 'Vui lòng đăng nhập để truy cập trang này.'
 login_manager.login_message_category = 'info'
 
+mark_startup_phase('config')
+
 
 # --- 2. ĐỊNH NGHĨA MODEL (CSDL) ---
 # (Giữ nguyên các Model: VaiTroEnum, TaiKhoan, SinhVien, MonHoc, KetQua, ThongBao)
+class VersionCounter:
+    """Số phiên bản theo tên bảng; invalidate() tăng phiên bản (dùng được với invalidate_on_commit)."""
+
+    def __init__(self, *names):
+        self._versions = dict.fromkeys(names, 0)
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        return self._versions[name]
+
+    def invalidate(self, *names):
+        with self._lock:
+            for name in names:
+                self._versions[name] += 1
+
+
 class VaiTroEnum(enum.Enum):
     SINHVIEN = 'SINHVIEN'
     GIAOVIEN = 'GIAOVIEN'
@@ -207,6 +468,12 @@ class SinhVien(db.Model):
 
     ket_qua_list = db.relationship('KetQua', backref='sinh_vien', lazy=True, cascade='all, delete-orphan', foreign_keys='KetQua.ma_sv')
 
+    # Index cho các cột lọc thường dùng (danh sách lớp, nhập điểm, báo cáo)
+    __table_args__ = (
+        db.Index('ix_sinh_vien_lop_ma_sv', 'lop', 'ma_sv'),
+        db.Index('ix_sinh_vien_khoa_lop', 'khoa', 'lop'),
+    )
+
 
 # === MODEL MỚI: GIAO_VIEN (ĐÃ SỬA) ===
 class GiaoVien(db.Model):
@@ -249,6 +516,15 @@ class MonHoc(db.Model):
     hoc_ky = db.Column(db.Integer, nullable=False, default=1) 
     # =====================
 
+    # Trọng số điểm thành phần (chuyên cần / giữa kỳ / cuối kỳ), tổng bằng 1
+    trong_so_cc = db.Column(db.Float, nullable=False, default=0.2, server_default='0.2')
+    trong_so_gk = db.Column(db.Float, nullable=False, default=0.2, server_default='0.2')
+    trong_so_ck = db.Column(db.Float, nullable=False, default=0.6, server_default='0.6')
+
+    @property
+    def weights(self):
+        return (self.trong_so_cc, self.trong_so_gk, self.trong_so_ck)
+
     ket_qua_list = db.relationship('KetQua', backref='mon_hoc', lazy=True, cascade='all, delete-orphan', foreign_keys='KetQua.ma_mh')
 
 class KetQua(db.Model):
@@ -258,49 +534,44 @@ class KetQua(db.Model):
     ma_mh = db.Column(db.String(50), db.ForeignKey('mon_hoc.ma_mh', ondelete='CASCADE'), primary_key=True)
 
     # Điểm thành phần (nullable=True cho phép nhập từ từ)
-    diem_chuyen_can = db.Column(db.Float, nullable=True) # 20%
-    diem_giua_ky = db.Column(db.Float, nullable=True)    # 20%
-    diem_cuoi_ky = db.Column(db.Float, nullable=True)     # 60%
+    # Trọng số lấy theo môn học (MonHoc.trong_so_*), mặc định 20% / 20% / 60%
+    diem_chuyen_can = db.Column(db.Float, nullable=True)
+    diem_giua_ky = db.Column(db.Float, nullable=True)
+    diem_cuoi_ky = db.Column(db.Float, nullable=True)
 
     # Điểm tổng kết (tính toán) - nullable=True vì chỉ tính khi đủ 3 điểm TP
     diem_tong_ket = db.Column(db.Float, nullable=True) # Hệ 10
     diem_chu = db.Column(db.String(2), nullable=True)   # A, B+, B, C+, C, D+, D, F
 
+    # PK là (ma_sv, ma_mh) nên tra cứu theo môn học cần index riêng bắt đầu bằng ma_mh
+    __table_args__ = (
+        db.Index('ix_ket_qua_ma_mh_ma_sv', 'ma_mh', 'ma_sv'),
+    )
+
     # Hàm tính điểm tổng kết và điểm chữ (có thể gọi khi lưu)
     def calculate_final_score(self):
-        # Chỉ tính khi cả 3 điểm thành phần đều đã được nhập (không phải None)
-        if self.diem_chuyen_can is not None and \
-           self.diem_giua_ky is not None and \
-           self.diem_cuoi_ky is not None:
-            # Tính điểm hệ 10
-            final_score_10 = round(
-                (self.diem_chuyen_can * 0.2) +
-                (self.diem_giua_ky * 0.2) +
-                (self.diem_cuoi_ky * 0.6),
-                2 # Làm tròn 2 chữ số thập phân
-            )
-            self.diem_tong_ket = final_score_10
-            # Tính điểm chữ từ điểm hệ 10
-            self.diem_chu = convert_10_to_letter(final_score_10)
-        else:
-            # Nếu chưa đủ điểm, đặt là None
-            self.diem_tong_ket = None
-            self.diem_chu = None
+        weights = self.mon_hoc.weights if self.mon_hoc is not None else DEFAULT_GRADE_WEIGHTS
+        self.diem_tong_ket, self.diem_chu = tinh_diem_tong_ket(
+            self.diem_chuyen_can, self.diem_giua_ky, self.diem_cuoi_ky, weights
+        )
 
-# === THÊM HÀM HELPER CHUYỂN ĐIỂM CHỮ ===
-# Đặt gần các hàm helper khác ở đầu file index.py
-def convert_10_to_letter(diem_10):
-    """Chuyển điểm 10 sang điểm chữ."""
-    if diem_10 is None:
-        return None # Hoặc F tùy quy định
-    if diem_10 >= 8.5: return "A"
-    elif diem_10 >= 8.0: return "B+"
-    elif diem_10 >= 7.0: return "B"
-    elif diem_10 >= 6.5: return "C+"
-    elif diem_10 >= 5.5: return "C"
-    elif diem_10 >= 5.0: return "D+"
-    elif diem_10 >= 4.0: return "D"
-    else: return "F"
+# === HÀM TÍNH ĐIỂM TỔNG KẾT ===
+DEFAULT_GRADE_WEIGHTS = (0.2, 0.2, 0.6) # Chuyên cần / giữa kỳ / cuối kỳ
+
+
+def tinh_diem_tong_ket(diem_cc, diem_gk, diem_ck, weights=DEFAULT_GRADE_WEIGHTS):
+    """Trả về (điểm tổng kết hệ 10, điểm chữ); (None, None) nếu chưa đủ 3 điểm thành phần."""
+    # Chỉ tính khi cả 3 điểm thành phần đều đã được nhập (không phải None)
+    if diem_cc is None or diem_gk is None or diem_ck is None:
+        return None, None
+    trong_so_cc, trong_so_gk, trong_so_ck = weights
+    final_score_10 = round(
+        (diem_cc * trong_so_cc) +
+        (diem_gk * trong_so_gk) +
+        (diem_ck * trong_so_ck),
+        2 # Làm tròn 2 chữ số thập phân
+    )
+    return final_score_10, convert_10_to_letter(final_score_10)
 # ======================================
 
 class ThongBao(db.Model):
@@ -314,22 +585,678 @@ class ThongBao(db.Model):
 
     nguoi_gui = db.relationship('TaiKhoan', backref='thong_bao_da_gui', foreign_keys=[ma_gv])
 
+    __table_args__ = (
+        db.Index('ix_thong_bao_lop_nhan_ngay_gui', 'lop_nhan', 'ngay_gui'), # Dashboard sinh viên
+        db.Index('ix_thong_bao_ngay_gui', 'ngay_gui'),                      # Dashboard giáo viên
+    )
+
+# --- 2.1. BẢNG GPA TỔNG HỢP ---
+# Lưu sẵn tổng (điểm x tín chỉ) và tổng tín chỉ của từng SV (và từng SV theo học kỳ)
+# để báo cáo chỉ phải đọc O(số SV) dòng thay vì GROUP BY toàn bộ bảng ket_qua.
+# Chỉ lưu SV đã có ít nhất một môn có điểm tổng kết.
+class GpaSinhVien(db.Model):
+    __tablename__ = 'gpa_sinh_vien'
+    ma_sv = db.Column(db.String(50), db.ForeignKey('sinh_vien.ma_sv', ondelete='CASCADE'), primary_key=True)
+    tong_diem_10 = db.Column(db.Float, nullable=False, default=0.0) # SUM(diem_tong_ket * so_tin_chi)
+    tong_diem_4 = db.Column(db.Float, nullable=False, default=0.0)  # SUM(diem_he_4 * so_tin_chi)
+    tong_tin_chi = db.Column(db.Integer, nullable=False, default=0)
+    gpa_10 = db.Column(db.Float, nullable=True, index=True)
+    gpa_4 = db.Column(db.Float, nullable=True)
+
+
+class GpaHocKy(db.Model):
+    __tablename__ = 'gpa_hoc_ky'
+    ma_sv = db.Column(db.String(50), db.ForeignKey('sinh_vien.ma_sv', ondelete='CASCADE'), primary_key=True)
+    hoc_ky = db.Column(db.Integer, primary_key=True)
+    tong_diem_10 = db.Column(db.Float, nullable=False, default=0.0)
+    tong_diem_4 = db.Column(db.Float, nullable=False, default=0.0)
+    tong_tin_chi = db.Column(db.Integer, nullable=False, default=0)
+    gpa_10 = db.Column(db.Float, nullable=True)
+    gpa_4 = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_gpa_hoc_ky_hoc_ky_gpa_10', 'hoc_ky', 'gpa_10'), # Xếp hạng theo học kỳ
+    )
+
+
+GPA_REFRESH_CHUNK_SIZE = 500 # Giới hạn số tham số trong mệnh đề IN
+
+# Phiên bản dữ liệu điểm cho cache báo cáo: 'ket_qua' tăng khi thêm/xóa bản ghi điểm,
+# 'gpa' tăng mỗi lần bảng GPA tổng hợp được ghi lại
+grade_versions = VersionCounter('ket_qua', 'gpa')
+
+
+def gpa_aggregate_select(ma_sv_list=None, by_hoc_ky=False):
+    """SELECT tổng hợp GPA theo SV (hoặc theo SV + học kỳ) từ ket_qua JOIN mon_hoc."""
+    total_points_10 = func.sum(KetQua.diem_tong_ket * MonHoc.so_tin_chi)
+    total_points_4 = func.sum(diem_he_4_case(KetQua.diem_tong_ket) * MonHoc.so_tin_chi)
+    total_credits = func.sum(MonHoc.so_tin_chi)
+    group_columns = [KetQua.ma_sv, MonHoc.hoc_ky] if by_hoc_ky else [KetQua.ma_sv]
+
+    stmt = select(
+        *group_columns,
+        total_points_10,
+        total_points_4,
+        total_credits,
+        total_points_10 / total_credits,
+        total_points_4 / total_credits
+    ).select_from(KetQua).join(
+        MonHoc, KetQua.ma_mh == MonHoc.ma_mh
+    ).where(
+        KetQua.diem_tong_ket.isnot(None)
+    )
+    if ma_sv_list is not None:
+        stmt = stmt.where(KetQua.ma_sv.in_(ma_sv_list))
+    return stmt.group_by(*group_columns).having(total_credits > 0)
+
+
+def _write_gpa_aggregates(connection, ma_sv_list=None):
+    """Xóa rồi ghi lại (set-based) các dòng GPA tổng hợp; ma_sv_list=None nghĩa là toàn bộ."""
+    value_columns = ['tong_diem_10', 'tong_diem_4', 'tong_tin_chi', 'gpa_10', 'gpa_4']
+    for model, by_hoc_ky in ((GpaHocKy, True), (GpaSinhVien, False)):
+        table = model.__table__
+        delete_stmt = delete(table)
+        if ma_sv_list is not None:
+            delete_stmt = delete_stmt.where(table.c.ma_sv.in_(ma_sv_list))
+        connection.execute(delete_stmt)
+
+        key_columns = ['ma_sv', 'hoc_ky'] if by_hoc_ky else ['ma_sv']
+        connection.execute(
+            insert(table).from_select(
+                key_columns + value_columns,
+                gpa_aggregate_select(ma_sv_list, by_hoc_ky=by_hoc_ky)
+            )
+        )
+
+
+def refresh_gpa_aggregates(ma_sv_list, connection=None):
+    """Tính lại GPA tổng hợp cho những SV bị ảnh hưởng bởi một lần ghi điểm."""
+    ma_sv_list = sorted({ma_sv for ma_sv in ma_sv_list if ma_sv})
+    if not ma_sv_list:
+        return 0
+    if connection is None:
+        connection = db.session.connection()
+    for start in range(0, len(ma_sv_list), GPA_REFRESH_CHUNK_SIZE):
+        _write_gpa_aggregates(connection, ma_sv_list[start:start + GPA_REFRESH_CHUNK_SIZE])
+    invalidate_on_commit(db.session, grade_versions, ['gpa'])
+    return len(ma_sv_list)
+
+
+def rebuild_gpa_aggregates(connection=None):
+    """Dựng lại toàn bộ bảng GPA tổng hợp từ ket_qua (dùng khi khởi tạo hoặc sửa lệch)."""
+    if connection is None:
+        connection = db.session.connection()
+    _write_gpa_aggregates(connection)
+    invalidate_on_commit(db.session, grade_versions, ['gpa'])
+
+
+@event.listens_for(Session, 'after_flush')
+def sync_gpa_aggregates(session, flush_context):
+    """Sau mỗi flush, tính lại GPA cho các SV có KetQua/MonHoc thay đổi."""
+    affected_ma_sv = set()
+    changed_courses = set()
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, KetQua):
+            state = sa_inspect(obj)
+            if obj in session.dirty and not state.attrs.diem_tong_ket.history.has_changes():
+                continue
+            affected_ma_sv.add(obj.ma_sv)
+        elif isinstance(obj, MonHoc) and obj in session.dirty:
+            # Sửa số tín chỉ / học kỳ làm thay đổi GPA của mọi SV đã học môn này
+            state = sa_inspect(obj)
+            if state.attrs.so_tin_chi.history.has_changes() or state.attrs.hoc_ky.history.has_changes():
+                changed_courses.add(obj.ma_mh)
+
+    connection = session.connection()
+    if changed_courses:
+        affected_ma_sv.update(connection.execute(
+            select(KetQua.ma_sv).where(KetQua.ma_mh.in_(changed_courses))
+        ).scalars())
+
+    refresh_gpa_aggregates(affected_ma_sv, connection=connection)
+
+
+def ensure_gpa_aggregates():
+    """Điền bảng GPA tổng hợp cho CSDL cũ (bảng vừa được tạo nhưng còn trống)."""
+    has_aggregates = db.session.query(GpaSinhVien.ma_sv).limit(1).first()
+    if has_aggregates:
+        return
+    has_final_scores = db.session.query(KetQua.ma_sv).filter(KetQua.diem_tong_ket.isnot(None)).limit(1).first()
+    if not has_final_scores:
+        return
+    rebuild_gpa_aggregates()
+    db.session.commit()
+
+
+def verify_gpa_aggregates():
+    """
+    So sánh bảng GPA tổng hợp với GPA tính lại từ đầu (calculate_gpa_expression).
+    Trả về danh sách (ma_sv, gpa_luu, gpa_tinh_lai) bị lệch.
+    """
+    expected = {
+        row.ma_sv: (row.gpa, row.gpa_4)
+        for row in db.session.query(
+            KetQua.ma_sv, calculate_gpa_expression(), calculate_gpa_4_expression()
+        ).join(
+            MonHoc, KetQua.ma_mh == MonHoc.ma_mh
+        ).group_by(KetQua.ma_sv).all()
+        if row.gpa is not None
+    }
+    stored = {
+        row.ma_sv: (row.gpa_10, row.gpa_4)
+        for row in db.session.query(GpaSinhVien.ma_sv, GpaSinhVien.gpa_10, GpaSinhVien.gpa_4).all()
+    }
+
+    def same(a, b):
+        if a is None or b is None:
+            return a is b
+        return abs(a - b) < 1e-6
+
+    drift = []
+    for ma_sv in sorted(expected.keys() | stored.keys()):
+        stored_gpa = stored.get(ma_sv, (None, None))
+        expected_gpa = expected.get(ma_sv, (None, None))
+        if not (same(stored_gpa[0], expected_gpa[0]) and same(stored_gpa[1], expected_gpa[1])):
+            drift.append((ma_sv, stored_gpa, expected_gpa))
+    return drift
+
+
+# --- 2.2. HÀNG ĐỢI CÔNG VIỆC NỀN ---
+# Nhập/xuất file lớn chạy ngoài request: bảng cong_viec_nen là hàng đợi (không cần broker),
+# một thread pool trong tiến trình web (hoặc lệnh `flask jobs-worker`) lấy việc ra xử lý.
+class TrangThaiJobEnum(enum.Enum):
+    CHO_XU_LY = 'CHO_XU_LY'
+    DANG_CHAY = 'DANG_CHAY'
+    HOAN_THANH = 'HOAN_THANH'
+    THAT_BAI = 'THAT_BAI'
+
+
+class CongViecNen(db.Model):
+    __tablename__ = 'cong_viec_nen'
+    id = db.Column(db.String(32), primary_key=True)
+    loai = db.Column(db.String(50), nullable=False) # Khóa trong JOB_HANDLERS
+    trang_thai = db.Column(db.Enum(TrangThaiJobEnum), nullable=False, default=TrangThaiJobEnum.CHO_XU_LY, index=True)
+    tham_so = db.Column(db.Text, nullable=True)          # JSON
+    tep_dau_vao = db.Column(db.String(255), nullable=True) # Tên tệp tải lên gốc
+    so_dong_da_xu_ly = db.Column(db.Integer, nullable=False, default=0)
+    tien_do = db.Column(db.Integer, nullable=False, default=0) # Phần trăm
+    thong_diep = db.Column(db.Text, nullable=True)
+    bao_cao_loi = db.Column(db.Text, nullable=True)      # JSON: danh sách lỗi theo dòng
+    tep_ket_qua = db.Column(db.String(255), nullable=True) # Tên file tải về
+    mimetype_ket_qua = db.Column(db.String(120), nullable=True)
+    nguoi_tao = db.Column(db.String(50), db.ForeignKey('tai_khoan.username', ondelete='SET NULL'), nullable=True)
+    ngay_tao = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    ngay_cap_nhat = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    @property
+    def da_ket_thuc(self):
+        return self.trang_thai in (TrangThaiJobEnum.HOAN_THANH, TrangThaiJobEnum.THAT_BAI)
+
+    @property
+    def danh_sach_loi(self):
+        return json.loads(self.bao_cao_loi) if self.bao_cao_loi else []
+
+
+JOB_HANDLERS = {} # loai -> hàm xử lý(job, params, input_file, progress)
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+
+def job_handler(loai):
+    """Đăng ký hàm xử lý cho một loại công việc nền."""
+    def decorator(f):
+        JOB_HANDLERS[loai] = f
+        return f
+    return decorator
+
+
+def job_storage_path(job_id, name):
+    job_dir = os.path.join(app.config['JOB_STORAGE_DIR'], job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    return os.path.join(job_dir, name)
+
+
+def _get_job_executor():
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(
+                max_workers=app.config['JOB_WORKERS'], thread_name_prefix='qlsv-job'
+            )
+        return _job_executor
+
+
+def enqueue_job(loai, params=None, upload=None):
+    """Ghi công việc vào hàng đợi (kèm tệp tải lên nếu có) và trả về mã công việc."""
+    job = CongViecNen(
+        id=uuid.uuid4().hex,
+        loai=loai,
+        tham_so=json.dumps(params or {}),
+        nguoi_tao=current_user.username if current_user and current_user.is_authenticated else None
+    )
+    if upload is not None:
+        upload.save(job_storage_path(job.id, 'input'))
+        job.tep_dau_vao = upload.filename
+    db.session.add(job)
+    db.session.commit()
+
+    if app.config['JOB_INLINE_WORKER']:
+        _get_job_executor().submit(run_job, job.id)
+    return job.id
+
+
+def claim_job(job_id=None):
+    """
+    Nhận một công việc CHO_XU_LY (cũ nhất nếu không chỉ định) bằng một câu UPDATE có điều kiện,
+    để nhiều worker không xử lý trùng. Trả về mã công việc hoặc None.
+    """
+    if job_id is None:
+        job_id = db.session.execute(
+            select(CongViecNen.id)
+            .where(CongViecNen.trang_thai == TrangThaiJobEnum.CHO_XU_LY)
+            .order_by(CongViecNen.ngay_tao)
+            .limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+
+    result = db.session.execute(
+        CongViecNen.__table__.update()
+        .where(CongViecNen.id == job_id, CongViecNen.trang_thai == TrangThaiJobEnum.CHO_XU_LY)
+        .values(trang_thai=TrangThaiJobEnum.DANG_CHAY)
+    )
+    db.session.commit()
+    return job_id if result.rowcount == 1 else None
+
+
+def release_stale_jobs():
+    """
+    Trả các công việc DANG_CHAY quá JOB_STALE_MINUTES không cập nhật tiến độ về CHO_XU_LY
+    (tiến trình đã nhận chúng không còn chạy). Trả về số công việc được trả lại.
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(
+        minutes=app.config['JOB_STALE_MINUTES']
+    )
+    result = db.session.execute(
+        CongViecNen.__table__.update()
+        .where(CongViecNen.trang_thai == TrangThaiJobEnum.DANG_CHAY, CongViecNen.ngay_cap_nhat < cutoff)
+        .values(trang_thai=TrangThaiJobEnum.CHO_XU_LY,
+                thong_diep='Tiến trình xử lý đã dừng, công việc được xếp hàng lại.')
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+_jobs_recovered = False
+_jobs_recovered_lock = threading.Lock()
+
+
+def recover_inline_jobs():
+    """
+    Chạy một lần mỗi tiến trình web (ở request đầu tiên): trả lại công việc bị bỏ dở và gửi
+    các công việc CHO_XU_LY vào thread pool, vì hàng đợi trong tiến trình mất khi khởi động lại.
+    """
+    global _jobs_recovered
+    if _jobs_recovered:
+        return
+    with _jobs_recovered_lock:
+        if _jobs_recovered:
+            return
+        _jobs_recovered = True
+        released = release_stale_jobs()
+        if not app.config['JOB_INLINE_WORKER']:
+            return
+        queued = db.session.execute(
+            select(CongViecNen.id)
+            .where(CongViecNen.trang_thai == TrangThaiJobEnum.CHO_XU_LY)
+            .order_by(CongViecNen.ngay_tao)
+        ).scalars().all()
+        db.session.commit()
+        for job_id in queued:
+            _get_job_executor().submit(run_job, job_id)
+        if queued or released:
+            print(f"[Jobs] Đã trả lại {released} công việc bị bỏ dở, xếp hàng lại {len(queued)} công việc")
+
+
+app.before_request(recover_inline_jobs)
+
+
+def run_job(job_id):
+    """Chạy một công việc đã xếp hàng (trong thread pool hoặc worker CLI)."""
+    with app.app_context():
+        if claim_job(job_id) is None:
+            return
+        job = CongViecNen.query.get(job_id)
+
+        def progress(so_dong=None, tien_do=None, thong_diep=None):
+            # Commit cùng lô dữ liệu vừa ghi để trang trạng thái thấy tiến độ; nếu công việc
+            # lỗi giữa chừng, so_dong_da_xu_ly cho biết các dòng đã được lưu
+            if so_dong is not None:
+                job.so_dong_da_xu_ly = so_dong
+                job.thong_diep = f'Đã xử lý {so_dong} dòng...'
+            if tien_do is not None:
+                job.tien_do = tien_do
+            if thong_diep is not None:
+                job.thong_diep = thong_diep
+            db.session.commit()
+
+        input_file = None
+        input_path = job_storage_path(job_id, 'input')
+        if job.tep_dau_vao and os.path.exists(input_path):
+            input_file = FileStorage(stream=open(input_path, 'rb'), filename=job.tep_dau_vao)
+
+        try:
+            result = JOB_HANDLERS[job.loai](job, json.loads(job.tham_so or '{}'), input_file, progress)
+
+            result_file = result.get('file')
+            if result_file is not None:
+                output, download_name, mimetype = result_file
+                with output, open(job_storage_path(job_id, 'result'), 'wb') as fh:
+                    shutil.copyfileobj(output, fh)
+                job.tep_ket_qua = download_name
+                job.mimetype_ket_qua = mimetype
+
+            errors = result.get('errors') or []
+            job.bao_cao_loi = json.dumps(errors, ensure_ascii=False) if errors else None
+            job.thong_diep = result.get('message')
+            job.tien_do = 100
+            job.trang_thai = TrangThaiJobEnum.HOAN_THANH
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            job = CongViecNen.query.get(job_id)
+            job.trang_thai = TrangThaiJobEnum.THAT_BAI
+            job.thong_diep = f'Đã xảy ra lỗi nghiêm trọng: {exc}'
+            if job.so_dong_da_xu_ly:
+                # Các lô trước đó đã được commit cùng tiến độ, không bị hoàn tác
+                job.thong_diep += (f'. Lưu ý: {job.so_dong_da_xu_ly} dòng đầu của tệp đã được lưu trước khi lỗi xảy ra;'
+                                   ' các dòng sau chưa được nhập.')
+            db.session.commit()
+        finally:
+            if input_file is not None:
+                input_file.close()
+
+
+# --- 2.3. CHỈ MỤC TÌM KIẾM SINH VIÊN (FTS5) ---
+# Bảng ảo FTS5 chứa mã SV và họ tên, token được bỏ dấu (unicode61 remove_diacritics 2;
+# riêng đ/Đ không phải dấu nên đổi thành d/D trước khi đánh chỉ mục). rowid của bảng
+# FTS trùng rowid của sinh_vien và trigger giữ đồng bộ với mọi thao tác thêm/sửa/xóa,
+# kể cả INSERT Core khi nhập hàng loạt. VACUUM có thể đánh số lại rowid của sinh_vien:
+# chạy `flask search-rebuild` sau khi VACUUM. CSDL không có FTS5 (PostgreSQL) dùng ILIKE.
+def _fold_d_sql(expr):
+    return f"replace(replace({expr}, 'đ', 'd'), 'Đ', 'D')"
+
+
+STUDENT_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS sinh_vien_fts USING fts5("
+    "ma_sv, ho_ten, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS sinh_vien_fts_ai AFTER INSERT ON sinh_vien BEGIN "
+    f"INSERT INTO sinh_vien_fts(rowid, ma_sv, ho_ten) VALUES (new.rowid, new.ma_sv, {_fold_d_sql('new.ho_ten')}); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS sinh_vien_fts_ad AFTER DELETE ON sinh_vien BEGIN "
+    "DELETE FROM sinh_vien_fts WHERE rowid = old.rowid; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS sinh_vien_fts_au AFTER UPDATE OF ma_sv, ho_ten ON sinh_vien BEGIN "
+    "DELETE FROM sinh_vien_fts WHERE rowid = old.rowid; "
+    f"INSERT INTO sinh_vien_fts(rowid, ma_sv, ho_ten) VALUES (new.rowid, new.ma_sv, {_fold_d_sql('new.ho_ten')}); "
+    "END",
+]
+
+_SEARCH_TOKEN_RE = re.compile(r'\w+')
+_student_search_ready = None
+
+
+def rebuild_student_search_index():
+    """Tạo bảng FTS5 + trigger (nếu chưa có) và nạp lại toàn bộ từ sinh_vien. Trả về False nếu không hỗ trợ FTS5."""
+    global _student_search_ready
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        for ddl in STUDENT_SEARCH_DDL:
+            db.session.execute(text(ddl))
+    except OperationalError as exc:
+        db.session.rollback()
+        print(f"[Search] FTS5 unavailable ({exc}), student search falls back to ILIKE")
+        return False
+
+    db.session.execute(text("DELETE FROM sinh_vien_fts"))
+    db.session.execute(text(
+        f"INSERT INTO sinh_vien_fts(rowid, ma_sv, ho_ten) SELECT rowid, ma_sv, {_fold_d_sql('ho_ten')} FROM sinh_vien"
+    ))
+    db.session.commit()
+    _student_search_ready = True
+    return True
+
+
+def student_search_available():
+    """Bảng sinh_vien_fts có sẵn hay không (chỉ kiểm tra một lần mỗi tiến trình)."""
+    global _student_search_ready
+    if _student_search_ready is None:
+        _student_search_ready = db.engine.dialect.name == 'sqlite' and db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sinh_vien_fts'"
+        )).first() is not None
+    return _student_search_ready
+
+
+def fts_prefix_query(columns, keyword):
+    """
+    Dựng biểu thức MATCH: mỗi từ khóa khớp theo tiền tố (AND), giới hạn trong các cột cho trước.
+    Trả về None nếu từ khóa không có chữ/số nào.
+    """
+    tokens = _SEARCH_TOKEN_RE.findall((keyword or '').replace('đ', 'd').replace('Đ', 'D'))
+    if not tokens:
+        return None
+    return '{%s} : (%s)' % (' '.join(columns), ' AND '.join(f'"{token}"*' for token in tokens))
+
+
+def student_search_conditions(search_ma_sv='', search_ho_ten=''):
+    """
+    Điều kiện WHERE cho ô tìm theo mã SV / họ tên. Mã SV luôn khớp chuỗi con trên khóa chính
+    (tìm "007" ra B22DCVT007); họ tên dùng FTS5 (không dấu, theo tiền tố) hoặc ILIKE.
+    """
+    conditions = []
+    if search_ma_sv:
+        conditions.append(SinhVien.ma_sv.ilike(f'%{search_ma_sv}%'))
+    if not search_ho_ten:
+        return conditions
+    if not student_search_available():
+        conditions.append(SinhVien.ho_ten.ilike(f'%{search_ho_ten}%'))
+        return conditions
+
+    match = fts_prefix_query(['ho_ten'], search_ho_ten)
+    if match is not None:
+        matching_rowids = text(
+            "SELECT rowid FROM sinh_vien_fts WHERE sinh_vien_fts MATCH :search_match"
+        ).bindparams(search_match=match).columns(column('rowid'))
+        conditions.append(literal_column('sinh_vien.rowid').in_(matching_rowids))
+    return conditions
+
+
+def search_students(keyword, limit=20):
+    """
+    Tìm SV theo mã hoặc họ tên, xếp hạng theo bm25 (FTS5) hoặc theo mã SV (ILIKE).
+    Với FTS5, SV có mã chứa từ khóa ở giữa (số thứ tự cuối mã) được thêm sau các kết quả xếp hạng.
+    """
+    if student_search_available():
+        match = fts_prefix_query(['ma_sv', 'ho_ten'], keyword)
+        if match is None:
+            return []
+        statement = text(
+            "SELECT sinh_vien.* FROM sinh_vien_fts "
+            "JOIN sinh_vien ON sinh_vien.rowid = sinh_vien_fts.rowid "
+            "WHERE sinh_vien_fts MATCH :search_match "
+            "ORDER BY bm25(sinh_vien_fts) LIMIT :limit"
+        ).bindparams(search_match=match, limit=limit)
+        students = db.session.execute(select(SinhVien).from_statement(statement)).scalars().all()
+        if len(students) < limit:
+            found = [sv.ma_sv for sv in students]
+            students += SinhVien.query.filter(
+                SinhVien.ma_sv.ilike(f'%{keyword}%'), SinhVien.ma_sv.notin_(found)
+            ).order_by(SinhVien.ma_sv).limit(limit - len(students)).all()
+        return students
+
+    pattern = f'%{keyword}%'
+    return SinhVien.query.filter(
+        or_(SinhVien.ma_sv.ilike(pattern), SinhVien.ho_ten.ilike(pattern))
+    ).order_by(SinhVien.ma_sv).limit(limit).all()
+
+
+# --- 2.4. PHIÊN BẢN SCHEMA & MIGRATION ---
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    ten = db.Column(db.String(100), nullable=False)
+    ngay_ap_dung = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+
+# (version, tên, hàm) theo thứ tự áp dụng. Mỗi bước phải idempotent: CSDL cũ
+# chưa có bảng schema_version sẽ chạy lại từ bước 1 trên các bảng đã tồn tại.
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def decorator(f):
+        MIGRATIONS.append((version, name, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return decorator
+
+
+@migration(1, 'create_tables')
+def _migrate_create_tables():
+    db.create_all()
+
+
+@migration(2, 'teacher_profile_columns')
+def _migrate_teacher_profile_columns():
+    ensure_teacher_profile_columns()
+
+
+@migration(3, 'hot_filter_indexes')
+def _migrate_hot_filter_indexes():
+    ensure_model_indexes()
+
+
+@migration(4, 'gpa_aggregates_backfill')
+def _migrate_gpa_aggregates_backfill():
+    ensure_gpa_aggregates()
+
+
+@migration(5, 'student_search_index')
+def _migrate_student_search_index():
+    rebuild_student_search_index()
+
+
+@migration(6, 'course_grade_weights')
+def _migrate_course_grade_weights():
+    ensure_course_weight_columns()
+
+
+@migration(7, 'gpa_ranking_indexes')
+def _migrate_gpa_ranking_indexes():
+    ensure_model_indexes()
+
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_schema_version():
+    """Trả về phiên bản schema hiện tại, hoặc None nếu CSDL chưa có bảng schema_version."""
+    try:
+        return db.session.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        db.session.rollback()
+        return None
+
+
+def apply_migrations(target=None):
+    """Áp dụng các migration còn thiếu theo thứ tự; trả về danh sách (version, tên) đã chạy."""
+    current = current_schema_version()
+    if current is None:
+        SchemaVersion.__table__.create(db.engine, checkfirst=True)
+        current = 0
+
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        step()
+        db.session.add(SchemaVersion(version=version, ten=name))
+        db.session.commit()
+        applied.append((version, name))
+    return applied
+
+
+mark_startup_phase('models')
+initialize_database()
+mark_startup_phase('schema_check')
+
 # --- 3. LOGIC XÁC THỰC VÀ PHÂN QUYỀN ---
+# Tài khoản + hồ sơ SV/GV được cache theo username; bản cache nằm ngoài mọi session
+# và mỗi request nhận một bản sao qua merge(load=False) nên không phát sinh truy vấn.
+user_cache = TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+
+def _load_identity(user_id):
+    """Nạp tài khoản kèm hồ sơ trong một session riêng để bản cache không bị expire theo request."""
+    with Session(db.engine, expire_on_commit=False) as session:
+        return session.get(TaiKhoan, user_id, options=[
+            joinedload(TaiKhoan.sinh_vien), joinedload(TaiKhoan.giao_vien)
+        ])
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return TaiKhoan.query.get(user_id)
+    account = user_cache.get(user_id)
+    if account is None:
+        account = _load_identity(user_id)
+        if account is None:
+            return None
+        user_cache.set(user_id, account)
+    return db.session.merge(account, load=False)
+
+
+def _identity_keys(objects):
+    keys = set()
+    for obj in objects:
+        if isinstance(obj, TaiKhoan):
+            keys.add(obj.username)
+        elif isinstance(obj, SinhVien):
+            keys.add(obj.ma_sv)
+        elif isinstance(obj, GiaoVien):
+            keys.add(obj.ma_gv)
+    return keys
+
+
+def invalidate_on_commit(session, cache, keys):
+    """
+    Bỏ các khóa khỏi cache ngay, rồi bỏ thêm lần nữa khi session commit, phòng
+    request khác nạp lại dữ liệu cũ vào cache giữa lúc flush và commit.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    cache.invalidate(*keys)
+    session.info.setdefault('cache_invalidations', []).append((cache, keys))
 
 
-_TEACHER_SCHEMA_PATCHED = False
+@event.listens_for(Session, 'after_flush')
+def invalidate_identity_cache(session, flush_context):
+    """Bỏ cache danh tính khi tài khoản/hồ sơ bị sửa (kể cả đổi mật khẩu) hoặc bị xóa."""
+    invalidate_on_commit(session, user_cache, _identity_keys(chain(session.new, session.dirty, session.deleted)))
 
 
-@app.before_request
-def apply_schema_patches():
-    global _TEACHER_SCHEMA_PATCHED
-    if _TEACHER_SCHEMA_PATCHED:
-        return
-    ensure_teacher_profile_columns()
-    _TEACHER_SCHEMA_PATCHED = True
+@event.listens_for(Session, 'after_commit')
+def apply_cache_invalidations(session):
+    for cache, keys in session.info.pop('cache_invalidations', ()):
+        cache.invalidate(*keys)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_cache_invalidations(session):
+    session.info.pop('cache_invalidations', None)
+
 
 def role_required(vai_tro_enum):
     def decorator(f):
@@ -347,6 +1274,62 @@ def role_required(vai_tro_enum):
 def forbidden_page(e):
     return render_template('403.html'), 403
 
+# === DỮ LIỆU THAM CHIẾU (LỚP, KHOA, MÔN HỌC) CHO CÁC Ô CHỌN ===
+# Khóa cache gồm phiên bản của bảng nguồn: ghi vào sinh_vien/mon_hoc làm tăng phiên bản,
+# các mục cũ không bao giờ được đọc lại và tự bị đẩy ra khỏi cache.
+reference_versions = VersionCounter('sinh_vien', 'mon_hoc')
+reference_cache = TTLCache(32, app.config['REFERENCE_CACHE_TTL'])
+
+
+def _cached_reference(name, table, loader):
+    key = (name, reference_versions[table])
+    value = reference_cache.get(key)
+    if value is None:
+        value = loader()
+        reference_cache.set(key, value)
+    return value
+
+
+def list_classes():
+    """Danh sách lớp (khác rỗng) có sinh viên, đã sắp xếp."""
+    return _cached_reference('lop', 'sinh_vien', lambda: tuple(
+        lop for lop in db.session.execute(select(SinhVien.lop).distinct().order_by(SinhVien.lop)).scalars() if lop
+    ))
+
+
+def list_faculties():
+    """Danh sách khoa (khác rỗng) có sinh viên, đã sắp xếp."""
+    return _cached_reference('khoa', 'sinh_vien', lambda: tuple(
+        khoa for khoa in db.session.execute(select(SinhVien.khoa).distinct().order_by(SinhVien.khoa)).scalars() if khoa
+    ))
+
+
+def list_courses():
+    """Danh mục môn học (ma_mh, ten_mh, so_tin_chi, hoc_ky) sắp theo tên, dạng Row chỉ đọc."""
+    return _cached_reference('mon_hoc', 'mon_hoc', lambda: tuple(db.session.execute(
+        select(MonHoc.ma_mh, MonHoc.ten_mh, MonHoc.so_tin_chi, MonHoc.hoc_ky).order_by(MonHoc.ten_mh)
+    ).all()))
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_reference_data(session, flush_context):
+    """Tăng phiên bản dữ liệu tham chiếu khi sinh viên hoặc môn học được thêm/sửa/xóa."""
+    changed_tables = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, SinhVien):
+            table, columns = 'sinh_vien', ('lop', 'khoa')
+        elif isinstance(obj, MonHoc):
+            table, columns = 'mon_hoc', ('ten_mh', 'so_tin_chi', 'hoc_ky')
+        else:
+            continue
+        # SV/môn học chỉ "dirty" vì danh sách KetQua thay đổi thì không ảnh hưởng các ô chọn
+        if obj in session.dirty and not any(
+                sa_inspect(obj).attrs[name].history.has_changes() for name in columns):
+            continue
+        changed_tables.add(table)
+    invalidate_on_commit(session, reference_versions, changed_tables)
+
+
 # --- 4. CÁC ROUTE (CHỨC NĂNG) ---
 # (Giữ nguyên các route: home, login, logout, student_dashboard, student_profile, student_grades,
 #  admin_dashboard, admin_manage_students, admin_add_student, admin_edit_student, admin_delete_student,
@@ -391,47 +1374,93 @@ def logout():
     return redirect(url_for('login'))
 
 # 4.2. Chức năng của Sinh viên
+# Dữ liệu dashboard SV dựng sẵn: biểu đồ điểm theo SV, 10 thông báo mới nhất theo lớp.
+# Bỏ cache khi KetQua của SV hoặc ThongBao của lớp thay đổi (xem các listener bên dưới).
+dashboard_cache = TTLCache(app.config['DASHBOARD_CACHE_SIZE'], app.config['DASHBOARD_CACHE_TTL'])
+notification_cache = TTLCache(app.config['DASHBOARD_CACHE_SIZE'], app.config['DASHBOARD_CACHE_TTL'])
+# Bảng điểm theo học kỳ của từng SV; bỏ cache cùng lúc với biểu đồ dashboard của SV đó
+transcript_cache = TTLCache(app.config['DASHBOARD_CACHE_SIZE'], app.config['DASHBOARD_CACHE_TTL'])
+DASHBOARD_NOTIFICATION_LIMIT = 10
+
+
+def invalidate_student_grade_caches(session, ma_sv_list):
+    """Bỏ cache biểu đồ dashboard và bảng điểm của các SV có điểm thay đổi."""
+    ma_sv_list = list(ma_sv_list)
+    invalidate_on_commit(session, dashboard_cache, ma_sv_list)
+    invalidate_on_commit(session, transcript_cache, ma_sv_list)
+
+
+def student_chart_payload(ma_sv):
+    """Nhãn (mã môn) và điểm tổng kết của các môn đã có điểm, dùng cho biểu đồ dashboard."""
+    payload = dashboard_cache.get(ma_sv)
+    if payload is None:
+        rows = db.session.execute(
+            select(KetQua.ma_mh, KetQua.diem_tong_ket)
+            .where(KetQua.ma_sv == ma_sv, KetQua.diem_tong_ket.isnot(None))
+            .order_by(KetQua.ma_mh)
+        ).all()
+        payload = {
+            'chart_labels': [row.ma_mh for row in rows],
+            'chart_data': [float(row.diem_tong_ket) for row in rows],
+        }
+        dashboard_cache.set(ma_sv, payload)
+    return payload
+
+
+def class_notifications(lop):
+    """Các thông báo mới nhất gửi tới lớp, dạng dict (không gắn với session)."""
+    notifications = notification_cache.get(lop)
+    if notifications is None:
+        rows = db.session.execute(
+            select(ThongBao.id, ThongBao.tieu_de, ThongBao.ma_gv, ThongBao.ngay_gui)
+            .where(ThongBao.lop_nhan == lop)
+            .order_by(ThongBao.ngay_gui.desc())
+            .limit(DASHBOARD_NOTIFICATION_LIMIT)
+        ).all()
+        notifications = [row._asdict() for row in rows]
+        notification_cache.set(lop, notifications)
+    return notifications
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_dashboard_cache(session, flush_context):
+    """Bỏ cache dashboard của SV có KetQua thay đổi và của lớp có ThongBao thay đổi."""
+    changed_ma_sv = set()
+    changed_lop = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, KetQua):
+            changed_ma_sv.add(obj.ma_sv)
+        elif isinstance(obj, ThongBao):
+            changed_lop.add(obj.lop_nhan)
+            history = sa_inspect(obj).attrs.lop_nhan.history
+            changed_lop.update(history.deleted or ())
+        elif isinstance(obj, MonHoc) and obj in session.deleted:
+            # Xóa môn học kéo theo xóa KetQua của nhiều SV: bỏ toàn bộ cache biểu đồ và bảng điểm
+            dashboard_cache.clear()
+            transcript_cache.clear()
+    invalidate_student_grade_caches(session, changed_ma_sv)
+    invalidate_on_commit(session, notification_cache, changed_lop)
+
+
 @app.route('/student/dashboard')
 @login_required
 @role_required(VaiTroEnum.SINHVIEN)
 def student_dashboard():
+    # Hồ sơ lấy từ cache danh tính (identity map), không phát sinh truy vấn
     sinh_vien = SinhVien.query.get(current_user.username)
-    ma_sv = current_user.username
-
-    # Lấy điểm và tạo dữ liệu biểu đồ
-    results = db.session.query(
-        MonHoc.ma_mh,
-        KetQua.diem_tong_ket,
-        KetQua.diem_chu
-    ).join(
-        KetQua, MonHoc.ma_mh == KetQua.ma_mh
-    ).filter(
-        KetQua.ma_sv == ma_sv
-    ).order_by(MonHoc.ma_mh).all()
-
-    chart_points = [
-        (row.ma_mh, float(row.diem_tong_ket))
-        for row in results
-        if row.diem_tong_ket is not None
-    ]
-    chart_labels = [label for label, _ in chart_points]
-    chart_data = [score for _, score in chart_points]
+    payload = student_chart_payload(current_user.username)
 
-    # Lấy thông báo
+    # Thông báo được cache theo lớp, dùng chung cho mọi SV trong lớp
     notifications = []
     if sinh_vien and sinh_vien.lop:
-        notifications = ThongBao.query.filter_by(
-            lop_nhan=sinh_vien.lop
-        ).order_by(
-            ThongBao.ngay_gui.desc()
-        ).limit(10).all()
+        notifications = class_notifications(sinh_vien.lop)
 
     return render_template(
         'student_dashboard.html',
         sinh_vien=sinh_vien,
         notifications=notifications,
-        chart_labels=chart_labels,
-        chart_data=chart_data
+        chart_labels=payload['chart_labels'],
+        chart_data=payload['chart_data']
     )
 
 @app.route('/student/profile', methods=['GET', 'POST'])
@@ -460,104 +1489,86 @@ def student_profile():
 
     return render_template('student_profile.html', sv=sinh_vien)
 
-@app.route('/student/grades')
-@login_required
-@role_required(VaiTroEnum.SINHVIEN)
-def student_grades():
-    ma_sv = current_user.username
-    
-    # Lấy tất cả thông tin điểm và môn học, sắp xếp theo HỌC KỲ
-    results_raw = db.session.query(
-        MonHoc.ma_mh,
-        MonHoc.ten_mh,
-        MonHoc.so_tin_chi,
-        MonHoc.hoc_ky, # Lấy thông tin học kỳ
-        KetQua.diem_chuyen_can,
-        KetQua.diem_giua_ky,
-        KetQua.diem_cuoi_ky,
-        KetQua.diem_tong_ket,
-        KetQua.diem_chu
-    ).select_from(MonHoc).join(
-        KetQua, and_(MonHoc.ma_mh == KetQua.ma_mh, KetQua.ma_sv == ma_sv), isouter=True
-    ).order_by(MonHoc.hoc_ky, MonHoc.ma_mh).all() # Sắp xếp theo học kỳ
-
-    # Khởi tạo biến cho GPA tích lũy
-    total_points_10_cumulative = 0
-    total_points_4_cumulative = 0
-    total_credits_cumulative = 0
-    
-    # Cấu trúc dữ liệu mới để nhóm theo học kỳ
-    semesters_data = {} # Ví dụ: { 1: { 'grades': [], 'gpa_10': 0, ... }, 2: ... }
+def student_transcript(ma_sv):
+    """
+    Bảng điểm theo học kỳ của SV, dạng dict truyền thẳng cho template student_grades.html.
+    Chỉ đọc các bản ghi ket_qua của SV (không quét cả danh mục môn học); GPA học kỳ / tích lũy
+    lấy từ bảng GPA tổng hợp (GROUP BY theo học kỳ, đã tính sẵn khi ghi điểm).
+    Cache theo SV, kèm phiên bản mon_hoc để đổi tên / số tín chỉ / học kỳ của môn cũng có hiệu lực.
+    """
+    version = reference_versions['mon_hoc']
+    cached = transcript_cache.get(ma_sv)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    rows = db.session.execute(
+        select(
+            MonHoc.hoc_ky,
+            KetQua.ma_mh,
+            MonHoc.ten_mh,
+            MonHoc.so_tin_chi,
+            KetQua.diem_chuyen_can,
+            KetQua.diem_giua_ky,
+            KetQua.diem_cuoi_ky,
+            KetQua.diem_tong_ket,
+            KetQua.diem_chu
+        ).select_from(KetQua).join(MonHoc, KetQua.ma_mh == MonHoc.ma_mh)
+        .where(KetQua.ma_sv == ma_sv)
+        .order_by(MonHoc.hoc_ky, KetQua.ma_mh)
+    ).all()
+    gpa_hoc_ky = {
+        row.hoc_ky: row
+        for row in db.session.execute(
+            select(GpaHocKy.hoc_ky, GpaHocKy.gpa_10, GpaHocKy.gpa_4).where(GpaHocKy.ma_sv == ma_sv)
+        )
+    }
+    gpa_tich_luy = db.session.execute(
+        select(GpaSinhVien.gpa_10, GpaSinhVien.gpa_4).where(GpaSinhVien.ma_sv == ma_sv)
+    ).first()
 
-    chart_labels = [] # Dữ liệu cho biểu đồ (vẫn dùng chung)
+    semesters_data = {} # Ví dụ: { 1: { 'grades': [], 'gpa_10': 0, ... }, 2: ... }
+    chart_labels = []
     chart_data = []
-
-    for row in results_raw:
-        hoc_ky = row.hoc_ky
-        
-        # Nếu đây là kỳ mới, tạo một entry mới trong dict
-        if hoc_ky not in semesters_data:
-            semesters_data[hoc_ky] = {
+    for row in rows:
+        if row.hoc_ky not in semesters_data:
+            ky_gpa = gpa_hoc_ky.get(row.hoc_ky)
+            semesters_data[row.hoc_ky] = {
                 'grades': [],
-                'total_points_10': 0,
-                'total_points_4': 0,
-                'total_credits': 0,
-                'gpa_10': 0.0,
-                'gpa_4': 0.0
+                'gpa_10': ky_gpa.gpa_10 if ky_gpa else 0.0,
+                'gpa_4': ky_gpa.gpa_4 if ky_gpa else 0.0
             }
-
-        diem_tk = row.diem_tong_ket
-        diem_chu = row.diem_chu
-
-        # Chỉ tính GPA cho các môn đã có điểm tổng kết
-        if diem_tk is not None:
-            diem_he_4 = convert_10_to_4_scale(diem_tk)
-            
-            # Tính cho GPA học kỳ
-            semesters_data[hoc_ky]['total_points_10'] += diem_tk * row.so_tin_chi
-            semesters_data[hoc_ky]['total_points_4'] += diem_he_4 * row.so_tin_chi
-            semesters_data[hoc_ky]['total_credits'] += row.so_tin_chi
-            
-            # Tính cho GPA tích lũy
-            total_points_10_cumulative += diem_tk * row.so_tin_chi
-            total_points_4_cumulative += diem_he_4 * row.so_tin_chi
-            total_credits_cumulative += row.so_tin_chi
-
-            # Dữ liệu biểu đồ (vẫn như cũ)
-            chart_labels.append(f"HK{hoc_ky}-{row.ma_mh}")
-            chart_data.append(diem_tk)
-
-        # Thêm thông tin môn học vào đúng học kỳ
-        semesters_data[hoc_ky]['grades'].append({
+        if row.diem_tong_ket is not None:
+            chart_labels.append(f"HK{row.hoc_ky}-{row.ma_mh}")
+            chart_data.append(row.diem_tong_ket)
+        semesters_data[row.hoc_ky]['grades'].append({
             'ma_mh': row.ma_mh,
             'ten_mh': row.ten_mh,
             'so_tin_chi': row.so_tin_chi,
             'diem_cc': row.diem_chuyen_can,
             'diem_gk': row.diem_giua_ky,
             'diem_ck': row.diem_cuoi_ky,
-            'diem_tk': diem_tk,
-            'diem_chu': diem_chu
+            'diem_tk': row.diem_tong_ket,
+            'diem_chu': row.diem_chu
         })
 
-    # Tính toán GPA (Hệ 10 và Hệ 4) cho TỪNG học kỳ
-    for ky in semesters_data:
-        credits_ky = semesters_data[ky]['total_credits']
-        if credits_ky > 0:
-            semesters_data[ky]['gpa_10'] = semesters_data[ky]['total_points_10'] / credits_ky
-            semesters_data[ky]['gpa_4'] = semesters_data[ky]['total_points_4'] / credits_ky
+    transcript = {
+        'semesters_data': semesters_data,
+        'gpa_10_cumulative': gpa_tich_luy.gpa_10 if gpa_tich_luy else 0.0,
+        'gpa_4_cumulative': gpa_tich_luy.gpa_4 if gpa_tich_luy else 0.0,
+        'chart_labels': chart_labels,
+        'chart_data': chart_data,
+    }
+    transcript_cache.set(ma_sv, (version, transcript))
+    return transcript
+
+
+@app.route('/student/grades')
+@login_required
+@role_required(VaiTroEnum.SINHVIEN)
+def student_grades():
+    return render_template('student_grades.html', **student_transcript(current_user.username))
 
-    # Tính GPA TÍCH LŨY (toàn bộ)
-    gpa_10_cumulative = (total_points_10_cumulative / total_credits_cumulative) if total_credits_cumulative > 0 else 0.0
-    gpa_4_cumulative = (total_points_4_cumulative / total_credits_cumulative) if total_credits_cumulative > 0 else 0.0
 
-    return render_template(
-        'student_grades.html',
-        semesters_data=semesters_data, # Gửi cấu trúc dữ liệu mới
-        gpa_10_cumulative=gpa_10_cumulative,
-        gpa_4_cumulative=gpa_4_cumulative,
-        chart_labels=chart_labels,
-        chart_data=chart_data
-    )
 # 4.3. Chức năng của Giáo viên
 @app.route('/admin/dashboard')
 @login_required
@@ -756,6 +1767,43 @@ def admin_profile():
 
     return render_template('admin_profile.html', gv=gv)
 
+# === PHÂN TRANG KEYSET ===
+def parse_page_size(value, default=None):
+    """Đọc per_page từ query string, giới hạn trong [1, STUDENT_PAGE_SIZE_MAX]."""
+    try:
+        per_page = int(value)
+    except (TypeError, ValueError):
+        return default or app.config['STUDENT_PAGE_SIZE']
+    return max(1, min(per_page, app.config['STUDENT_PAGE_SIZE_MAX']))
+
+
+def keyset_page(query, key_column, after=None, before=None, per_page=50):
+    """
+    Lấy một trang theo con trỏ trên cột khóa duy nhất (key_column).
+    after: lấy các dòng có khóa > after (trang sau); before: khóa < before (trang trước).
+    Trả về (rows theo thứ tự tăng dần, has_prev, has_next).
+    """
+    if before:
+        rows = query.filter(key_column < before).order_by(key_column.desc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        return list(reversed(rows[:per_page])), has_prev, True
+
+    if after:
+        query = query.filter(key_column > after)
+    rows = query.order_by(key_column).limit(per_page + 1).all()
+    return rows[:per_page], bool(after), len(rows) > per_page
+
+
+# Tổng số SV theo bộ lọc chỉ để hiển thị: cache ngắn hạn, bỏ khi thêm/xóa SV
+student_count_cache = TTLCache(256, app.config['STUDENT_COUNT_CACHE_TTL'])
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_student_counts(session, flush_context):
+    if any(isinstance(obj, SinhVien) for obj in chain(session.new, session.deleted, session.dirty)):
+        student_count_cache.clear()
+
+
 @app.route('/admin/students')
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
@@ -764,24 +1812,30 @@ def admin_manage_students():
     search_ho_ten = request.args.get('ho_ten', '')
     filter_lop = request.args.get('lop', '')
     filter_khoa = request.args.get('khoa', '')
+    per_page = parse_page_size(request.args.get('per_page'))
 
-    query = SinhVien.query
-    if search_ma_sv:
-        query = query.filter(SinhVien.ma_sv.ilike(f'%{search_ma_sv}%'))
-    if search_ho_ten:
-        query = query.filter(SinhVien.ho_ten.ilike(f'%{search_ho_ten}%'))
+    query = SinhVien.query.filter(*student_search_conditions(search_ma_sv, search_ho_ten))
     if filter_lop:
         query = query.filter(SinhVien.lop == filter_lop)
     if filter_khoa:
         query = query.filter(SinhVien.khoa == filter_khoa)
 
-    students = query.order_by(SinhVien.ma_sv).all()
+    # Phân trang keyset theo ma_sv: chỉ đọc per_page + 1 dòng, không phụ thuộc sĩ số toàn trường
+    students, has_prev, has_next = keyset_page(
+        query, SinhVien.ma_sv,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page
+    )
+    filter_key = (search_ma_sv, search_ho_ten, filter_lop, filter_khoa)
+    total_students = student_count_cache.get(filter_key)
+    if total_students is None:
+        total_students = query.order_by(None).count()
+        student_count_cache.set(filter_key, total_students)
 
-    lop_hoc_tuples = db.session.query(SinhVien.lop).distinct().order_by(SinhVien.lop).all()
-    danh_sach_lop = [lop[0] for lop in lop_hoc_tuples if lop[0]]
+    danh_sach_lop = list_classes()
 
-    khoa_tuples = db.session.query(SinhVien.khoa).distinct().order_by(SinhVien.khoa).all()
-    danh_sach_khoa = [khoa[0] for khoa in khoa_tuples if khoa[0]]
+    danh_sach_khoa = list_faculties()
 
     return render_template(
         'admin_manage_students.html',
@@ -792,10 +1846,27 @@ def admin_manage_students():
             'ma_sv': search_ma_sv,
             'ho_ten': search_ho_ten,
             'lop': filter_lop,
-            'khoa': filter_khoa
-        }
+            'khoa': filter_khoa,
+            'per_page': per_page
+        },
+        total_students=total_students,
+        prev_cursor=students[0].ma_sv if has_prev and students else None,
+        next_cursor=students[-1].ma_sv if has_next and students else None
     )
 
+@app.route('/admin/students/search')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_search_students():
+    """Tra cứu nhanh SV theo mã hoặc họ tên (gõ không dấu, theo tiền tố), trả về JSON đã xếp hạng."""
+    keyword = request.args.get('q', '').strip()
+    limit = parse_page_size(request.args.get('limit', 20))
+    students = search_students(keyword, limit) if keyword else []
+    return jsonify([
+        {'ma_sv': sv.ma_sv, 'ho_ten': sv.ho_ten, 'lop': sv.lop, 'khoa': sv.khoa}
+        for sv in students
+    ])
+
 @app.route('/admin/students/add', methods=['GET', 'POST'])
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
@@ -894,6 +1965,21 @@ def admin_manage_courses():
     courses = MonHoc.query.order_by(MonHoc.hoc_ky, MonHoc.ma_mh).all() 
     return render_template('admin_manage_courses.html', courses=courses)
 
+
+def parse_grade_weights(form):
+    """Đọc trọng số CC / GK / CK (đơn vị %) từ form; trả về tuple tỉ lệ, tổng phải bằng 100%."""
+    weights = []
+    for field, default in zip(('trong_so_cc', 'trong_so_gk', 'trong_so_ck'), DEFAULT_GRADE_WEIGHTS):
+        value = form.get(field)
+        percent = float(value) if value not in (None, '') else default * 100
+        if not (0 <= percent <= 100):
+            raise ValueError('Trọng số phải nằm trong khoảng 0-100%.')
+        weights.append(round(percent / 100, 4))
+    if abs(sum(weights) - 1) > 1e-6:
+        raise ValueError('Tổng trọng số chuyên cần + giữa kỳ + cuối kỳ phải bằng 100%.')
+    return tuple(weights)
+
+
 @app.route('/admin/courses/add', methods=['GET', 'POST'])
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
@@ -911,12 +1997,16 @@ def admin_add_course():
             return redirect(url_for('admin_add_course'))
 
         try:
+            trong_so_cc, trong_so_gk, trong_so_ck = parse_grade_weights(request.form)
             new_course = MonHoc(
                 ma_mh=ma_mh,
                 ten_mh=ten_mh,
                 so_tin_chi=int(so_tin_chi),
                 # Thêm học kỳ vào
-                hoc_ky=int(hoc_ky) 
+                hoc_ky=int(hoc_ky),
+                trong_so_cc=trong_so_cc,
+                trong_so_gk=trong_so_gk,
+                trong_so_ck=trong_so_ck
             )
             db.session.add(new_course)
             db.session.commit()
@@ -941,9 +2031,19 @@ def admin_edit_course(ma_mh):
             course.so_tin_chi = int(request.form.get('so_tin_chi'))
             # Cập nhật học kỳ
             course.hoc_ky = int(request.form.get('hoc_ky')) 
-            
+
+            # Đổi trọng số -> tính lại điểm tổng kết của cả môn bằng UPDATE hàng loạt
+            old_weights = course.weights
+            course.trong_so_cc, course.trong_so_gk, course.trong_so_ck = parse_grade_weights(request.form)
+            recomputed = 0
+            if course.weights != old_weights:
+                recomputed = recompute_course_grades(course.ma_mh, course.weights)
+
             db.session.commit()
-            flash('Cập nhật môn học thành công!', 'success')
+            if recomputed:
+                flash(f'Cập nhật môn học thành công! Đã tính lại điểm tổng kết của {recomputed} bản ghi.', 'success')
+            else:
+                flash('Cập nhật môn học thành công!', 'success')
             return redirect(url_for('admin_manage_courses'))
 
         except Exception as e:
@@ -973,9 +2073,8 @@ def admin_delete_course(ma_mh):
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_manage_grades():
     # Lấy danh sách Lớp và Môn học cho dropdown
-    lop_hoc_tuples = db.session.query(SinhVien.lop).distinct().order_by(SinhVien.lop).all()
-    danh_sach_lop = [lop[0] for lop in lop_hoc_tuples if lop[0]]
-    danh_sach_mon_hoc = MonHoc.query.order_by(MonHoc.ten_mh).all()
+    danh_sach_lop = list_classes()
+    danh_sach_mon_hoc = list_courses()
 
     # Lấy Lớp và Môn học được chọn từ URL (nếu có)
     selected_lop = request.args.get('lop', None)
@@ -1060,6 +2159,171 @@ def admin_enter_grades(lop, ma_mh):
         mon_hoc=mon_hoc,
         danh_sach_nhap_diem=danh_sach_nhap_diem
     )
+# === LƯU ĐIỂM HÀNG LOẠT (SET-BASED) ===
+KET_QUA_SCORE_COLUMNS = ('diem_chuyen_can', 'diem_giua_ky', 'diem_cuoi_ky', 'diem_tong_ket', 'diem_chu')
+
+
+def upsert_ket_qua_rows(new_rows, changed_rows, connection=None):
+    """
+    Ghi hàng loạt các dòng ket_qua (dạng dict) trong một lần executemany.
+    SQLite/PostgreSQL: INSERT ... ON CONFLICT (ma_sv, ma_mh) DO UPDATE.
+    CSDL khác: một executemany INSERT cho dòng mới và một executemany UPDATE cho dòng cũ.
+    """
+    if not new_rows and not changed_rows:
+        return
+    if connection is None:
+        connection = db.session.connection()
+    table = KetQua.__table__
+    dialect_name = connection.dialect.name
+
+    if dialect_name in ('sqlite', 'postgresql'):
+        if dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.ma_sv, table.c.ma_mh],
+            set_={col: stmt.excluded[col] for col in KET_QUA_SCORE_COLUMNS}
+        )
+        connection.execute(stmt, list(new_rows) + list(changed_rows))
+        return
+
+    if new_rows:
+        connection.execute(insert(table), list(new_rows))
+    if changed_rows:
+        update_stmt = table.update().where(
+            and_(table.c.ma_sv == bindparam('b_ma_sv'), table.c.ma_mh == bindparam('b_ma_mh'))
+        ).values({col: bindparam(col) for col in KET_QUA_SCORE_COLUMNS})
+        connection.execute(update_stmt, [
+            dict(row, b_ma_sv=row['ma_sv'], b_ma_mh=row['ma_mh']) for row in changed_rows
+        ])
+
+
+def course_weights(ma_mh):
+    """Trọng số (cc, gk, ck) của một môn; môn không tồn tại dùng trọng số mặc định."""
+    row = db.session.execute(
+        select(MonHoc.trong_so_cc, MonHoc.trong_so_gk, MonHoc.trong_so_ck).where(MonHoc.ma_mh == ma_mh)
+    ).first()
+    return tuple(row) if row is not None else DEFAULT_GRADE_WEIGHTS
+
+
+def save_grades_bulk(ma_mh, scores_by_sv, weights=None):
+    """
+    Lưu điểm thành phần của nhiều SV cho một môn với số câu truy vấn cố định:
+    1 SELECT kiểm tra SV, 1 SELECT điểm hiện có, 1 UPSERT hàng loạt (+ cập nhật GPA tổng hợp).
+    scores_by_sv: { ma_sv: {'cc': float|None, 'gk': ..., 'ck': ...} }
+    weights: trọng số của môn; None thì đọc từ MonHoc (thêm 1 SELECT).
+    Trả về (created_count, updated_count, missing_ma_sv) - missing_ma_sv là các mã SV không tồn tại.
+    """
+    if not scores_by_sv:
+        return 0, 0, []
+    ma_sv_list = list(scores_by_sv.keys())
+    if weights is None:
+        weights = course_weights(ma_mh)
+
+    valid_ma_sv = set(db.session.execute(
+        select(SinhVien.ma_sv).where(SinhVien.ma_sv.in_(ma_sv_list))
+    ).scalars())
+    existing_grades = {
+        row.ma_sv: row
+        for row in db.session.execute(
+            select(KetQua.ma_sv, KetQua.diem_chuyen_can, KetQua.diem_giua_ky, KetQua.diem_cuoi_ky)
+            .where(KetQua.ma_mh == ma_mh, KetQua.ma_sv.in_(ma_sv_list))
+        )
+    }
+
+    missing_ma_sv = []
+    new_rows = []
+    changed_rows = []
+    for ma_sv, scores in scores_by_sv.items():
+        if ma_sv not in valid_ma_sv:
+            missing_ma_sv.append(ma_sv)
+            continue
+
+        existing_grade = existing_grades.get(ma_sv)
+        if existing_grade is None:
+            # Bỏ qua nếu cả 3 ô đều trống (và chưa có bản ghi)
+            if all(v is None for v in scores.values()):
+                continue
+            diem_cc, diem_gk, diem_ck = scores['cc'], scores['gk'], scores['ck']
+            target_rows = new_rows
+        else:
+            # Chỉ cập nhật những điểm được gửi lên (khác None)
+            old_scores = (existing_grade.diem_chuyen_can, existing_grade.diem_giua_ky, existing_grade.diem_cuoi_ky)
+            diem_cc, diem_gk, diem_ck = (
+                new if new is not None else old
+                for new, old in zip((scores['cc'], scores['gk'], scores['ck']), old_scores)
+            )
+            if (diem_cc, diem_gk, diem_ck) == old_scores:
+                continue
+            target_rows = changed_rows
+
+        diem_tong_ket, diem_chu = tinh_diem_tong_ket(diem_cc, diem_gk, diem_ck, weights)
+        target_rows.append({
+            'ma_sv': ma_sv,
+            'ma_mh': ma_mh,
+            'diem_chuyen_can': diem_cc,
+            'diem_giua_ky': diem_gk,
+            'diem_cuoi_ky': diem_ck,
+            'diem_tong_ket': diem_tong_ket,
+            'diem_chu': diem_chu
+        })
+
+    upsert_ket_qua_rows(new_rows, changed_rows)
+    # Câu lệnh Core không đi qua after_flush nên phải cập nhật GPA tổng hợp và cache thủ công
+    touched_ma_sv = [row['ma_sv'] for row in chain(new_rows, changed_rows)]
+    refresh_gpa_aggregates(touched_ma_sv)
+    invalidate_student_grade_caches(db.session, touched_ma_sv)
+    if new_rows:
+        invalidate_on_commit(db.session, grade_versions, ['ket_qua'])
+    return len(new_rows), len(changed_rows), missing_ma_sv
+
+
+GRADE_RECOMPUTE_CHUNK_SIZE = 1000
+
+
+def recompute_course_grades(ma_mh, weights=None):
+    """
+    Tính lại điểm tổng kết / điểm chữ của mọi bản ghi ket_qua thuộc một môn (sau khi đổi trọng số):
+    1 SELECT điểm thành phần, UPDATE hàng loạt theo lô chỉ những dòng có kết quả khác,
+    rồi cập nhật GPA tổng hợp của các SV đó. Không nạp đối tượng ORM nào.
+    Dùng chính tinh_diem_tong_ket (ROUND của SQL làm tròn khác Python ở các giá trị .xx5)
+    nên kết quả trùng khớp với điểm nhập qua form / file.
+    Trả về số bản ghi đã cập nhật.
+    """
+    if weights is None:
+        weights = course_weights(ma_mh)
+    table = KetQua.__table__
+    connection = db.session.connection()
+
+    changed_rows = []
+    for row in connection.execute(
+        select(table.c.ma_sv, table.c.diem_chuyen_can, table.c.diem_giua_ky, table.c.diem_cuoi_ky,
+               table.c.diem_tong_ket, table.c.diem_chu)
+        .where(table.c.ma_mh == ma_mh)
+    ):
+        diem_tong_ket, diem_chu = tinh_diem_tong_ket(
+            row.diem_chuyen_can, row.diem_giua_ky, row.diem_cuoi_ky, weights
+        )
+        if (diem_tong_ket, diem_chu) != (row.diem_tong_ket, row.diem_chu):
+            changed_rows.append({'b_ma_sv': row.ma_sv, 'diem_tong_ket': diem_tong_ket, 'diem_chu': diem_chu})
+    if not changed_rows:
+        return 0
+
+    update_stmt = table.update().where(
+        and_(table.c.ma_mh == ma_mh, table.c.ma_sv == bindparam('b_ma_sv'))
+    ).values(diem_tong_ket=bindparam('diem_tong_ket'), diem_chu=bindparam('diem_chu'))
+    for batch in iter_chunks(changed_rows, GRADE_RECOMPUTE_CHUNK_SIZE):
+        connection.execute(update_stmt, batch)
+
+    # Câu lệnh Core không đi qua after_flush nên phải cập nhật GPA tổng hợp và cache thủ công
+    touched_ma_sv = [row['b_ma_sv'] for row in changed_rows]
+    refresh_gpa_aggregates(touched_ma_sv)
+    invalidate_student_grade_caches(db.session, touched_ma_sv)
+    return len(changed_rows)
+
+
 # === THAY THẾ HÀM admin_save_grades CŨ BẰNG HÀM NÀY ===
 @app.route('/admin/grades/save', methods=['POST'])
 @login_required
@@ -1068,8 +2332,6 @@ def admin_save_grades():
     try:
         ma_mh = request.form.get('ma_mh')
         lop = request.form.get('lop') # Lấy lại để redirect
-        updated_count = 0
-        created_count = 0
 
         # Dữ liệu form sẽ có dạng: diem_cc_MaSV, diem_gk_MaSV, diem_ck_MaSV
         scores_by_sv = {} # Gom điểm của từng SV vào dict
@@ -1102,49 +2364,10 @@ def admin_save_grades():
                         flash(f'Lỗi: Điểm "{value}" ({score_type}) của SV {ma_sv} không hợp lệ. Giá trị này sẽ bị bỏ qua.', 'warning')
                     # === KẾT THÚC SỬA LỖI ===
 
-        # 2. Xử lý và lưu vào CSDL
-        for ma_sv, scores in scores_by_sv.items():
-            
-            # Kiểm tra sinh viên có tồn tại không
-            student_exists = SinhVien.query.get(ma_sv)
-            if not student_exists:
-                flash(f"Lỗi: Mã SV '{ma_sv}' không tồn tại. Bỏ qua.", 'danger')
-                continue # Bỏ qua sinh viên này
-
-            existing_grade = KetQua.query.get((ma_sv, ma_mh))
-
-            # Bỏ qua nếu cả 3 ô đều trống (và chưa có bản ghi)
-            if all(v is None for v in scores.values()) and not existing_grade:
-                continue
-
-            if existing_grade:
-                # UPDATE: Cập nhật các điểm được gửi lên
-                changed = False
-                # Chỉ cập nhật nếu điểm mới (từ form) là một con số
-                if scores['cc'] is not None and existing_grade.diem_chuyen_can != scores['cc']:
-                    existing_grade.diem_chuyen_can = scores['cc']; changed = True
-                if scores['gk'] is not None and existing_grade.diem_giua_ky != scores['gk']:
-                    existing_grade.diem_giua_ky = scores['gk']; changed = True
-                if scores['ck'] is not None and existing_grade.diem_cuoi_ky != scores['ck']:
-                    existing_grade.diem_cuoi_ky = scores['ck']; changed = True
-
-                # TÍNH LẠI ĐIỂM (THEO YÊU CẦU CỦA BẠN)
-                if changed:
-                    existing_grade.calculate_final_score() # Tự động tính lại TK 10 và Chữ
-                    updated_count += 1
-            else:
-                # INSERT: Tạo bản ghi mới
-                new_grade = KetQua(
-                    ma_sv=ma_sv,
-                    ma_mh=ma_mh,
-                    diem_chuyen_can=scores['cc'],
-                    diem_giua_ky=scores['gk'],
-                    diem_cuoi_ky=scores['ck']
-                )
-                # TÍNH ĐIỂM LẦN ĐẦU (THEO YÊU CẦU CỦA BẠN)
-                new_grade.calculate_final_score() # Tự động tính TK 10 và Chữ
-                db.session.add(new_grade)
-                created_count += 1
+        # 2. Xử lý và lưu vào CSDL (số truy vấn không phụ thuộc sĩ số lớp)
+        created_count, updated_count, missing_ma_sv = save_grades_bulk(ma_mh, scores_by_sv)
+        for ma_sv in missing_ma_sv:
+            flash(f"Lỗi: Mã SV '{ma_sv}' không tồn tại. Bỏ qua.", 'danger')
 
         if updated_count > 0 or created_count > 0:
             db.session.commit()
@@ -1192,16 +2415,7 @@ def calculate_gpa_expression():
 def calculate_gpa_4_expression():
     """Trả về biểu thức SQLAlchemy để tính GPA hệ 4 DỰA TRÊN ĐIỂM TỔNG KẾT."""
     # Chuyển điểm tổng kết (hệ 10) sang điểm hệ 4
-    diem_he_4 = case(
-        (KetQua.diem_tong_ket >= 8.5, 4.0),
-        (KetQua.diem_tong_ket >= 8.0, 3.5),
-        (KetQua.diem_tong_ket >= 7.0, 3.0),
-        (KetQua.diem_tong_ket >= 6.5, 2.5),
-        (KetQua.diem_tong_ket >= 5.5, 2.0),
-        (KetQua.diem_tong_ket >= 5.0, 1.5),
-        (KetQua.diem_tong_ket >= 4.0, 1.0),
-        else_=0.0
-    )
+    diem_he_4 = diem_he_4_case(KetQua.diem_tong_ket)
 
     # Chỉ tính tổng điểm và tín chỉ cho những môn ĐÃ CÓ điểm tổng kết
     total_points_4 = func.sum(
@@ -1228,77 +2442,351 @@ def calculate_gpa_4_expression():
 def admin_reports_index():
     return render_template('admin_reports_index.html')
 
+RANKING_PARTITIONS = {'lop': SinhVien.lop, 'khoa': SinhVien.khoa}
+
+
+def _ranking_source(columns, threshold=None, hoc_ky=None, lop=None, khoa=None, partition=None):
+    """
+    SELECT trên bảng GPA tổng hợp (gpa_sinh_vien; gpa_hoc_ky khi chọn hoc_ky) theo phạm vi xếp hạng.
+    Chỉ JOIN sinh_vien khi cần lớp/khoa (lọc hoặc chia nhóm), còn lại quét thẳng index gpa_10.
+    columns: hàm nhận bảng nguồn, trả về danh sách cột cần lấy.
+    """
+    source = GpaSinhVien if hoc_ky is None else GpaHocKy
+    conditions = [source.gpa_10.isnot(None)]
+    if hoc_ky is not None:
+        conditions.append(GpaHocKy.hoc_ky == hoc_ky)
+    if threshold is not None:
+        conditions.append(source.gpa_10 > threshold)
+    if lop:
+        conditions.append(SinhVien.lop == lop)
+    if khoa:
+        conditions.append(SinhVien.khoa == khoa)
+    stmt = select(*columns(source)).select_from(source)
+    if partition or lop or khoa:
+        stmt = stmt.join(SinhVien, SinhVien.ma_sv == source.ma_sv)
+    return stmt.where(*conditions)
+
+
+def _ranked_gpa(threshold=None, partition=None, hoc_ky=None, lop=None, khoa=None):
+    """
+    Subquery xếp hạng: ROW_NUMBER() (hạng) và RANK() (hạng đồng hạng) theo GPA hệ 10 giảm dần
+    trong từng nhóm (partition = 'lop' | 'khoa' | None = toàn trường, cột 'nhom').
+    Ngưỡng GPA > threshold được lọc TRƯỚC khi đánh số: mọi SV xếp trên một SV đạt ngưỡng cũng
+    đạt ngưỡng nên hạng không đổi, còn window function chỉ phải sắp xếp các SV đạt ngưỡng.
+    """
+    partition_column = RANKING_PARTITIONS[partition] if partition else None
+
+    def ranking_columns(source):
+        return [
+            source.ma_sv,
+            source.gpa_10.label('gpa'),
+            source.gpa_4.label('gpa_4'),
+            func.row_number().over(
+                partition_by=partition_column, order_by=(source.gpa_10.desc(), source.ma_sv)
+            ).label('hang'),
+            func.rank().over(partition_by=partition_column, order_by=source.gpa_10.desc()).label('hang_dong_hang'),
+            (partition_column if partition else literal_column('NULL')).label('nhom'),
+        ]
+    return _ranking_source(ranking_columns, threshold, hoc_ky, lop, khoa, partition).subquery()
+
+
+def gpa_ranking_page(threshold=None, top_k=None, partition=None, hoc_ky=None, lop=None, khoa=None,
+                     limit=50, offset=0):
+    """
+    Một trang bảng xếp hạng GPA (đọc từ bảng GPA tổng hợp, không GROUP BY lại ket_qua);
+    top_k giới hạn số SV mỗi nhóm. Họ tên / lớp / khoa chỉ được JOIN cho các dòng của trang.
+    """
+    ranked = _ranked_gpa(threshold, partition, hoc_ky, lop, khoa)
+    page = select(ranked)
+    if top_k:
+        page = page.where(ranked.c.hang <= top_k)
+    page = page.order_by(ranked.c.nhom, ranked.c.hang).limit(limit).offset(offset).subquery()
+    return db.session.execute(
+        select(
+            SinhVien.ma_sv, SinhVien.ho_ten, SinhVien.lop, SinhVien.khoa,
+            page.c.gpa, page.c.gpa_4, page.c.hang, page.c.hang_dong_hang, page.c.nhom
+        ).join(SinhVien, SinhVien.ma_sv == page.c.ma_sv).order_by(page.c.nhom, page.c.hang)
+    ).all()
+
+
+def gpa_ranking_summary(threshold=None, top_k=None, partition=None, hoc_ky=None, lop=None, khoa=None):
+    """
+    (tổng số SV của bảng xếp hạng, {xếp loại: số SV}); chỉ cần window function khi có top_k.
+    Cache theo phiên bản GPA tổng hợp nên chuyển trang không phải tính lại.
+    """
+    key = ('ranking_summary', threshold, top_k, partition, hoc_ky, lop, khoa, grade_versions['gpa'])
+    return _cached_report(key, lambda: _gpa_ranking_summary(threshold, top_k, partition, hoc_ky, lop, khoa))
+
+
+def _gpa_ranking_summary(threshold, top_k, partition, hoc_ky, lop, khoa):
+    if top_k:
+        ranked = _ranked_gpa(threshold, partition, hoc_ky, lop, khoa)
+        top = select(ranked.c.gpa).where(ranked.c.hang <= top_k).subquery()
+        stmt = select(func.count(), *gpa_class_count_columns(top.c.gpa)).select_from(top)
+    else:
+        stmt = _ranking_source(lambda source: [func.count(), *gpa_class_count_columns(source.gpa_10)],
+                               threshold, hoc_ky, lop, khoa)
+    total, *class_counts = db.session.execute(stmt).one()
+    return total, dict(zip(GPA_CLASS_LABELS, class_counts))
+
+
+def ranking_cohort_sizes(partition=None, hoc_ky=None, lop=None, khoa=None):
+    """
+    Số SV có GPA của từng nhóm xếp hạng ({giá trị nhóm: số SV}; toàn trường -> khóa None).
+    Cache theo phiên bản GPA tổng hợp: sửa điểm (UPDATE) có thể làm SV có hoặc mất GPA.
+    """
+    def load():
+        group_column = RANKING_PARTITIONS[partition] if partition else literal_column('NULL')
+        stmt = _ranking_source(lambda source: [group_column, func.count()], None, hoc_ky, lop, khoa, partition)
+        if partition:
+            stmt = stmt.group_by(group_column)
+        return dict(db.session.execute(stmt).all())
+    return _cached_report(('ranking_cohort', partition, hoc_ky, lop, khoa, grade_versions['gpa']), load)
+
+
 @app.route('/admin/reports/high_gpa')
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_report_high_gpa():
-    GPA_THRESHOLD = 8.0
-    gpa_10_expression = calculate_gpa_expression()
-    gpa_4_expression = calculate_gpa_4_expression()
-
-    results = db.session.query(
-        SinhVien.ma_sv, SinhVien.ho_ten, SinhVien.lop,
-        gpa_10_expression, gpa_4_expression
-    ).join(
-        KetQua, SinhVien.ma_sv == KetQua.ma_sv
-    ).join(
-        MonHoc, KetQua.ma_mh == MonHoc.ma_mh
-    ).group_by(
-        SinhVien.ma_sv, SinhVien.ho_ten, SinhVien.lop
-    ).having(
-        gpa_10_expression > GPA_THRESHOLD
-    ).order_by(
-        gpa_10_expression.desc()
-    ).all()
+    # Ngưỡng để trống = xếp hạng mọi SV; không hợp lệ = ngưỡng mặc định
+    raw_threshold = request.args.get('threshold')
+    try:
+        threshold = float(raw_threshold) if raw_threshold.strip() else None
+    except (AttributeError, ValueError):
+        threshold = app.config['HIGH_GPA_THRESHOLD']
+    top_k = request.args.get('top_k', type=int)
+    partition = request.args.get('partition', '')
+    if partition not in RANKING_PARTITIONS:
+        partition = ''
+    hoc_ky = request.args.get('hoc_ky', type=int)
+    filter_lop = request.args.get('lop', '')
+    filter_khoa = request.args.get('khoa', '')
+    per_page = parse_page_size(request.args.get('per_page'))
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    ranking_args = (threshold, top_k if top_k and top_k > 0 else None, partition or None,
+                    hoc_ky, filter_lop, filter_khoa)
+    rows = gpa_ranking_page(*ranking_args, limit=per_page, offset=(page - 1) * per_page)
+    total, category_counts = gpa_ranking_summary(*ranking_args)
+    # Top %: SV thuộc nhóm bao nhiêu % GPA cao nhất (hạng đồng hạng / số SV có GPA trong nhóm)
+    cohort_sizes = ranking_cohort_sizes(partition or None, hoc_ky, filter_lop, filter_khoa)
+    results = [
+        dict(row._mapping, top_phan_tram=100.0 * row.hang_dong_hang / max(cohort_sizes.get(row.nhom, 0), row.hang_dong_hang))
+        for row in rows
+    ]
 
     # Tính toán cho biểu đồ
-    category_counts = {"Yếu": 0, "Trung bình": 0, "Khá": 0, "Giỏi": 0, "Xuất sắc": 0}
-    for row in results:
-        # Quan trọng: Cần kiểm tra row.gpa có phải là None không
-        if row.gpa is not None:
-             category = classify_gpa_10(row.gpa)
-             if category in category_counts:
-                 category_counts[category] += 1
     chart_labels = list(category_counts.keys())
     chart_data = list(category_counts.values())
 
     return render_template(
         'admin_report_high_gpa.html',
         results=results,
-        threshold=GPA_THRESHOLD,
+        threshold=threshold,
         chart_labels=chart_labels,
-        chart_data=chart_data
+        chart_data=chart_data,
+        total=total,
+        page=page,
+        per_page=per_page,
+        has_next=page * per_page < total,
+        filters={
+            'threshold': '' if threshold is None else threshold,
+            'top_k': top_k or '',
+            'partition': partition,
+            'hoc_ky': hoc_ky or '',
+            'lop': filter_lop,
+            'khoa': filter_khoa,
+            'per_page': per_page,
+        },
+        danh_sach_lop=list_classes(),
+        danh_sach_khoa=list_faculties(),
+        danh_sach_hoc_ky=sorted({course.hoc_ky for course in list_courses()})
     )
 
+# Báo cáo đọc nhiều, dữ liệu ít thay đổi: cache theo phiên bản của ket_qua (thêm/xóa bản ghi điểm)
+# và của sinh_vien / mon_hoc (reference_versions), nên không cần dò từng khóa khi ghi.
+report_cache = TTLCache(app.config['REPORT_CACHE_SIZE'], app.config['REPORT_CACHE_TTL'])
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_grade_reports(session, flush_context):
+    """Tăng phiên bản ket_qua khi có bản ghi điểm được thêm hoặc xóa."""
+    if any(isinstance(obj, KetQua) for obj in chain(session.new, session.deleted)):
+        invalidate_on_commit(session, grade_versions, ['ket_qua'])
+
+
+def _cached_report(key, loader):
+    key = key + (grade_versions['ket_qua'], reference_versions['sinh_vien'], reference_versions['mon_hoc'])
+    value = report_cache.get(key)
+    if value is None:
+        value = loader()
+        report_cache.set(key, value)
+    return value
+
+
+def missing_grade_query(ma_mh, lop=None, hoc_ky=None):
+    """
+    SV chưa có bản ghi điểm môn ma_mh: anti-join NOT EXISTS trên khóa chính (ma_sv, ma_mh)
+    của ket_qua (không dính bẫy NULL của NOT IN).
+    lop: chỉ xét một lớp; hoc_ky: chỉ xét SV đã có điểm ít nhất một môn của học kỳ đó.
+    """
+    query = SinhVien.query.filter(
+        ~exists().where(KetQua.ma_sv == SinhVien.ma_sv, KetQua.ma_mh == ma_mh)
+    )
+    if lop:
+        query = query.filter(SinhVien.lop == lop)
+    if hoc_ky is not None:
+        query = query.filter(
+            exists().where(KetQua.ma_sv == SinhVien.ma_sv, KetQua.ma_mh == MonHoc.ma_mh, MonHoc.hoc_ky == hoc_ky)
+        )
+    return query
+
+
+def missing_grade_matrix(lop=None, hoc_ky=None):
+    """
+    Số SV chưa có điểm theo từng (lớp, môn) cho mọi môn trong một câu truy vấn:
+    sĩ số lớp trừ số bản ghi điểm của lớp ở môn đó (một lần GROUP BY ket_qua thay vì
+    kiểm tra từng cặp SV x môn). hoc_ky: chỉ lấy các môn của học kỳ đó.
+    Trả về (danh sách môn, list (lop, si_so, {ma_mh: số SV thiếu điểm})).
+    """
+    class_filter = [SinhVien.lop.isnot(None), SinhVien.lop != '']
+    if lop:
+        class_filter.append(SinhVien.lop == lop)
+    class_sizes = select(
+        SinhVien.lop, func.count().label('si_so')
+    ).where(*class_filter).group_by(SinhVien.lop).subquery()
+    graded = select(
+        SinhVien.lop, KetQua.ma_mh, func.count().label('so_sv')
+    ).join(KetQua, KetQua.ma_sv == SinhVien.ma_sv).where(*class_filter).group_by(SinhVien.lop, KetQua.ma_mh).subquery()
+
+    courses = [course for course in list_courses() if hoc_ky is None or course.hoc_ky == hoc_ky]
+    stmt = select(
+        class_sizes.c.lop, class_sizes.c.si_so, MonHoc.ma_mh,
+        class_sizes.c.si_so - func.coalesce(graded.c.so_sv, 0)
+    ).select_from(class_sizes).join(MonHoc, true()).outerjoin(
+        graded, and_(graded.c.lop == class_sizes.c.lop, graded.c.ma_mh == MonHoc.ma_mh)
+    ).order_by(class_sizes.c.lop)
+    if hoc_ky is not None:
+        stmt = stmt.where(MonHoc.hoc_ky == hoc_ky)
+
+    rows = OrderedDict()
+    for row_lop, si_so, ma_mh, so_sv_thieu in db.session.execute(stmt):
+        rows.setdefault(row_lop, (row_lop, si_so, {}))[2][ma_mh] = so_sv_thieu
+    return courses, list(rows.values())
+
+
 @app.route('/admin/reports/missing_grade', methods=['GET'])
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_report_missing_grade():
-    danh_sach_mon_hoc = MonHoc.query.order_by(MonHoc.ten_mh).all()
+    danh_sach_mon_hoc = list_courses()
+    danh_sach_lop = list_classes()
     selected_mh_id = request.args.get('ma_mh')
+    selected_lop = request.args.get('lop', '')
+    # Chỉ xét SV đang học cùng học kỳ với môn được chọn
+    theo_hoc_ky = request.args.get('theo_hoc_ky') == '1'
+    per_page = parse_page_size(request.args.get('per_page'), app.config['MISSING_GRADE_PAGE_SIZE'])
     results = []
     selected_mon_hoc = None
+    total_missing = 0
+    has_prev = has_next = False
 
     if selected_mh_id:
         selected_mon_hoc = MonHoc.query.get(selected_mh_id)
-        subquery_sv_da_thi = select(KetQua.ma_sv).where(KetQua.ma_mh == selected_mh_id)
-        results = SinhVien.query.where(
-            SinhVien.ma_sv.notin_(subquery_sv_da_thi)
-        ).order_by(SinhVien.lop, SinhVien.ma_sv).all()
+    if selected_mon_hoc:
+        hoc_ky = selected_mon_hoc.hoc_ky if theo_hoc_ky else None
+        query = missing_grade_query(selected_mon_hoc.ma_mh, selected_lop or None, hoc_ky)
+        results, has_prev, has_next = keyset_page(
+            query, SinhVien.ma_sv,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page
+        )
+        total_missing = _cached_report(
+            ('missing_grade_count', selected_mon_hoc.ma_mh, selected_lop, hoc_ky),
+            lambda: query.order_by(None).count()
+        )
 
     return render_template(
         'admin_report_missing_grade.html',
         danh_sach_mon_hoc=danh_sach_mon_hoc,
+        danh_sach_lop=danh_sach_lop,
         selected_mon_hoc=selected_mon_hoc,
-        results=results
+        selected_lop=selected_lop,
+        theo_hoc_ky=theo_hoc_ky,
+        per_page=per_page,
+        results=results,
+        total_missing=total_missing,
+        prev_cursor=results[0].ma_sv if has_prev and results else None,
+        next_cursor=results[-1].ma_sv if has_next and results else None
+    )
+
+
+@app.route('/admin/reports/missing_grade/matrix', methods=['GET'])
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_report_missing_grade_matrix():
+    danh_sach_lop = list_classes()
+    selected_lop = request.args.get('lop', '')
+    selected_hoc_ky = request.args.get('hoc_ky', type=int)
+
+    courses, rows = _cached_report(
+        ('missing_grade_matrix', selected_lop, selected_hoc_ky),
+        lambda: missing_grade_matrix(selected_lop or None, selected_hoc_ky)
+    )
+    danh_sach_hoc_ky = sorted({course.hoc_ky for course in list_courses()})
+
+    return render_template(
+        'admin_report_missing_grade_matrix.html',
+        danh_sach_lop=danh_sach_lop,
+        danh_sach_hoc_ky=danh_sach_hoc_ky,
+        selected_lop=selected_lop,
+        selected_hoc_ky=selected_hoc_ky,
+        courses=courses,
+        rows=rows
     )
 
+def class_gpa_summary(lop=None, khoa=None):
+    """
+    Thống kê GPA theo lớp trong một lần quét sinh_vien LEFT JOIN gpa_sinh_vien: sĩ số,
+    số SV đã có GPA, GPA trung bình hệ 10 / hệ 4 và số SV theo từng xếp loại (đếm trong SQL).
+    lop / khoa để lọc; trả về list dict theo thứ tự tên lớp.
+    """
+    stmt = select(
+        SinhVien.lop,
+        func.count(SinhVien.ma_sv),
+        func.count(GpaSinhVien.gpa_10),
+        func.avg(GpaSinhVien.gpa_10),
+        func.avg(GpaSinhVien.gpa_4),
+        *gpa_class_count_columns(GpaSinhVien.gpa_10)
+    ).select_from(SinhVien).outerjoin(
+        GpaSinhVien, SinhVien.ma_sv == GpaSinhVien.ma_sv
+    ).where(
+        SinhVien.lop.isnot(None), SinhVien.lop != ''
+    ).group_by(SinhVien.lop).order_by(SinhVien.lop)
+    if lop:
+        stmt = stmt.where(SinhVien.lop == lop)
+    if khoa:
+        stmt = stmt.where(SinhVien.khoa == khoa)
+
+    summary = []
+    for row_lop, si_so, so_sv_co_gpa, gpa_10, gpa_4, *class_counts in db.session.execute(stmt):
+        summary.append({
+            'lop': row_lop,
+            'si_so': si_so,
+            'so_sv_co_gpa': so_sv_co_gpa,
+            'gpa_10': gpa_10,
+            'gpa_4': gpa_4,
+            'xep_loai': dict(zip(GPA_CLASS_LABELS, class_counts)),
+        })
+    return summary
+
+
 @app.route('/admin/reports/class_gpa', methods=['GET'])
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_report_class_gpa():
-    lop_hoc_tuples = db.session.query(SinhVien.lop).distinct().order_by(SinhVien.lop).all()
-    danh_sach_lop = [lop[0] for lop in lop_hoc_tuples if lop[0]]
+    danh_sach_lop = list_classes()
     selected_lop = request.args.get('lop')
 
     lop_gpa_10 = None
@@ -1307,42 +2795,13 @@ def admin_report_class_gpa():
     chart_data = []
 
     if selected_lop:
-        # Subquery GPA 10
-        gpa_10_expression = calculate_gpa_expression()
-        subquery_gpa_10_sv = db.session.query(
-            SinhVien.ma_sv.label('sv_id'), gpa_10_expression
-        ).join(KetQua, SinhVien.ma_sv == KetQua.ma_sv)\
-         .join(MonHoc, KetQua.ma_mh == MonHoc.ma_mh)\
-         .filter(SinhVien.lop == selected_lop)\
-         .group_by(SinhVien.ma_sv).subquery()
-
-        # Subquery GPA 4
-        gpa_4_expression = calculate_gpa_4_expression()
-        subquery_gpa_4_sv = db.session.query(
-            SinhVien.ma_sv.label('sv_id'), gpa_4_expression
-        ).join(KetQua, SinhVien.ma_sv == KetQua.ma_sv)\
-         .join(MonHoc, KetQua.ma_mh == MonHoc.ma_mh)\
-         .filter(SinhVien.lop == selected_lop)\
-         .group_by(SinhVien.ma_sv).subquery()
-
-        # Tính AVG GPA
-        avg_gpa_10_result = db.session.query(func.avg(subquery_gpa_10_sv.c.gpa)).scalar()
-        avg_gpa_4_result = db.session.query(func.avg(subquery_gpa_4_sv.c.gpa_4)).scalar()
-        lop_gpa_10 = avg_gpa_10_result if avg_gpa_10_result else 0.0
-        lop_gpa_4 = avg_gpa_4_result if avg_gpa_4_result else 0.0
-
-        # Đếm phân loại
-        student_gpas = db.session.query(subquery_gpa_10_sv.c.gpa).all()
-        category_counts = {"Yếu": 0, "Trung bình": 0, "Khá": 0, "Giỏi": 0, "Xuất sắc": 0}
-        if student_gpas:
-            for gpa_tuple in student_gpas:
-                # Quan trọng: Kiểm tra gpa_tuple[0] có phải là None không
-                 if gpa_tuple[0] is not None:
-                      category = classify_gpa_10(gpa_tuple[0])
-                      if category in category_counts:
-                          category_counts[category] += 1
-        chart_labels = [label for label, count in category_counts.items() if count > 0]
-        chart_data = [count for label, count in category_counts.items() if count > 0]
+        # Một câu GROUP BY trả về cả GPA trung bình hai hệ và số SV theo xếp loại
+        summary = class_gpa_summary(lop=selected_lop)
+        class_row = summary[0] if summary else {'gpa_10': None, 'gpa_4': None, 'xep_loai': {}}
+        lop_gpa_10 = class_row['gpa_10'] if class_row['gpa_10'] else 0.0
+        lop_gpa_4 = class_row['gpa_4'] if class_row['gpa_4'] else 0.0
+        chart_labels = [label for label, count in class_row['xep_loai'].items() if count > 0]
+        chart_data = [count for label, count in class_row['xep_loai'].items() if count > 0]
 
     return render_template(
         'admin_report_class_gpa.html',
@@ -1355,53 +2814,135 @@ def admin_report_class_gpa():
     )
 
 
+@app.route('/admin/reports/faculty_gpa', methods=['GET'])
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_report_faculty_gpa():
+    danh_sach_khoa = list_faculties()
+    selected_khoa = request.args.get('khoa', '')
+
+    # So sánh mọi lớp (của một khoa hoặc toàn trường) trong cùng một câu truy vấn
+    summary = class_gpa_summary(khoa=selected_khoa or None)
+
+    # Dòng tổng: GPA trung bình có trọng số theo số SV đã có GPA của từng lớp
+    so_sv_co_gpa = sum(row['so_sv_co_gpa'] for row in summary)
+    totals = {
+        'si_so': sum(row['si_so'] for row in summary),
+        'so_sv_co_gpa': so_sv_co_gpa,
+        'gpa_10': sum((row['gpa_10'] or 0) * row['so_sv_co_gpa'] for row in summary) / so_sv_co_gpa if so_sv_co_gpa else None,
+        'gpa_4': sum((row['gpa_4'] or 0) * row['so_sv_co_gpa'] for row in summary) / so_sv_co_gpa if so_sv_co_gpa else None,
+        'xep_loai': {label: sum(row['xep_loai'][label] for row in summary) for label in GPA_CLASS_LABELS},
+    }
+
+    return render_template(
+        'admin_report_faculty_gpa.html',
+        danh_sach_khoa=danh_sach_khoa,
+        selected_khoa=selected_khoa,
+        summary=summary,
+        totals=totals,
+        class_labels=GPA_CLASS_LABELS
+    )
+
+
 
 # === THÊM BÁO CÁO 4: PHÂN BỐ ĐIỂM ===
+SCORE_PERCENTILES = (10, 50, 90)
+SCORE_DISTRIBUTION_GROUPS = {'ma_mh': KetQua.ma_mh, 'lop': SinhVien.lop}
+
+
+def score_distributions(ma_mh_list=None, lop_list=None, group_by='ma_mh'):
+    """
+    Phân bố điểm tổng kết của nhiều nhóm (môn hoặc lớp) cùng lúc, tính trong CSDL bằng 2 câu truy vấn:
+    - GROUP BY (nhóm, điểm chữ theo diem_chu_case): số SV từng điểm chữ, tổng và tổng bình phương điểm
+      -> trung bình, độ lệch chuẩn (mẫu);
+    - ROW_NUMBER() theo nhóm: chỉ trả về các dòng quanh P10 / P50 / P90 để nội suy tuyến tính
+      (cùng cách tính với numpy.percentile).
+    ma_mh_list / lop_list: lọc theo môn / lớp (None = tất cả). Chỉ tính các điểm tổng kết đã có.
+    Trả về OrderedDict {nhóm: {'counts': {A..F}, 'n', 'mean', 'std', 'p10', 'p50', 'p90'}} theo thứ tự nhóm.
+    """
+    group_column = SCORE_DISTRIBUTION_GROUPS[group_by]
+    score = KetQua.diem_tong_ket
+    conditions = [score.isnot(None)]
+    if ma_mh_list:
+        conditions.append(KetQua.ma_mh.in_(ma_mh_list))
+    if lop_list:
+        conditions.append(SinhVien.lop.in_(lop_list))
+
+    def from_ket_qua(stmt):
+        if group_by == 'lop' or lop_list:
+            stmt = stmt.join(SinhVien, SinhVien.ma_sv == KetQua.ma_sv)
+        return stmt.where(*conditions)
+
+    letter = diem_chu_case(score)
+    histogram = from_ket_qua(select(
+        group_column, letter, func.count(), func.sum(score), func.sum(score * score)
+    ).select_from(KetQua)).group_by(group_column, letter).order_by(group_column)
+
+    distributions = OrderedDict()
+    for group, letter_grade, count, total, total_squares in db.session.execute(histogram):
+        entry = distributions.setdefault(group, {
+            'counts': dict.fromkeys(LETTER_GRADES, 0), 'n': 0, 'sum': 0.0, 'sum_squares': 0.0
+        })
+        entry['counts'][letter_grade] = count
+        entry['n'] += count
+        entry['sum'] += total
+        entry['sum_squares'] += total_squares
+    if not distributions:
+        return distributions
+
+    ranked = from_ket_qua(select(
+        group_column.label('nhom'),
+        score.label('diem'),
+        func.row_number().over(partition_by=group_column, order_by=score).label('hang'),
+        func.count().over(partition_by=group_column).label('n')
+    ).select_from(KetQua)).subquery()
+    # Hạng (tính từ 1) của dòng ngay dưới vị trí phân vị p: floor(p * (n - 1) / 100) + 1 (chia nguyên)
+    lower_ranks = [(percentile * (ranked.c.n - 1)) // 100 + 1 for percentile in SCORE_PERCENTILES]
+    around_percentiles = select(ranked.c.nhom, ranked.c.hang, ranked.c.diem).where(
+        or_(*[ranked.c.hang.between(rank, rank + 1) for rank in lower_ranks])
+    )
+    scores_at_rank = {}
+    for group, rank, value in db.session.execute(around_percentiles):
+        scores_at_rank.setdefault(group, {})[rank] = value
+
+    for group, entry in distributions.items():
+        n = entry['n']
+        mean = entry.pop('sum') / n
+        variance = (entry.pop('sum_squares') - n * mean * mean) / (n - 1) if n > 1 else 0.0
+        entry['mean'] = mean
+        entry['std'] = max(variance, 0.0) ** 0.5
+        ranks = scores_at_rank[group]
+        for percentile in SCORE_PERCENTILES:
+            position = percentile * (n - 1) / 100
+            lower = int(position)
+            value = ranks[lower + 1]
+            if lower + 2 in ranks:
+                value += (position - lower) * (ranks[lower + 2] - value)
+            entry[f'p{percentile}'] = value
+    return distributions
+
+
 @app.route('/admin/reports/score_distribution', methods=['GET'])
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_report_score_distribution():
     # Lấy danh sách môn học cho dropdown
-    danh_sach_mon_hoc = MonHoc.query.order_by(MonHoc.ten_mh).all()
+    danh_sach_mon_hoc = list_courses()
     selected_mh_id = request.args.get('ma_mh') # Lấy MaMH từ URL
 
     selected_mon_hoc = None
     chart_labels = []
     chart_data = []
+    stats = None
 
     if selected_mh_id:
         selected_mon_hoc = MonHoc.query.get(selected_mh_id)
         if selected_mon_hoc:
-            # 1. Lấy tất cả điểm tổng kết (đã có) của môn này
-            scores_raw = db.session.query(
-                KetQua.diem_tong_ket
-            ).filter(
-                KetQua.ma_mh == selected_mh_id,
-                KetQua.diem_tong_ket.isnot(None) # Chỉ lấy những SV đã có điểm TK
-            ).all()
-
-            # 2. Phân loại điểm
-            # Dùng hàm convert_10_to_letter đã định nghĩa
-            score_distribution = {
-                "A": 0, "B+": 0, "B": 0, "C+": 0, "C": 0, "D+": 0, "D": 0, "F": 0
-            }
-            total_students = 0
-
-            if scores_raw:
-                for score_tuple in scores_raw:
-                    diem_10 = score_tuple[0]
-                    letter_grade = convert_10_to_letter(diem_10) # Dùng helper
-                    if letter_grade in score_distribution:
-                        score_distribution[letter_grade] += 1
-                        total_students += 1
-
-            # 3. Chuẩn bị dữ liệu cho biểu đồ (chỉ lấy loại có SV)
-            if total_students > 0:
-                # Sắp xếp theo thứ tự điểm (A -> F)
-                ordered_keys = ["A", "B+", "B", "C+", "C", "D+", "D", "F"]
-                for key in ordered_keys:
-                    count = score_distribution[key]
-                    # Chỉ thêm vào biểu đồ nếu có SV
+            # Đếm theo điểm chữ và tính thống kê ngay trong CSDL (chỉ SV đã có điểm TK)
+            stats = score_distributions([selected_mh_id]).get(selected_mh_id)
+            if stats:
+                # Thứ tự A -> F, chỉ lấy loại có SV
+                for key, count in stats['counts'].items():
                     if count > 0:
                         chart_labels.append(key)
                         chart_data.append(count)
@@ -1411,7 +2952,41 @@ def admin_report_score_distribution():
         danh_sach_mon_hoc=danh_sach_mon_hoc,
         selected_mon_hoc=selected_mon_hoc,
         chart_labels=chart_labels,
-        chart_data=chart_data
+        chart_data=chart_data,
+        stats=stats
+    )
+
+
+@app.route('/admin/reports/score_distribution/compare', methods=['GET'])
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_report_score_distribution_compare():
+    """So sánh phân bố điểm của nhiều môn hoặc nhiều lớp trong một request (format=json cho dashboard)."""
+    group_by = request.args.get('group_by', 'ma_mh')
+    if group_by not in SCORE_DISTRIBUTION_GROUPS:
+        group_by = 'ma_mh'
+    selected_mh_ids = [ma_mh for ma_mh in request.args.getlist('ma_mh') if ma_mh]
+    selected_lops = [lop for lop in request.args.getlist('lop') if lop]
+
+    distributions = score_distributions(selected_mh_ids or None, selected_lops or None, group_by)
+
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'group_by': group_by,
+            'letters': list(LETTER_GRADES),
+            'groups': [dict(stats, nhom=group) for group, stats in distributions.items()],
+        })
+
+    return render_template(
+        'admin_report_score_distribution_compare.html',
+        danh_sach_mon_hoc=list_courses(),
+        danh_sach_lop=list_classes(),
+        group_by=group_by,
+        selected_mh_ids=selected_mh_ids,
+        selected_lops=selected_lops,
+        distributions=distributions,
+        letters=LETTER_GRADES,
+        percentiles=SCORE_PERCENTILES
     )
 # ========================================
 
@@ -1421,8 +2996,7 @@ def admin_report_score_distribution():
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_send_notification():
-    lop_hoc_tuples = db.session.query(SinhVien.lop).distinct().order_by(SinhVien.lop).all()
-    danh_sach_lop = [lop[0] for lop in lop_hoc_tuples if lop[0]]
+    danh_sach_lop = list_classes()
 
     if request.method == 'POST':
         try:
@@ -1451,6 +3025,268 @@ def admin_send_notification():
 
     return render_template('admin_send_notification.html', danh_sach_lop=danh_sach_lop)
 
+# === ĐỌC TỆP TẢI LÊN THEO LUỒNG (XLSX / CSV) ===
+IMPORT_CHUNK_SIZE = 1000 # Số dòng xử lý mỗi lô khi nhập tệp lớn
+
+
+def _clean_cell(value):
+    """Chuẩn hóa ô trống (None, chuỗi rỗng, NaN) thành None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    if isinstance(value, float) and value != value: # NaN
+        return None
+    return value
+
+
+def iter_upload_rows(file_storage):
+    """
+    Đọc tệp .xlsx/.csv (hoặc .xls qua pandas) từng dòng một mà không nạp cả tệp vào bộ nhớ.
+    Yield (số dòng trong tệp, dict {tên cột: giá trị}); dòng 1 là tiêu đề.
+    """
+    filename = file_storage.filename.lower()
+    if filename.endswith('.csv'):
+        reader = csv.reader(io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline=''))
+    elif filename.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_storage.stream, read_only=True, data_only=True)
+        reader = workbook.active.iter_rows(values_only=True)
+    else:
+        # .xls không hỗ trợ đọc theo luồng, dùng pandas như trước
+        import pandas as pd
+        df = pd.read_excel(file_storage, dtype=object)
+        reader = chain([list(df.columns)], df.itertuples(index=False, name=None))
+
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [str(col).strip() if col is not None else '' for col in header]
+    for row_number, values in enumerate(reader, start=2):
+        row = {col: _clean_cell(value) for col, value in zip(columns, values) if col}
+        if any(value is not None for value in row.values()):
+            yield row_number, row
+
+
+def iter_upload_columns(file_storage):
+    """Chỉ đọc dòng tiêu đề của tệp tải lên (để kiểm tra cột bắt buộc)."""
+    filename = file_storage.filename.lower()
+    if filename.endswith('.csv'):
+        text_stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+        header = next(csv.reader(text_stream), [])
+        text_stream.detach() # Không để TextIOWrapper đóng luồng gốc
+        file_storage.stream.seek(0)
+    elif filename.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_storage.stream, read_only=True, data_only=True)
+        header = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+        workbook.close()
+        file_storage.stream.seek(0)
+    else:
+        import pandas as pd
+        header = list(pd.read_excel(file_storage, nrows=0).columns)
+        file_storage.stream.seek(0)
+    return [str(col).strip() for col in header if col is not None]
+
+
+def iter_chunks(iterable, size):
+    """Gom một iterable thành từng list có tối đa `size` phần tử."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+GRADE_IMPORT_COLUMNS = [('diem_chuyen_can', 'cc'), ('diem_giua_ky', 'gk'), ('diem_cuoi_ky', 'ck')]
+
+
+def import_grades_stream(rows, ma_mh, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Nhập điểm theo lô: mỗi lô được kiểm tra điểm bằng pandas (vector hóa), tra cứu SV và
+    điểm hiện có bằng một câu IN, rồi UPSERT hàng loạt qua save_grades_bulk.
+    rows: iterable (số dòng, dict) từ iter_upload_rows.
+    progress: hàm tùy chọn, được gọi sau mỗi lô với số dòng đã xử lý.
+    Trả về (created_count, updated_count, skipped_count, errors).
+    """
+    import pandas as pd # Nạp khi cần để không làm chậm khởi động nguội
+    created_count = 0
+    updated_count = 0
+    skipped_count = 0
+    errors = []
+    processed_rows = 0
+    weights = course_weights(ma_mh)
+
+    for chunk in iter_chunks(rows, chunk_size):
+        frame = pd.DataFrame(
+            [row for _, row in chunk],
+            columns=['ma_sinh_vien'] + [col for col, _ in GRADE_IMPORT_COLUMNS]
+        )
+        frame.index = [row_number for row_number, _ in chunk]
+        chunk_errors = []
+
+        ma_sv_series = frame['ma_sinh_vien'].map(lambda v: str(v).strip() if pd.notna(v) else None)
+        has_ma_sv = ma_sv_series.notna() & (ma_sv_series != '')
+        skipped_count += int((~has_ma_sv).sum())
+
+        # Kiểm tra điểm cả lô cùng lúc: ô có giá trị nhưng không phải số 0-10 là lỗi
+        scores = {}
+        for col_name, key in GRADE_IMPORT_COLUMNS:
+            raw = frame[col_name]
+            numeric = pd.to_numeric(raw, errors='coerce')
+            invalid = raw.notna() & (numeric.isna() | (numeric < 0) | (numeric > 10)) & has_ma_sv
+            for row_number in frame.index[invalid]:
+                chunk_errors.append((row_number, f"Dòng {row_number}: Điểm '{col_name}' ('{raw[row_number]}') của SV '{ma_sv_series[row_number]}' không hợp lệ. Bản ghi này có thể không được tính điểm tổng kết."))
+            scores[key] = numeric.where(~invalid)
+
+        # Gộp các dòng trùng mã SV trong cùng lô (dòng sau ghi đè điểm khác None của dòng trước)
+        scores_by_sv = {}
+        first_row_of = {}
+        for row_number in frame.index[has_ma_sv]:
+            ma_sv = ma_sv_series[row_number]
+            entry = scores_by_sv.setdefault(ma_sv, {'cc': None, 'gk': None, 'ck': None})
+            first_row_of.setdefault(ma_sv, row_number)
+            for key in ('cc', 'gk', 'ck'):
+                value = scores[key][row_number]
+                if pd.notna(value):
+                    entry[key] = float(value)
+
+        created, updated, missing_ma_sv = save_grades_bulk(ma_mh, scores_by_sv, weights)
+        created_count += created
+        updated_count += updated
+        for ma_sv in missing_ma_sv:
+            row_number = first_row_of[ma_sv]
+            chunk_errors.append((row_number, f"Dòng {row_number}: Mã SV '{ma_sv}' không tồn tại. Bỏ qua."))
+
+        errors.extend(message for _, message in sorted(chunk_errors, key=lambda item: item[0]))
+
+        processed_rows += len(chunk)
+        if progress is not None:
+            progress(processed_rows)
+
+    return created_count, updated_count, skipped_count, errors
+
+
+# === BĂM MẬT KHẨU & NHẬP SINH VIÊN HÀNG LOẠT ===
+BULK_HASH_MIN_PARALLEL = 16 # Dưới ngưỡng này băm tuần tự cho nhanh hơn việc tạo pool
+
+
+def _bcrypt_hash(job):
+    """Hàm chạy trong tiến trình con: băm một mật khẩu với số vòng cho trước."""
+    import bcrypt as bcrypt_backend
+    password, rounds = job
+    return bcrypt_backend.hashpw(password.encode('utf-8'), bcrypt_backend.gensalt(rounds)).decode('utf-8')
+
+
+def hash_passwords_bulk(passwords, rounds=None):
+    """
+    Băm nhiều mật khẩu song song trên mọi lõi CPU bằng process pool.
+    Kết quả tương thích với TaiKhoan.check_password (cùng định dạng bcrypt).
+    Nếu môi trường không cho tạo tiến trình con (serverless), dùng thread pool
+    vì bcrypt nhả GIL trong lúc băm.
+    """
+    if rounds is None:
+        rounds = app.config['BULK_BCRYPT_LOG_ROUNDS']
+    jobs = [(password, rounds) for password in passwords]
+    if len(jobs) < BULK_HASH_MIN_PARALLEL:
+        return [_bcrypt_hash(job) for job in jobs]
+
+    # multiprocessing chỉ được nạp khi thực sự băm hàng loạt
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = os.cpu_count() or 1
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_bcrypt_hash, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    except (OSError, NotImplementedError, BrokenProcessPool) as exc:
+        print(f"[Bulk hash] Process pool unavailable ({exc}), falling back to threads")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_bcrypt_hash, jobs))
+
+
+def _optional_str(row, column):
+    value = row.get(column)
+    return None if value is None else str(value)
+
+
+def import_students_stream(rows, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Tạo hàng loạt tài khoản + hồ sơ SV theo lô: mỗi lô kiểm tra mã SV đã tồn tại bằng
+    một câu IN, băm mật khẩu song song, rồi INSERT hàng loạt tai_khoan và sinh_vien.
+    rows: iterable (số dòng, dict) từ iter_upload_rows.
+    progress: hàm tùy chọn, được gọi sau mỗi lô với số dòng đã xử lý.
+    Trả về (created_count, errors).
+    """
+    import pandas as pd # Nạp khi cần để không làm chậm khởi động nguội
+    created_count = 0
+    errors = []
+    seen_ma_sv = set()
+    processed_rows = 0
+
+    for chunk in iter_chunks(rows, chunk_size):
+        candidates = []
+        for row_number, row in chunk:
+            ma_sv = _optional_str(row, 'ma_sinh_vien')
+            role_str = str(row.get('role')).upper()
+            if role_str != 'SINHVIEN':
+                errors.append(f'Dòng {row_number}: Vai trò "{role_str}" không hợp lệ. Bỏ qua.')
+                continue
+            if not ma_sv or row.get('ten_sinh_vien') is None:
+                errors.append(f'Dòng {row_number}: Thiếu mã SV hoặc tên SV. Bỏ qua.')
+                continue
+            candidates.append((row_number, ma_sv, row))
+
+        existing_usernames = set(db.session.execute(
+            select(TaiKhoan.username).where(TaiKhoan.username.in_([ma_sv for _, ma_sv, _ in candidates]))
+        ).scalars()) if candidates else set()
+
+        accepted = []
+        for row_number, ma_sv, row in candidates:
+            if ma_sv in existing_usernames or ma_sv in seen_ma_sv:
+                errors.append(f'Dòng {row_number}: Mã SV "{ma_sv}" đã tồn tại. Bỏ qua.')
+                continue
+            seen_ma_sv.add(ma_sv)
+            accepted.append((ma_sv, row))
+        processed_rows += len(chunk)
+        if not accepted:
+            if progress is not None:
+                progress(processed_rows)
+            continue
+
+        password_hashes = hash_passwords_bulk([str(row.get('password')) for _, row in accepted])
+
+        account_rows = []
+        student_rows = []
+        for (ma_sv, row), password_hash in zip(accepted, password_hashes):
+            ngay_sinh = pd.to_datetime(row.get('ngay_sinh'), errors='coerce')
+            account_rows.append({'username': ma_sv, 'password': password_hash, 'vai_tro': VaiTroEnum.SINHVIEN})
+            student_rows.append({
+                'ma_sv': ma_sv,
+                'ho_ten': _optional_str(row, 'ten_sinh_vien'),
+                'lop': _optional_str(row, 'lop'),
+                'khoa': _optional_str(row, 'khoa'),
+                'email': _optional_str(row, 'email'),
+                'location': _optional_str(row, 'location'),
+                'ngay_sinh': None if pd.isna(ngay_sinh) else ngay_sinh.date()
+            })
+
+        db.session.execute(insert(TaiKhoan.__table__), account_rows)
+        db.session.execute(insert(SinhVien.__table__), student_rows)
+        # INSERT Core không đi qua after_flush
+        student_count_cache.clear()
+        invalidate_on_commit(db.session, reference_versions, ['sinh_vien'])
+        created_count += len(student_rows)
+        if progress is not None:
+            progress(processed_rows)
+
+    return created_count, errors
+
+
 # 4.8. Nhập Excel Sinh viên
 @app.route('/admin/import_students', methods=['GET', 'POST'])
 @login_required
@@ -1465,51 +3301,20 @@ def admin_import_students():
             flash('Chưa chọn tệp.', 'danger')
             return redirect(request.url)
 
-        if file and file.filename.endswith(('.xls', '.xlsx')):
+        if file and file.filename.lower().endswith(('.xls', '.xlsx', '.csv')):
             try:
-                df = pd.read_excel(file)
                 required_columns = ['ma_sinh_vien', 'ten_sinh_vien', 'password', 'role']
-                if not all(col in df.columns for col in required_columns):
+                columns = iter_upload_columns(file)
+                if not all(col in columns for col in required_columns):
                     flash(f'Lỗi: File Excel phải chứa các cột: {", ".join(required_columns)}', 'danger')
                     return redirect(request.url)
 
-                created_count = 0
-                errors = []
-                for index, row in df.iterrows():
-                    ma_sv = str(row['ma_sinh_vien'])
-                    ten_sv = str(row['ten_sinh_vien'])
-                    password = str(row['password'])
-                    role_str = str(row['role']).upper()
-
-                    if role_str != 'SINHVIEN':
-                        errors.append(f'Dòng {index+2}: Vai trò "{role_str}" không hợp lệ. Bỏ qua.')
-                        continue
-                    existing_user = TaiKhoan.query.get(ma_sv)
-                    if existing_user:
-                        errors.append(f'Dòng {index+2}: Mã SV "{ma_sv}" đã tồn tại. Bỏ qua.')
-                        continue
+                # Chạy nền: lưu tệp vào hàng đợi và trả về mã công việc ngay
+                if request.form.get('background'):
+                    job_id = enqueue_job('import_students', upload=file)
+                    return job_accepted_response(job_id)
 
-                    new_account = TaiKhoan(username=ma_sv, vai_tro=VaiTroEnum.SINHVIEN)
-                    new_account.set_password(password)
-
-                    lop_val = row.get('lop', None)
-                    khoa_val = row.get('khoa', None)
-                    email_val = row.get('email', None)
-                    location_val = row.get('location', None)
-                    ngay_sinh_val = row.get('ngay_sinh', None)
-                    ngay_sinh_final = None if pd.isna(ngay_sinh_val) else pd.to_datetime(ngay_sinh_val)
-
-                    new_student = SinhVien(
-                        ma_sv=ma_sv, ho_ten=ten_sv,
-                        lop = None if pd.isna(lop_val) else str(lop_val),
-                        khoa = None if pd.isna(khoa_val) else str(khoa_val),
-                        email = None if pd.isna(email_val) else str(email_val),
-                        location = None if pd.isna(location_val) else str(location_val),
-                        ngay_sinh = ngay_sinh_final
-                    )
-                    db.session.add(new_account)
-                    db.session.add(new_student)
-                    created_count += 1
+                created_count, errors = import_students_stream(iter_upload_rows(file))
 
                 db.session.commit()
                 flash(f'Nhập file thành công! Đã thêm mới {created_count} sinh viên.', 'success')
@@ -1529,7 +3334,7 @@ def admin_import_students():
 @login_required
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_import_grades():
-    danh_sach_mon_hoc = MonHoc.query.order_by(MonHoc.ten_mh).all()
+    danh_sach_mon_hoc = list_courses()
 
     if request.method == 'POST':
         if 'file' not in request.files:
@@ -1541,71 +3346,24 @@ def admin_import_grades():
             flash('Vui lòng chọn Môn học và tệp Excel.', 'danger')
             return redirect(request.url)
 
-        if file and file.filename.endswith(('.xls', '.xlsx')):
+        if file and file.filename.lower().endswith(('.xls', '.xlsx', '.csv')):
             try:
-                df = pd.read_excel(file)
                 # Yêu cầu 4 cột: ma_sv và 3 điểm thành phần
                 required_columns = ['ma_sinh_vien', 'diem_chuyen_can', 'diem_giua_ky', 'diem_cuoi_ky']
-                if not all(col in df.columns for col in required_columns):
+                columns = iter_upload_columns(file)
+                if not all(col in columns for col in required_columns):
                     flash(f'Lỗi: File Excel phải chứa các cột: {", ".join(required_columns)}', 'danger')
                     return redirect(request.url)
 
-                updated_count = 0
-                created_count = 0
-                errors = []
-                skipped_count = 0
-                for index, row in df.iterrows():
-                    ma_sv = str(row['ma_sinh_vien']).strip() if pd.notna(row['ma_sinh_vien']) else None
-                    if not ma_sv: skipped_count += 1; continue
-
-                    # Lấy và validate từng điểm thành phần
-                    diem_cc, diem_gk, diem_ck = None, None, None
-                    valid_scores = True
-                    for col_name, score_var_name in [('diem_chuyen_can', 'diem_cc'), ('diem_giua_ky', 'diem_gk'), ('diem_cuoi_ky', 'diem_ck')]:
-                        score_val = row.get(col_name, None)
-                        temp_score = None
-                        if pd.notna(score_val): # Chỉ xử lý nếu ô không trống
-                            try:
-                                temp_score = float(score_val)
-                                if not (0 <= temp_score <= 10):
-                                    raise ValueError("Điểm không hợp lệ")
-                                # Gán giá trị hợp lệ
-                                if score_var_name == 'diem_cc': diem_cc = temp_score
-                                elif score_var_name == 'diem_gk': diem_gk = temp_score
-                                elif score_var_name == 'diem_ck': diem_ck = temp_score
-                            except (ValueError, TypeError):
-                                errors.append(f"Dòng {index+2}: Điểm '{col_name}' ('{score_val}') của SV '{ma_sv}' không hợp lệ. Bản ghi này có thể không được tính điểm tổng kết.")
-                                valid_scores = False # Đánh dấu nếu có điểm thành phần không hợp lệ
-                                # Không gán giá trị không hợp lệ
-                        # else: # Giữ None nếu ô trống
-
-                    student_exists = SinhVien.query.get(ma_sv)
-                    if not student_exists:
-                        errors.append(f"Dòng {index+2}: Mã SV '{ma_sv}' không tồn tại. Bỏ qua.")
-                        continue
+                # Chạy nền: lưu tệp vào hàng đợi và trả về mã công việc ngay
+                if request.form.get('background'):
+                    job_id = enqueue_job('import_grades', params={'ma_mh': selected_mh}, upload=file)
+                    return job_accepted_response(job_id)
 
-                    existing_grade = KetQua.query.get((ma_sv, selected_mh))
-                    if existing_grade:
-                         # Chỉ update nếu có điểm mới từ file và khác điểm cũ
-                         changed = False
-                         if diem_cc is not None and existing_grade.diem_chuyen_can != diem_cc:
-                              existing_grade.diem_chuyen_can = diem_cc; changed=True
-                         if diem_gk is not None and existing_grade.diem_giua_ky != diem_gk:
-                              existing_grade.diem_giua_ky = diem_gk; changed=True
-                         if diem_ck is not None and existing_grade.diem_cuoi_ky != diem_ck:
-                              existing_grade.diem_cuoi_ky = diem_ck; changed=True
-
-                         if changed:
-                              existing_grade.calculate_final_score() # Tính lại điểm TK
-                              updated_count += 1
-                    else:
-                        new_grade = KetQua(ma_sv=ma_sv, ma_mh=selected_mh,
-                                           diem_chuyen_can=diem_cc,
-                                           diem_giua_ky=diem_gk,
-                                           diem_cuoi_ky=diem_ck)
-                        new_grade.calculate_final_score() # Tính điểm TK
-                        db.session.add(new_grade)
-                        created_count += 1
+                # Đọc và ghi theo lô, không nạp toàn bộ tệp vào bộ nhớ
+                created_count, updated_count, skipped_count, errors = import_grades_stream(
+                    iter_upload_rows(file), selected_mh
+                )
 
                 if updated_count > 0 or created_count > 0:
                      db.session.commit()
@@ -1621,7 +3379,7 @@ def admin_import_grades():
 
             return redirect(url_for('admin_manage_grades'))
         else:
-             flash('Lỗi: Định dạng file không được hỗ trợ. Chỉ chấp nhận .xls hoặc .xlsx', 'danger')
+             flash('Lỗi: Định dạng file không được hỗ trợ. Chỉ chấp nhận .xls, .xlsx hoặc .csv', 'danger')
              return redirect(request.url)
 
     return render_template('admin_import_grades.html', danh_sach_mon_hoc=danh_sach_mon_hoc)
@@ -1634,18 +3392,270 @@ def admin_import_grades():
 def admin_export_grades():
     """Trang hiển thị dropdown để chọn Lớp VÀ Môn học."""
     # Lấy danh sách lớp
-    lop_hoc_tuples = db.session.query(SinhVien.lop).distinct().order_by(SinhVien.lop).all()
-    danh_sach_lop = [lop[0] for lop in lop_hoc_tuples if lop[0]]
+    danh_sach_lop = list_classes()
     # Lấy danh sách môn học
-    danh_sach_mon_hoc = MonHoc.query.order_by(MonHoc.ten_mh).all()
+    danh_sach_mon_hoc = list_courses()
 
     return render_template(
         'admin_export_grades.html',
         danh_sach_lop=danh_sach_lop,
-        danh_sach_mon_hoc=danh_sach_mon_hoc # Gửi thêm danh sách môn học
+        danh_sach_mon_hoc=danh_sach_mon_hoc, # Gửi thêm danh sách môn học
+        parquet_available=parquet_export_available()
     )
 # ========================================================
 
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# === XUẤT FILE THEO LUỒNG (XLSX / CSV / PARQUET) ===
+# Dữ liệu được đọc theo lô (yield_per) và ghi thẳng từng dòng vào một SpooledTemporaryFile
+# (nằm trong RAM tới EXPORT_SPOOL_MAX_SIZE rồi tự chuyển xuống đĩa), nên bộ nhớ không
+# tăng theo số dòng xuất. Parquet cần thư viện tùy chọn pyarrow.
+EXPORT_FORMATS = {
+    'xlsx': (XLSX_MIMETYPE, 'xlsx'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+EXPORT_BATCH_SIZE = 1000 # Số dòng đọc từ CSDL mỗi lô khi xuất file
+
+GRADE_EXPORT_COLUMNS = [
+    ('Mã SV', 'str'), ('Họ tên', 'str'), ('Lớp', 'str'), ('Mã MH', 'str'), ('Tên Môn học', 'str'),
+    ('Số TC', 'int'), ('Điểm CC', 'float'), ('Điểm GK', 'float'), ('Điểm CK', 'float'),
+    ('Điểm TK (10)', 'float'), ('Điểm Chữ', 'str'),
+]
+STUDENT_EXPORT_COLUMNS = [
+    ('Mã SV', 'str'), ('Họ tên', 'str'), ('Ngày sinh', 'str'), ('Lớp', 'str'),
+    ('Khoa', 'str'), ('Email', 'str'), ('Địa chỉ (Location)', 'str'),
+]
+
+
+_parquet_available = None
+
+
+def parquet_export_available():
+    """Đã cài pyarrow hay chưa (chỉ tìm module, không nạp; kiểm tra một lần mỗi tiến trình)."""
+    global _parquet_available
+    if _parquet_available is None:
+        import importlib.util
+        _parquet_available = importlib.util.find_spec('pyarrow') is not None
+    return _parquet_available
+
+
+def export_format(value):
+    """Chuẩn hóa tham số định dạng xuất file (mặc định xlsx)."""
+    value = (value or 'xlsx').lower()
+    return value if value in EXPORT_FORMATS else 'xlsx'
+
+
+def _write_csv(output, columns, rows):
+    text_stream = io.TextIOWrapper(output, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text_stream)
+    writer.writerow([name for name, _ in columns])
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    text_stream.flush()
+    text_stream.detach() # Giữ file gốc mở để trả về
+    return count
+
+
+def _write_xlsx(output, columns, rows, sheet_name):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True) # Chế độ ghi tuần tự, không giữ cả sheet trong RAM
+    sheet = workbook.create_sheet(sheet_name[:31])
+    sheet.append([name for name, _ in columns])
+    count = 0
+    for row in rows:
+        sheet.append(list(row))
+        count += 1
+    workbook.save(output)
+    return count
+
+
+def _write_parquet(output, columns, rows):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Xuất Parquet cần cài thêm thư viện pyarrow (pip install pyarrow).')
+    types = {'str': pa.string(), 'int': pa.int64(), 'float': pa.float64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    count = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        for batch in iter_chunks(rows, EXPORT_BATCH_SIZE):
+            writer.write_table(pa.Table.from_pylist(
+                [dict(zip(schema.names, row)) for row in batch], schema=schema
+            ))
+            count += len(batch)
+    return count
+
+
+def write_export(rows, columns, fmt, sheet_name='Sheet1'):
+    """
+    Ghi rows (iterable các tuple theo thứ tự columns) ra file tạm theo định dạng fmt.
+    Trả về (file đã seek(0), số dòng dữ liệu). Gọi viên chịu trách nhiệm đóng file.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=app.config['EXPORT_SPOOL_MAX_SIZE'])
+    try:
+        if fmt == 'csv':
+            count = _write_csv(output, columns, rows)
+        elif fmt == 'parquet':
+            count = _write_parquet(output, columns, rows)
+        else:
+            count = _write_xlsx(output, columns, rows, sheet_name)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output, count
+
+
+def build_grades_export(selected_lop, selected_mh_id, fmt='xlsx'):
+    """
+    Tạo file điểm DẠNG DÀI (đã lọc) theo luồng.
+    Trả về (file, tên file tải về), hoặc (None, thông báo) nếu không có dữ liệu.
+    """
+    fmt = export_format(fmt)
+    # Chỉ lấy các bản ghi điểm đã có (SV chưa học môn nào không xuất hiện trong file)
+    query = select(
+        SinhVien.ma_sv,
+        SinhVien.ho_ten,
+        SinhVien.lop,
+        MonHoc.ma_mh,
+        MonHoc.ten_mh,
+        MonHoc.so_tin_chi,
+        KetQua.diem_chuyen_can,
+        KetQua.diem_giua_ky,
+        KetQua.diem_cuoi_ky,
+        KetQua.diem_tong_ket,
+        KetQua.diem_chu
+    ).select_from(KetQua).join(
+        SinhVien, SinhVien.ma_sv == KetQua.ma_sv
+    ).join(
+        MonHoc, KetQua.ma_mh == MonHoc.ma_mh
+    )
+
+    # Xây dựng tên file
+    file_lop_name = "ALL"
+    file_mh_name = "ALL"
+
+    # 1. Áp dụng bộ lọc Lớp (nếu người dùng chọn 1 lớp cụ thể)
+    if selected_lop and selected_lop != 'all':
+        query = query.where(SinhVien.lop == selected_lop)
+        file_lop_name = selected_lop.replace(" ", "_")
+
+    # 2. Áp dụng bộ lọc Môn học (nếu người dùng chọn 1 môn cụ thể)
+    if selected_mh_id and selected_mh_id != 'all':
+        query = query.where(KetQua.ma_mh == selected_mh_id)
+        file_mh_name = selected_mh_id.replace(" ", "_")
+
+    query = query.order_by(SinhVien.lop, SinhVien.ma_sv, MonHoc.ma_mh)
+    rows = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    output, count = write_export(rows, GRADE_EXPORT_COLUMNS, fmt, sheet_name=f'Diem_{file_lop_name}')
+    if count == 0:
+        output.close()
+        return None, 'Không tìm thấy dữ liệu điểm nào cho lựa chọn của bạn.'
+    return output, f'BangDiem_Lop_{file_lop_name}_Mon_{file_mh_name}.{EXPORT_FORMATS[fmt][1]}'
+
+
+def build_gradebook_export(selected_lop, selected_mh_id, fmt='xlsx'):
+    """
+    Tạo bảng điểm DẠNG RỘNG: mỗi SV một dòng, mỗi môn một nhóm cột (điểm TK, điểm chữ),
+    thêm GPA từng học kỳ và GPA tích lũy (lấy từ bảng GPA tổng hợp).
+    Dữ liệu lấy bằng một truy vấn JOIN duy nhất rồi pivot bằng pandas.
+    Trả về (file, tên file tải về), hoặc (None, thông báo) nếu không có dữ liệu.
+    """
+    import pandas as pd # Nạp khi cần để không làm chậm khởi động nguội
+    fmt = export_format(fmt)
+    query = select(
+        SinhVien.ma_sv,
+        SinhVien.ho_ten,
+        SinhVien.lop,
+        MonHoc.ma_mh,
+        MonHoc.hoc_ky,
+        KetQua.diem_tong_ket,
+        KetQua.diem_chu,
+        func.round(GpaHocKy.gpa_10, 2).label('gpa_hoc_ky'),
+        func.round(GpaSinhVien.gpa_10, 2).label('gpa_10'),
+        func.round(GpaSinhVien.gpa_4, 2).label('gpa_4'),
+        GpaSinhVien.tong_tin_chi
+    ).select_from(KetQua).join(
+        SinhVien, SinhVien.ma_sv == KetQua.ma_sv
+    ).join(
+        MonHoc, KetQua.ma_mh == MonHoc.ma_mh
+    ).outerjoin(
+        GpaHocKy, and_(GpaHocKy.ma_sv == KetQua.ma_sv, GpaHocKy.hoc_ky == MonHoc.hoc_ky)
+    ).outerjoin(
+        GpaSinhVien, GpaSinhVien.ma_sv == KetQua.ma_sv
+    )
+
+    file_lop_name = "ALL"
+    file_mh_name = "ALL"
+    if selected_lop and selected_lop != 'all':
+        query = query.where(SinhVien.lop == selected_lop)
+        file_lop_name = selected_lop.replace(" ", "_")
+    if selected_mh_id and selected_mh_id != 'all':
+        query = query.where(KetQua.ma_mh == selected_mh_id)
+        file_mh_name = selected_mh_id.replace(" ", "_")
+
+    long_df = pd.read_sql(query, db.session.connection())
+    if long_df.empty:
+        return None, 'Không tìm thấy dữ liệu điểm nào cho lựa chọn của bạn.'
+
+    # Pivot chỉ theo ma_sv (không bao giờ NULL): pandas bỏ các nhóm có khóa NaN,
+    # nên SV chưa có lớp / họ tên sẽ bị mất nếu đưa lop, ho_ten vào khóa pivot
+    students = long_df.groupby('ma_sv')[['lop', 'ho_ten']].first()
+    # Nhóm cột theo môn (sắp theo học kỳ rồi mã môn): điểm TK rồi điểm chữ
+    courses = long_df[['hoc_ky', 'ma_mh']].drop_duplicates().sort_values(['hoc_ky', 'ma_mh'])['ma_mh'].tolist()
+    scores = long_df.pivot_table(index='ma_sv', columns='ma_mh',
+                                 values=['diem_tong_ket', 'diem_chu'], aggfunc='first')
+    scores = scores.reindex(columns=pd.MultiIndex.from_product([['diem_tong_ket', 'diem_chu'], courses]))
+    scores = scores.swaplevel(axis=1)[courses]
+    semesters = sorted(long_df['hoc_ky'].dropna().unique())
+    semester_gpa = long_df.pivot_table(index='ma_sv', columns='hoc_ky', values='gpa_hoc_ky',
+                                       aggfunc='first', dropna=False).reindex(columns=semesters)
+    cumulative = long_df.groupby('ma_sv')[['gpa_10', 'gpa_4', 'tong_tin_chi']].first()
+
+    wide = pd.concat([students, scores, semester_gpa, cumulative], axis=1)
+    wide = wide.reset_index().sort_values(['lop', 'ma_sv'], na_position='last')
+    wide = wide[['lop', 'ma_sv', 'ho_ten'] + [column for column in wide.columns if column not in ('lop', 'ma_sv', 'ho_ten')]]
+    wide = wide.astype(object).where(wide.notna(), None)
+
+    columns = [('Lớp', 'str'), ('Mã SV', 'str'), ('Họ tên', 'str')]
+    for ma_mh in courses:
+        columns += [(f'{ma_mh} - Điểm TK', 'float'), (f'{ma_mh} - Điểm Chữ', 'str')]
+    columns += [(f'GPA HK{int(hoc_ky)}', 'float') for hoc_ky in semesters]
+    columns += [('GPA tích lũy (10)', 'float'), ('GPA tích lũy (4)', 'float'), ('Tổng TC', 'int')]
+
+    output, _ = write_export(wide.itertuples(index=False, name=None), columns, fmt,
+                             sheet_name=f'BangDiem_{file_lop_name}')
+    return output, f'BangDiemTongHop_Lop_{file_lop_name}_Mon_{file_mh_name}.{EXPORT_FORMATS[fmt][1]}'
+
+
+def build_students_export(search_ma_sv='', search_ho_ten='', filter_lop='', filter_khoa='', fmt='xlsx'):
+    """Tạo file danh sách SV theo bộ lọc (theo luồng). Trả về (file, tên file) hoặc (None, thông báo)."""
+    fmt = export_format(fmt)
+    query = select(
+        SinhVien.ma_sv, SinhVien.ho_ten, SinhVien.ngay_sinh, SinhVien.lop,
+        SinhVien.khoa, SinhVien.email, SinhVien.location
+    ).where(*student_search_conditions(search_ma_sv, search_ho_ten))
+    if filter_lop: query = query.where(SinhVien.lop == filter_lop)
+    if filter_khoa: query = query.where(SinhVien.khoa == filter_khoa)
+
+    result = db.session.execute(query.order_by(SinhVien.ma_sv).execution_options(yield_per=EXPORT_BATCH_SIZE))
+    rows = (
+        (row.ma_sv, row.ho_ten, row.ngay_sinh.strftime('%d-%m-%Y') if row.ngay_sinh else '',
+         row.lop, row.khoa, row.email, row.location)
+        for row in result
+    )
+    output, count = write_export(rows, STUDENT_EXPORT_COLUMNS, fmt, sheet_name='DanhSachSinhVien')
+    if count == 0:
+        output.close()
+        return None, 'Không có dữ liệu sinh viên nào để xuất.'
+    return output, f'DanhSachSinhVien_Filtered.{EXPORT_FORMATS[fmt][1]}'
+
+
 # === THAY THẾ HÀM admin_perform_export CŨ BẰNG HÀM NÀY ===
 @app.route('/admin/export/perform', methods=['POST'])
 @login_required
@@ -1656,90 +3666,26 @@ def admin_perform_export():
         # Lấy giá trị từ form
         selected_lop = request.form.get('lop')
         selected_mh_id = request.form.get('ma_mh')
+        fmt = export_format(request.form.get('format'))
+        layout = request.form.get('layout', 'long')
 
-        # Bắt đầu truy vấn cơ sở
-        query = db.session.query(
-            SinhVien.ma_sv,
-            SinhVien.ho_ten,
-            SinhVien.lop,
-            MonHoc.ma_mh,
-            MonHoc.ten_mh,
-            MonHoc.so_tin_chi,
-            KetQua.diem_chuyen_can,
-            KetQua.diem_giua_ky,
-            KetQua.diem_cuoi_ky,
-            KetQua.diem_tong_ket,
-            KetQua.diem_chu
-        ).select_from(SinhVien).join( # Bắt đầu từ SinhVien
-            KetQua, SinhVien.ma_sv == KetQua.ma_sv, isouter=True # LEFT JOIN KetQua
-        ).join(
-             MonHoc, KetQua.ma_mh == MonHoc.ma_mh, isouter=True # LEFT JOIN MonHoc
-        )
-
-        # Xây dựng tên file
-        file_lop_name = "ALL"
-        file_mh_name = "ALL"
-
-        # 1. Áp dụng bộ lọc Lớp (nếu người dùng chọn 1 lớp cụ thể)
-        if selected_lop and selected_lop != 'all':
-            query = query.filter(SinhVien.lop == selected_lop)
-            file_lop_name = selected_lop.replace(" ", "_")
-
-        # 2. Áp dụng bộ lọc Môn học (nếu người dùng chọn 1 môn cụ thể)
-        if selected_mh_id and selected_mh_id != 'all':
-            query = query.filter(KetQua.ma_mh == selected_mh_id)
-            file_mh_name = selected_mh_id.replace(" ", "_")
-        
-        # 3. Chỉ lấy những SV có bản ghi điểm (nếu lọc theo môn hoặc cả 2)
-        #    Nếu chỉ lọc theo lớp, ta vẫn muốn lấy cả SV chưa có điểm
-        if selected_mh_id and selected_mh_id != 'all':
-             query = query.filter(KetQua.ma_sv != None) # Đảm bảo có kết quả
-
-        # Sắp xếp kết quả
-        query_results = query.order_by(SinhVien.lop, SinhVien.ma_sv, MonHoc.ma_mh).all()
-
-        if not query_results:
-            flash(f'Không tìm thấy dữ liệu điểm nào cho lựa chọn của bạn.', 'warning')
-            return redirect(url_for('admin_export_grades'))
-
-        # 4. Chuẩn bị dữ liệu cho DataFrame
-        data_for_df = []
-        for row in query_results:
-             # Bỏ qua nếu là SV trong lớp nhưng chưa có điểm môn nào (chỉ xảy ra khi lọc theo lớp)
-            if row.ma_mh is None: 
-                continue
-                
-            data_for_df.append({
-                'Mã SV': row.ma_sv,
-                'Họ tên': row.ho_ten,
-                'Lớp': row.lop,
-                'Mã MH': row.ma_mh,
-                'Tên Môn học': row.ten_mh,
-                'Số TC': row.so_tin_chi,
-                'Điểm CC': row.diem_chuyen_can,
-                'Điểm GK': row.diem_giua_ky,
-                'Điểm CK': row.diem_cuoi_ky,
-                'Điểm TK (10)': row.diem_tong_ket,
-                'Điểm Chữ': row.diem_chu
+        # Chạy nền: trả về mã công việc ngay, file sẽ được tải ở trang trạng thái
+        if request.form.get('background'):
+            job_id = enqueue_job('export_grades', params={
+                'lop': selected_lop, 'ma_mh': selected_mh_id, 'fmt': fmt, 'layout': layout
             })
-        
-        if not data_for_df:
-            flash(f'Không có dữ liệu điểm cụ thể nào được tìm thấy (có thể sinh viên trong lớp chưa học môn nào).', 'warning')
-            return redirect(url_for('admin_export_grades'))
-
-        df = pd.DataFrame(data_for_df)
+            return job_accepted_response(job_id)
 
-        # 5. Tạo file Excel
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name=f'Diem_{file_lop_name}', index=False)
-        output.seek(0)
+        build_export = build_gradebook_export if layout == 'wide' else build_grades_export
+        output, download_name = build_export(selected_lop, selected_mh_id, fmt)
+        if output is None:
+            flash(download_name, 'warning')
+            return redirect(url_for('admin_export_grades'))
 
-        # 6. Trả file về cho người dùng
-        download_name = f'BangDiem_Lop_{file_lop_name}_Mon_{file_mh_name}.xlsx'
+        # 6. Trả file về cho người dùng (đọc dần từ file tạm, đóng file khi gửi xong)
         return send_file(
             output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            mimetype=EXPORT_FORMATS[fmt][0],
             as_attachment=True,
             download_name=download_name
         )
@@ -1755,49 +3701,440 @@ def admin_perform_export():
 @role_required(VaiTroEnum.GIAOVIEN)
 def admin_export_students_excel():
     try:
-        search_ma_sv = request.args.get('ma_sv', '')
-        search_ho_ten = request.args.get('ho_ten', '')
-        filter_lop = request.args.get('lop', '')
-        filter_khoa = request.args.get('khoa', '')
-
-        query = SinhVien.query
-        if search_ma_sv: query = query.filter(SinhVien.ma_sv.ilike(f'%{search_ma_sv}%'))
-        if search_ho_ten: query = query.filter(SinhVien.ho_ten.ilike(f'%{search_ho_ten}%'))
-        if filter_lop: query = query.filter(SinhVien.lop == filter_lop)
-        if filter_khoa: query = query.filter(SinhVien.khoa == filter_khoa)
-
-        students = query.order_by(SinhVien.ma_sv).all()
-        if not students:
-            flash('Không có dữ liệu sinh viên nào để xuất.', 'warning')
-            return redirect(url_for('admin_manage_students'))
-
-        data_for_df = [{'Mã SV': sv.ma_sv, 'Họ tên': sv.ho_ten, 'Ngày sinh': sv.ngay_sinh,
-                        'Lớp': sv.lop, 'Khoa': sv.khoa, 'Email': sv.email,
-                        'Địa chỉ (Location)': sv.location} for sv in students]
-        df = pd.DataFrame(data_for_df)
-        if 'Ngày sinh' in df.columns:
-            # Sửa lỗi: Thêm errors='coerce' để xử lý ngày không hợp lệ thành NaT
-            df['Ngày sinh'] = pd.to_datetime(df['Ngày sinh'], errors='coerce').dt.strftime('%d-%m-%Y')
-            # Thay NaT thành chuỗi rỗng
-            df['Ngày sinh'] = df['Ngày sinh'].fillna('')
+        filters = {
+            'search_ma_sv': request.args.get('ma_sv', ''),
+            'search_ho_ten': request.args.get('ho_ten', ''),
+            'filter_lop': request.args.get('lop', ''),
+            'filter_khoa': request.args.get('khoa', ''),
+            'fmt': export_format(request.args.get('format'))
+        }
 
+        if request.args.get('background'):
+            job_id = enqueue_job('export_students', params=filters)
+            return job_accepted_response(job_id)
 
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='DanhSachSinhVien', index=False)
-        output.seek(0)
+        output, download_name = build_students_export(**filters)
+        if output is None:
+            flash(download_name, 'warning')
+            return redirect(url_for('admin_manage_students'))
 
         return send_file(
             output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            mimetype=EXPORT_FORMATS[filters['fmt']][0],
             as_attachment=True,
-            download_name='DanhSachSinhVien_Filtered.xlsx'
+            download_name=download_name
         )
     except Exception as e:
         flash(f'Đã xảy ra lỗi khi xuất file: {e}', 'danger')
         return redirect(url_for('admin_manage_students'))
 
-from data.thongbao import notifications
+# 4.12. Công việc nền (nhập/xuất chạy ngoài request)
+@job_handler('import_students')
+def run_import_students_job(job, params, input_file, progress):
+    created_count, errors = import_students_stream(iter_upload_rows(input_file), progress=progress)
+    return {'message': f'Nhập file thành công! Đã thêm mới {created_count} sinh viên.', 'errors': errors}
+
+
+@job_handler('import_grades')
+def run_import_grades_job(job, params, input_file, progress):
+    created_count, updated_count, skipped_count, errors = import_grades_stream(
+        iter_upload_rows(input_file), params['ma_mh'], progress=progress
+    )
+    return {
+        'message': f'Nhập điểm từ Excel thành công! (Thêm mới: {created_count}, Cập nhật: {updated_count}, Bỏ qua: {skipped_count})',
+        'errors': errors
+    }
+
+
+@job_handler('export_grades')
+def run_export_grades_job(job, params, input_file, progress):
+    progress(tien_do=10, thong_diep='Đang truy vấn dữ liệu điểm...')
+    fmt = export_format(params.get('fmt'))
+    build_export = build_gradebook_export if params.get('layout') == 'wide' else build_grades_export
+    output, download_name = build_export(params.get('lop'), params.get('ma_mh'), fmt)
+    if output is None:
+        return {'message': download_name}
+    return {'message': 'Đã tạo xong file điểm.', 'file': (output, download_name, EXPORT_FORMATS[fmt][0])}
+
+
+@job_handler('export_students')
+def run_export_students_job(job, params, input_file, progress):
+    progress(tien_do=10, thong_diep='Đang truy vấn danh sách sinh viên...')
+    params = dict(params, fmt=export_format(params.get('fmt')))
+    output, download_name = build_students_export(**params)
+    if output is None:
+        return {'message': download_name}
+    return {'message': 'Đã tạo xong file danh sách sinh viên.',
+            'file': (output, download_name, EXPORT_FORMATS[params['fmt']][0])}
+
+
+def job_accepted_response(job_id):
+    """Trả về mã công việc ngay: JSON 202 cho client API, chuyển hướng tới trang trạng thái cho trình duyệt."""
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('admin_job_status', job_id=job_id)
+        }), 202
+    flash(f'Đã đưa vào hàng đợi xử lý nền (mã công việc: {job_id}).', 'info')
+    return redirect(url_for('admin_job_detail', job_id=job_id))
+
+
+@app.route('/admin/jobs')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_jobs():
+    jobs = CongViecNen.query.order_by(CongViecNen.ngay_tao.desc()).limit(50).all()
+    return render_template('admin_jobs.html', jobs=jobs)
+
+
+@app.route('/admin/jobs/<job_id>')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_job_detail(job_id):
+    job = CongViecNen.query.get_or_404(job_id)
+    return render_template('admin_job_detail.html', job=job)
+
+
+@app.route('/admin/jobs/<job_id>/status')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_job_status(job_id):
+    job = CongViecNen.query.get_or_404(job_id)
+    return jsonify({
+        'job_id': job.id,
+        'loai': job.loai,
+        'trang_thai': job.trang_thai.value,
+        'tien_do': job.tien_do,
+        'so_dong_da_xu_ly': job.so_dong_da_xu_ly,
+        'thong_diep': job.thong_diep,
+        'so_loi': len(job.danh_sach_loi),
+        'download_url': url_for('admin_job_download', job_id=job.id) if job.tep_ket_qua else None,
+        'report_url': url_for('admin_job_report', job_id=job.id) if job.bao_cao_loi else None
+    })
+
+
+@app.route('/admin/jobs/<job_id>/download')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_job_download(job_id):
+    job = CongViecNen.query.get_or_404(job_id)
+    result_path = job_storage_path(job.id, 'result')
+    if not job.tep_ket_qua or not os.path.exists(result_path):
+        abort(404)
+    return send_file(result_path, mimetype=job.mimetype_ket_qua, as_attachment=True, download_name=job.tep_ket_qua)
+
+
+@app.route('/admin/jobs/<job_id>/report')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_job_report(job_id):
+    """Tải danh sách lỗi theo dòng của một lần nhập dưới dạng CSV."""
+    job = CongViecNen.query.get_or_404(job_id)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Lỗi'])
+    for error in job.danh_sach_loi:
+        writer.writerow([error])
+    return send_file(
+        io.BytesIO(output.getvalue().encode('utf-8-sig')),
+        mimetype='text/csv',
+        as_attachment=True,
+        download_name=f'BaoCaoLoi_{job.id}.csv'
+    )
+
+
+# 4.13. Thống kê bộ nhớ đệm
+CACHES = {
+    'user': user_cache,
+    'dashboard': dashboard_cache,
+    'transcript': transcript_cache,
+    'notifications': notification_cache,
+    'student_count': student_count_cache,
+    'reference': reference_cache,
+    'report': report_cache,
+}
+
+
+@app.route('/admin/cache/stats')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_cache_stats():
+    """Hit/miss và tỉ lệ hit của các cache trong tiến trình hiện tại (JSON)."""
+    return jsonify({
+        name: {
+            'hits': cache.hits,
+            'misses': cache.misses,
+            'hit_rate': round(cache.hit_rate, 4),
+            'size': len(cache),
+        }
+        for name, cache in CACHES.items()
+    })
+
+
+# 4.14. Đo truy vấn SQL & thời gian xử lý theo route
+# Mỗi request đếm số câu SQL, tổng thời gian SQL, thời gian render template và kích thước phản hồi
+# (lưu trên flask.g), rồi cộng dồn theo endpoint khi trả về. Số liệu nằm trong tiến trình hiện tại,
+# giống các cache ở trên. executemany được tính là một truy vấn (một lần gọi tới CSDL).
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_HISTORY = 50
+SLOW_QUERY_PARAMS_MAX_LENGTH = 500
+
+
+class RouteMetrics:
+    """Số liệu cộng dồn theo (endpoint, method), an toàn với nhiều thread."""
+
+    COUNTERS = ('requests', 'errors', 'queries', 'sql_seconds', 'render_seconds', 'total_seconds', 'response_bytes')
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, method, status, queries, sql_seconds, render_seconds, total_seconds, response_bytes):
+        with self._lock:
+            stats = self._routes.get((endpoint, method))
+            if stats is None:
+                stats = self._routes[(endpoint, method)] = dict.fromkeys(self.COUNTERS, 0)
+                stats.update(max_queries=0, max_seconds=0.0, latency_buckets=[0] * len(self.buckets))
+            stats['requests'] += 1
+            stats['errors'] += status >= 500
+            stats['queries'] += queries
+            stats['sql_seconds'] += sql_seconds
+            stats['render_seconds'] += render_seconds
+            stats['total_seconds'] += total_seconds
+            stats['response_bytes'] += response_bytes
+            stats['max_queries'] = max(stats['max_queries'], queries)
+            stats['max_seconds'] = max(stats['max_seconds'], total_seconds)
+            bucket = bisect.bisect_left(self.buckets, total_seconds)
+            if bucket < len(self.buckets):
+                stats['latency_buckets'][bucket] += 1
+
+    def snapshot(self):
+        """Bản sao số liệu kèm các giá trị trung bình, sắp theo tổng thời gian giảm dần."""
+        with self._lock:
+            items = [(key, dict(stats, latency_buckets=list(stats['latency_buckets'])))
+                     for key, stats in self._routes.items()]
+        rows = []
+        for (endpoint, method), stats in items:
+            n = stats['requests']
+            rows.append(dict(
+                stats,
+                endpoint=endpoint,
+                method=method,
+                avg_queries=stats['queries'] / n,
+                avg_sql_ms=stats['sql_seconds'] * 1000 / n,
+                avg_render_ms=stats['render_seconds'] * 1000 / n,
+                avg_ms=stats['total_seconds'] * 1000 / n,
+                max_ms=stats['max_seconds'] * 1000,
+                avg_bytes=stats['response_bytes'] / n,
+            ))
+        rows.sort(key=lambda row: row['total_seconds'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+route_metrics = RouteMetrics()
+slow_queries = deque(maxlen=SLOW_QUERY_HISTORY)
+
+
+def _describe_parameter_set(parameters):
+    values = parameters.values() if isinstance(parameters, dict) else parameters
+    return '(' + ', '.join(type(value).__name__ for value in values) + ')'
+
+
+def _format_query_parameters(parameters, executemany):
+    """Giá trị tham số chỉ khi bật SLOW_QUERY_LOG_PARAMS; mặc định chỉ số lượng và kiểu."""
+    if app.config['SLOW_QUERY_LOG_PARAMS']:
+        text_value = repr(parameters)
+    elif executemany:
+        text_value = f"{len(parameters)} bộ tham số"
+        if parameters:
+            text_value += ' ' + _describe_parameter_set(parameters[0])
+    else:
+        text_value = f"{len(parameters or ())} tham số {_describe_parameter_set(parameters or ())}"
+    if len(text_value) > SLOW_QUERY_PARAMS_MAX_LENGTH:
+        text_value = text_value[:SLOW_QUERY_PARAMS_MAX_LENGTH] + '...'
+    return text_value
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+    slow_ms = app.config['SLOW_QUERY_MS']
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        entry = {
+            'thoi_diem': time.strftime('%d/%m/%Y %H:%M:%S'),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'ms': round(elapsed * 1000, 1),
+            'sql': ' '.join(statement.split()),
+            'params': _format_query_parameters(parameters, executemany),
+        }
+        slow_queries.append(entry)
+        print(f"[Slow query] {entry['ms']}ms endpoint={entry['endpoint']} {entry['sql'][:500]} params={entry['params']}")
+
+
+def _discard_query_timer(exception_context):
+    # Truy vấn lỗi không đi tới after_cursor_execute: bỏ mốc thời gian đã đẩy vào
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+def _start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+    g.render_seconds = 0.0
+
+
+def _start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def _record_render(sender, template, context, **extra):
+    if 'render_started' in g:
+        g.render_seconds += time.perf_counter() - g.pop('render_started')
+
+
+def _record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    total_seconds = time.perf_counter() - g.request_started
+    if response.content_length is not None:
+        response_bytes = response.content_length
+    elif response.is_sequence:
+        response_bytes = response.calculate_content_length() or 0
+    else:
+        response_bytes = 0 # Phản hồi dạng luồng (xuất file): không biết trước kích thước
+    route_metrics.record(
+        request.endpoint or '<không khớp route>', request.method, response.status_code,
+        g.sql_queries, g.sql_seconds, g.render_seconds, total_seconds, response_bytes
+    )
+    if app.config['METRICS_SERVER_TIMING']:
+        response.headers['Server-Timing'] = (
+            f'sql;dur={g.sql_seconds * 1000:.1f};desc="{g.sql_queries} queries", '
+            f'render;dur={g.render_seconds * 1000:.1f}, total;dur={total_seconds * 1000:.1f}'
+        )
+    return response
+
+
+if app.config['METRICS_ENABLED']:
+    event.listen(Engine, 'before_cursor_execute', _start_query_timer)
+    event.listen(Engine, 'after_cursor_execute', _record_query)
+    event.listen(Engine, 'handle_error', _discard_query_timer)
+    app.before_request(_start_request_metrics)
+    app.after_request(_record_request_metrics)
+    before_render_template.connect(_start_render_timer, app)
+    template_rendered.connect(_record_render, app)
+
+
+def metrics_access_allowed():
+    """Prometheus dùng token (METRICS_TOKEN); người dùng qua trình duyệt phải là giáo viên."""
+    token = app.config['METRICS_TOKEN']
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return current_user.is_authenticated and current_user.vai_tro == VaiTroEnum.GIAOVIEN
+
+
+def _prometheus_labels(labels):
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def prometheus_metrics_text():
+    """Số liệu theo route và cache ở định dạng text exposition của Prometheus."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{_prometheus_labels(labels)} {value}')
+
+    rows = route_metrics.snapshot()
+    route_labels = [({'endpoint': row['endpoint'], 'method': row['method']}, row) for row in rows]
+    metric('qlsv_http_requests_total', 'counter', 'Số request đã xử lý.',
+           [(labels, row['requests']) for labels, row in route_labels])
+    metric('qlsv_http_errors_total', 'counter', 'Số request trả về mã 5xx.',
+           [(labels, row['errors']) for labels, row in route_labels])
+    metric('qlsv_sql_queries_total', 'counter', 'Số câu SQL đã chạy trong các request.',
+           [(labels, row['queries']) for labels, row in route_labels])
+    metric('qlsv_sql_queries_per_request_max', 'gauge', 'Số câu SQL lớn nhất trong một request.',
+           [(labels, row['max_queries']) for labels, row in route_labels])
+    metric('qlsv_sql_duration_seconds_total', 'counter', 'Tổng thời gian chạy SQL (giây).',
+           [(labels, row['sql_seconds']) for labels, row in route_labels])
+    metric('qlsv_template_render_seconds_total', 'counter', 'Tổng thời gian render template (giây).',
+           [(labels, row['render_seconds']) for labels, row in route_labels])
+    metric('qlsv_http_response_bytes_total', 'counter', 'Tổng kích thước phản hồi đã biết trước (byte).',
+           [(labels, row['response_bytes']) for labels, row in route_labels])
+
+    lines.append('# HELP qlsv_http_request_duration_seconds Thời gian xử lý request (giây).')
+    lines.append('# TYPE qlsv_http_request_duration_seconds histogram')
+    for labels, row in route_labels:
+        cumulative = 0
+        for upper, count in zip(route_metrics.buckets, row['latency_buckets']):
+            cumulative += count
+            lines.append(f'qlsv_http_request_duration_seconds_bucket{_prometheus_labels(dict(labels, le=upper))} {cumulative}')
+        lines.append(f'qlsv_http_request_duration_seconds_bucket{_prometheus_labels(dict(labels, le="+Inf"))} {row["requests"]}')
+        lines.append(f'qlsv_http_request_duration_seconds_sum{_prometheus_labels(labels)} {row["total_seconds"]}')
+        lines.append(f'qlsv_http_request_duration_seconds_count{_prometheus_labels(labels)} {row["requests"]}')
+
+    metric('qlsv_cache_hits_total', 'counter', 'Số lần đọc trúng cache trong tiến trình.',
+           [({'cache': name}, cache.hits) for name, cache in CACHES.items()])
+    metric('qlsv_cache_misses_total', 'counter', 'Số lần đọc trượt cache trong tiến trình.',
+           [({'cache': name}, cache.misses) for name, cache in CACHES.items()])
+    metric('qlsv_cache_entries', 'gauge', 'Số phần tử đang có trong cache.',
+           [({'cache': name}, len(cache)) for name, cache in CACHES.items()])
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics_access_allowed():
+        abort(403)
+    return Response(prometheus_metrics_text(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/admin/metrics')
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_metrics():
+    """Số truy vấn SQL, thời gian SQL / render / tổng và kích thước phản hồi theo route; ?format=json."""
+    rows = route_metrics.snapshot()
+    if request.args.get('format') == 'json':
+        return jsonify({'routes': rows, 'slow_queries': list(slow_queries)})
+    return render_template(
+        'admin_metrics.html',
+        rows=rows,
+        slow_queries=list(reversed(slow_queries)),
+        metrics_enabled=app.config['METRICS_ENABLED'],
+        slow_query_ms=app.config['SLOW_QUERY_MS']
+    )
+
+
+@app.route('/admin/metrics/reset', methods=['POST'])
+@login_required
+@role_required(VaiTroEnum.GIAOVIEN)
+def admin_metrics_reset():
+    route_metrics.reset()
+    slow_queries.clear()
+    flash('Đã xóa số liệu đo theo route.', 'success')
+    return redirect(url_for('admin_metrics'))
+
+
+from Data.thongbao import notifications
 
 # ========== THÔNG BÁO CHUNG ==========
 @app.route('/thong-bao-chung')
@@ -1817,12 +4154,546 @@ def thong_bao_chung_detail(id):
     return render_template('thongbao_detail.html', notification=notif)
 
 
-# --- 5. KHỞI CHẠY ỨNG DỤNG ---
+# --- 5. LỆNH QUẢN TRỊ (FLASK CLI) ---
+# Chạy bằng: flask --app api.index <lệnh>
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='Chỉ hiển thị phiên bản schema, không áp dụng migration.')
+@click.option('--target', type=int, default=None, help='Chỉ áp dụng đến phiên bản này.')
+def migrate_command(status, target):
+    """Áp dụng các migration schema còn thiếu theo thứ tự."""
+    if status:
+        version = current_schema_version() or 0
+        click.echo(f"Phiên bản schema: {version}/{LATEST_SCHEMA_VERSION}")
+        for migration_version, name, _ in MIGRATIONS:
+            mark = 'x' if migration_version <= version else ' '
+            click.echo(f"  [{mark}] {migration_version}: {name}")
+        return
+
+    applied = apply_migrations(target)
+    for version, name in applied:
+        click.echo(f"Đã áp dụng migration {version}: {name}")
+    click.echo(f"Phiên bản schema: {current_schema_version()}/{LATEST_SCHEMA_VERSION}")
+
+
+@app.cli.command('search-rebuild')
+def search_rebuild_command():
+    """Dựng lại chỉ mục tìm kiếm FTS5 của sinh viên (chạy sau VACUUM)."""
+    if rebuild_student_search_index():
+        count = db.session.execute(text("SELECT count(*) FROM sinh_vien_fts")).scalar()
+        click.echo(f"Đã dựng lại chỉ mục tìm kiếm cho {count} sinh viên.")
+    else:
+        click.echo("CSDL không hỗ trợ FTS5; tìm kiếm dùng ILIKE.")
+
+
+@app.cli.command('gpa-rebuild')
+def gpa_rebuild_command():
+    """Dựng lại toàn bộ bảng GPA tổng hợp từ bảng ket_qua."""
+    rebuild_gpa_aggregates()
+    db.session.commit()
+    click.echo(f"Đã dựng lại GPA tổng hợp cho {GpaSinhVien.query.count()} sinh viên.")
+
+
+@app.cli.command('gpa-verify')
+@click.option('--fix', is_flag=True, help='Tự động tính lại các sinh viên bị lệch.')
+def gpa_verify_command(fix):
+    """Kiểm tra bảng GPA tổng hợp có khớp với GPA tính lại từ đầu hay không."""
+    drift = verify_gpa_aggregates()
+    if not drift:
+        click.echo("GPA tổng hợp khớp với dữ liệu điểm.")
+        return
+
+    for ma_sv, stored_gpa, expected_gpa in drift:
+        click.echo(f"Lệch: {ma_sv} lưu={stored_gpa} tính lại={expected_gpa}")
+
+    if fix:
+        refresh_gpa_aggregates(ma_sv for ma_sv, _, _ in drift)
+        db.session.commit()
+        click.echo(f"Đã tính lại {len(drift)} sinh viên.")
+    else:
+        raise SystemExit(1)
+
+
+@app.cli.command('grades-recompute')
+@click.option('--course', 'ma_mh', default=None, help='Chỉ tính lại một môn (mặc định: mọi môn).')
+def grades_recompute_command(ma_mh):
+    """Tính lại điểm tổng kết / điểm chữ theo trọng số hiện tại của từng môn."""
+    courses = [ma_mh] if ma_mh else db.session.execute(select(MonHoc.ma_mh)).scalars().all()
+    total = 0
+    for course in courses:
+        total += recompute_course_grades(course)
+    db.session.commit()
+    click.echo(f"Đã tính lại {total} bản ghi điểm của {len(courses)} môn.")
+
+
+@app.cli.command('jobs-worker')
+@click.option('--once', is_flag=True, help='Xử lý hết hàng đợi hiện tại rồi thoát.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Số giây chờ giữa hai lần kiểm tra hàng đợi.')
+def jobs_worker_command(once, poll_interval):
+    """Worker xử lý hàng đợi công việc nền (dùng khi đặt JOB_INLINE_WORKER=0)."""
+    click.echo("Worker công việc nền đang chạy...")
+    while True:
+        released = release_stale_jobs()
+        if released:
+            click.echo(f"Đã trả lại {released} công việc bị bỏ dở vào hàng đợi")
+        job_id = db.session.execute(
+            select(CongViecNen.id)
+            .where(CongViecNen.trang_thai == TrangThaiJobEnum.CHO_XU_LY)
+            .order_by(CongViecNen.ngay_tao)
+            .limit(1)
+        ).scalar()
+        db.session.commit()
+        if job_id is not None:
+            click.echo(f"Đang xử lý công việc {job_id}")
+            run_job(job_id)
+            continue
+        if once:
+            break
+        time.sleep(poll_interval)
+
+
+# Các route chỉ đọc được index-advisor chạy thử; giá trị {lop}/{khoa}/{ma_mh} lấy từ dữ liệu thật
+INDEX_ADVISOR_ROUTES = [
+    ('student', 'student_dashboard', {}),
+    ('student', 'student_grades', {}),
+    ('admin', 'admin_dashboard', {}),
+    ('admin', 'admin_manage_students', {}),
+    ('admin', 'admin_manage_students', {'lop': '{lop}'}),
+    ('admin', 'admin_manage_students', {'khoa': '{khoa}'}),
+    ('admin', 'admin_manage_grades', {'lop': '{lop}', 'ma_mh': '{ma_mh}'}),
+    ('admin', 'admin_enter_grades', {'lop': '{lop}', 'ma_mh': '{ma_mh}'}),
+    ('admin', 'admin_report_high_gpa', {}),
+    ('admin', 'admin_report_missing_grade', {'ma_mh': '{ma_mh}'}),
+    ('admin', 'admin_report_class_gpa', {'lop': '{lop}'}),
+    ('admin', 'admin_report_score_distribution', {'ma_mh': '{ma_mh}'}),
+    ('admin', 'admin_export_grades', {}),
+    ('admin', 'admin_send_notification', {}),
+]
+
+
+def _is_full_scan(dialect_name, plan_line):
+    if dialect_name == 'sqlite':
+        # "SCAN sinh_vien" là quét toàn bảng; "SCAN ... USING (COVERING) INDEX" là quét theo index
+        return plan_line.startswith('SCAN ') and ' USING ' not in plan_line and 'CONSTANT ROW' not in plan_line
+    return 'Seq Scan' in plan_line
+
+
+@app.cli.command('index-advisor', with_appcontext=False)
+@click.option('--teacher', default=None, help='Tài khoản giáo viên dùng để chạy thử (mặc định: tài khoản đầu tiên).')
+@click.option('--student', default=None, help='Mã SV dùng để chạy thử (mặc định: SV đầu tiên).')
+@click.option('--strict', is_flag=True, help='Trả về mã lỗi 1 nếu còn truy vấn quét toàn bảng.')
+def index_advisor_command(teacher, student, strict):
+    """Chạy EXPLAIN cho các truy vấn của từng route và cảnh báo quét toàn bảng."""
+    # Không dùng app context chung: mỗi request của test client cần context (và current_user) riêng
+    with app.app_context():
+        engine = db.engine
+        teacher = teacher or db.session.execute(
+            select(TaiKhoan.username).where(TaiKhoan.vai_tro == VaiTroEnum.GIAOVIEN).limit(1)
+        ).scalar()
+        sample = db.session.query(SinhVien).filter(SinhVien.lop.isnot(None)).first()
+        student = student or (sample.ma_sv if sample else None)
+        sample_course = db.session.query(MonHoc.ma_mh).first()
+        values = {
+            'lop': sample.lop if sample else '',
+            'khoa': (sample.khoa or '') if sample else '',
+            'ma_mh': sample_course.ma_mh if sample_course else ''
+        }
+
+    dialect_name = engine.dialect.name
+    explain_prefix = 'EXPLAIN QUERY PLAN ' if dialect_name == 'sqlite' else 'EXPLAIN '
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    client = app.test_client()
+    event.listen(engine, 'before_cursor_execute', capture)
+    flagged_count = 0
+    try:
+        for role, endpoint, params in INDEX_ADVISOR_ROUTES:
+            username = teacher if role == 'admin' else student
+            if not username:
+                click.echo(f"[bỏ qua] {endpoint}: không có tài khoản {role} để chạy thử")
+                continue
+            with client.session_transaction() as sess:
+                sess['_user_id'] = username
+                sess['_fresh'] = True
+            with app.test_request_context():
+                url = url_for(endpoint, **{key: value.format(**values) for key, value in params.items()})
+
+            captured.clear()
+            client.get(url)
+            click.echo(f"\n== {endpoint} ({url}) - {len(captured)} truy vấn")
+
+            seen = set()
+            with engine.connect() as conn:
+                for statement, parameters in captured:
+                    if statement in seen:
+                        continue
+                    seen.add(statement)
+                    plan = conn.exec_driver_sql(explain_prefix + statement, parameters).fetchall()
+                    plan_lines = [str(row[-1]) if dialect_name == 'sqlite' else str(row[0]) for row in plan]
+                    scans = [line for line in plan_lines if _is_full_scan(dialect_name, line)]
+                    if scans:
+                        flagged_count += 1
+                        click.echo("  [QUÉT TOÀN BẢNG] " + ' '.join(statement.split())[:160])
+                        for line in scans:
+                            click.echo(f"      {line}")
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    click.echo(f"\nTổng số truy vấn quét toàn bảng: {flagged_count}")
+    if strict and flagged_count:
+        raise SystemExit(1)
+
+
+# === DỮ LIỆU GIẢ LẬP QUY MÔ TRƯỜNG (flask seed-synthetic) ===
+# Ngành: (mã ngành trong mã lớp / mã SV, khoa, tỉ trọng số SV)
+SYNTHETIC_MAJORS = (
+    ('CN', 'CNTT', 30), ('AT', 'ATTT', 12), ('VT', 'VT', 14), ('DT', 'DT', 12),
+    ('KT', 'KT', 10), ('QT', 'QTKD', 10), ('MR', 'MKT', 7), ('PT', 'DPT', 5),
+)
+# Họ phổ biến kèm tỉ lệ (%) xấp xỉ trong dân số
+SYNTHETIC_HO = (
+    ('Nguyễn', 38), ('Trần', 11), ('Lê', 9.5), ('Phạm', 7), ('Hoàng', 5), ('Huỳnh', 4), ('Phan', 4.5),
+    ('Vũ', 3.9), ('Võ', 3), ('Đặng', 2.1), ('Bùi', 2), ('Đỗ', 1.4), ('Hồ', 1.3), ('Ngô', 1.3),
+    ('Dương', 1), ('Lý', 0.5), ('Đinh', 1), ('Trịnh', 0.8), ('Đào', 0.8), ('Mai', 0.5), ('Tạ', 0.3),
+)
+SYNTHETIC_DEM_NAM = ('Văn', 'Hữu', 'Đức', 'Minh', 'Quốc', 'Gia', 'Thanh', 'Mạnh', 'Xuân', 'Tuấn',
+                     'Công', 'Đình', 'Hoàng', 'Nhật', 'Quang', 'Trung', 'Bảo')
+SYNTHETIC_DEM_NU = ('Thị', 'Ngọc', 'Thu', 'Thanh', 'Minh', 'Phương', 'Hồng', 'Thùy', 'Khánh', 'Bảo',
+                    'Mai', 'Hải', 'Diệu', 'Kim', 'Quỳnh')
+SYNTHETIC_TEN_NAM = ('An', 'Anh', 'Bảo', 'Bình', 'Cường', 'Dũng', 'Duy', 'Đạt', 'Đức', 'Hải', 'Hiếu',
+                     'Hoàng', 'Hùng', 'Huy', 'Khánh', 'Khoa', 'Kiên', 'Long', 'Minh', 'Nam', 'Phong',
+                     'Phúc', 'Quân', 'Quang', 'Sơn', 'Thành', 'Thắng', 'Trung', 'Tuấn', 'Tùng', 'Việt', 'Vinh')
+SYNTHETIC_TEN_NU = ('An', 'Anh', 'Châu', 'Chi', 'Dung', 'Giang', 'Hà', 'Hạnh', 'Hằng', 'Hoa', 'Hương',
+                    'Huyền', 'Lan', 'Linh', 'Ly', 'Mai', 'My', 'Ngân', 'Ngọc', 'Nhung', 'Phương',
+                    'Quỳnh', 'Thảo', 'Thu', 'Trang', 'Uyên', 'Vân', 'Vy', 'Yến')
+SYNTHETIC_LOCATIONS = ('Hà Nội', 'Hà Nội', 'Hà Nội', 'Nam Định', 'Thái Bình', 'Nghệ An', 'Thanh Hóa',
+                       'Hải Phòng', 'Bắc Ninh', 'Hải Dương', 'Hưng Yên', 'Phú Thọ', 'Ninh Bình', 'Hà Tĩnh')
+# Chương trình học theo học kỳ (1-8): (mã môn, tên môn, số tín chỉ)
+SYNTHETIC_COURSES = (
+    (('BAS1203', 'Giải tích 1', 3), ('BAS1201', 'Đại số', 3), ('INT1154', 'Tin học cơ sở 1', 2),
+     ('BAS1150', 'Triết học Mác - Lênin', 3), ('BAS1157', 'Tiếng Anh (Course 1)', 4)),
+    (('BAS1204', 'Giải tích 2', 3), ('BAS1224', 'Vật lý 1 và thí nghiệm', 4), ('INT1155', 'Tin học cơ sở 2', 2),
+     ('BAS1151', 'Kinh tế chính trị Mác - Lênin', 2), ('BAS1158', 'Tiếng Anh (Course 2)', 4)),
+    (('BAS1226', 'Xác suất thống kê', 2), ('INT1339', 'Ngôn ngữ lập trình C++', 3), ('INT1358', 'Toán rời rạc 1', 3),
+     ('BAS1152', 'Chủ nghĩa xã hội khoa học', 2), ('ELE1433', 'Kỹ thuật số', 2)),
+    (('INT1306', 'Cấu trúc dữ liệu và giải thuật', 3), ('INT1359', 'Toán rời rạc 2', 3),
+     ('INT1332', 'Lập trình hướng đối tượng', 3), ('BAS1122', 'Tư tưởng Hồ Chí Minh', 2), ('INT1325', 'Kiến trúc máy tính', 3)),
+    (('INT1313', 'Cơ sở dữ liệu', 3), ('INT1319', 'Hệ điều hành', 3), ('INT1336', 'Mạng máy tính', 3),
+     ('BAS1153', 'Lịch sử Đảng Cộng sản Việt Nam', 2), ('INT1340', 'Nhập môn công nghệ phần mềm', 3)),
+    (('INT1434', 'Lập trình Web', 3), ('INT1341', 'Nhập môn trí tuệ nhân tạo', 3),
+     ('INT1303', 'An toàn và bảo mật hệ thống thông tin', 3), ('INT1342', 'Phân tích và thiết kế hệ thống thông tin', 3),
+     ('SKD1108', 'Kỹ năng tạo lập văn bản', 1)),
+    (('INT14107', 'Phát triển ứng dụng cho thiết bị di động', 3), ('INT1448', 'Phát triển phần mềm hướng dịch vụ', 3),
+     ('INT1408', 'Chuyên đề công nghệ phần mềm', 3), ('INT1416', 'Đảm bảo chất lượng phần mềm', 3),
+     ('INT1427', 'Kiến trúc và thiết kế phần mềm', 3)),
+    (('INT1450', 'Quản lý dự án phần mềm', 3), ('INT1406', 'Học máy', 3), ('INT1419', 'Điện toán đám mây', 3),
+     ('INT1472', 'Thực tập cơ sở', 4), ('INT1480', 'Thực tập tốt nghiệp', 4)),
+)
+SYNTHETIC_CHUNK_SIZE = 5000
+XLSX_MAX_DATA_ROWS = 1048575 # Giới hạn số dòng của một sheet Excel (trừ dòng tiêu đề)
+# Cột của tệp nhập SV / nhập điểm (giống DS.csv và Nhap_Diem_Thi.xlsx)
+SYNTHETIC_STUDENT_COLUMNS = ('ma_sinh_vien', 'ten_sinh_vien', 'password', 'role', 'email', 'location', 'lop', 'khoa', 'ngay_sinh')
+
+
+def synthetic_course_catalogue(per_semester=5):
+    """Danh mục môn giả lập: per_semester môn cho mỗi học kỳ 1-8 (thêm học phần tự chọn nếu vượt danh sách có sẵn)."""
+    courses = []
+    for hoc_ky, semester in enumerate(SYNTHETIC_COURSES, start=1):
+        for k in range(per_semester):
+            if k < len(semester):
+                ma_mh, ten_mh, so_tin_chi = semester[k]
+            else:
+                ma_mh, ten_mh, so_tin_chi = f'TC{hoc_ky}{k:02d}', f'Học phần tự chọn {hoc_ky}.{k - len(semester) + 1}', 2
+            courses.append({'ma_mh': ma_mh, 'ten_mh': ten_mh, 'so_tin_chi': so_tin_chi, 'hoc_ky': hoc_ky})
+    return courses
+
+
+def synthetic_student_groups(students, first_cohort=22, cohorts=4):
+    """Chia số SV đều theo khóa, trong mỗi khóa theo tỉ trọng ngành: [(khóa, mã ngành, khoa, số SV)]."""
+    total_weight = sum(weight for _, _, weight in SYNTHETIC_MAJORS)
+    groups = []
+    for index in range(cohorts):
+        cohort_students = students // cohorts + (1 if index < students % cohorts else 0)
+        counts = [cohort_students * weight // total_weight for _, _, weight in SYNTHETIC_MAJORS]
+        counts[0] += cohort_students - sum(counts)
+        for (major, khoa, _), count in zip(SYNTHETIC_MAJORS, counts):
+            if count:
+                groups.append(((first_cohort + index) % 100, major, khoa, count))
+    return groups
+
+
+def _ascii_fold(value):
+    """Bỏ dấu tiếng Việt (dùng cho email)."""
+    value = value.replace('Đ', 'D').replace('đ', 'd')
+    return ''.join(ch for ch in unicodedata.normalize('NFD', value) if not unicodedata.combining(ch))
+
+
+def iter_synthetic_students(students, seed=2024, first_cohort=22, cohorts=4, class_size=60, id_offset=0):
+    """
+    Sinh SV giả lập theo thứ tự (khóa, ngành): mã SV kiểu B22DCCN001, lớp kiểu D22CQCN01-B,
+    họ tên theo tần suất họ phổ biến, email / ngày sinh / quê quán.
+    Kèm 'so_hoc_ky' (khóa cũ nhất đã học 8 kỳ, mỗi khóa sau ít hơn 2 kỳ) và 'nang_luc'
+    (độ lệch học lực, dùng khi sinh điểm). Cùng seed cho cùng dữ liệu.
+    """
+    rng = random.Random(seed)
+    ho_names = [name for name, _ in SYNTHETIC_HO]
+    ho_cum_weights = list(accumulate(weight for _, weight in SYNTHETIC_HO))
+    for cohort, major, khoa, count in synthetic_student_groups(students, first_cohort, cohorts):
+        width = max(3, len(str(count + id_offset)))
+        so_hoc_ky = max(1, min(8, 2 * ((first_cohort + cohorts - cohort) % 100)))
+        for seq in range(1, count + 1):
+            female = rng.random() < 0.5
+            ho = rng.choices(ho_names, cum_weights=ho_cum_weights)[0]
+            dem_choices = SYNTHETIC_DEM_NU if female else SYNTHETIC_DEM_NAM
+            dem = rng.choice(dem_choices)
+            if rng.random() < 0.25:
+                dem += ' ' + rng.choice([name for name in dem_choices if name != dem])
+            ten = rng.choice(SYNTHETIC_TEN_NU if female else SYNTHETIC_TEN_NAM)
+            number = f'{seq + id_offset:0{width}d}'
+            initials = ''.join(word[0] for word in f'{ho} {dem}'.split())
+            yield {
+                'ma_sv': f'B{cohort:02d}DC{major}{number}',
+                'ho_ten': f'{ho} {dem} {ten}',
+                'lop': f'D{cohort:02d}CQ{major}{(seq - 1) // class_size + 1:02d}-B',
+                'khoa': khoa,
+                'email': _ascii_fold(f'{ten}{initials}.B{cohort:02d}{major}{number}@stu.ptit.edu.vn'),
+                'location': rng.choice(SYNTHETIC_LOCATIONS),
+                'ngay_sinh': datetime.date(2000 + cohort - 18, 1, 1) + datetime.timedelta(days=rng.randrange(365)),
+                'so_hoc_ky': so_hoc_ky,
+                'nang_luc': rng.gauss(0, 1),
+            }
+
+
+def _quarter_score(value):
+    """Làm tròn tới 0.25 và giới hạn trong [0, 10] như điểm thi thật."""
+    return min(10.0, max(0.0, round(value * 4) / 4))
+
+
+class SyntheticGrades:
+    """
+    Sinh điểm thành phần: mỗi môn có độ khó riêng, mỗi SV có học lực riêng, nên phân bố điểm
+    chữ / GPA lệch nhau giữa các môn và các lớp. missing_rate: tỉ lệ môn SV chưa có điểm.
+    """
+
+    def __init__(self, courses, seed=2024, missing_rate=0.02):
+        self.courses = sorted(courses, key=lambda course: (course['hoc_ky'], course['ma_mh']))
+        self.missing_rate = missing_rate
+        self.rng = random.Random(seed + 1)
+        self.difficulty = {course['ma_mh']: self.rng.gauss(0, 0.6) for course in self.courses}
+
+    def for_student(self, student):
+        """(ma_mh, CC, GK, CK) cho các môn thuộc những học kỳ SV đã học."""
+        rng = self.rng
+        base = 6.8 + 1.1 * student['nang_luc']
+        for course in self.courses:
+            if course['hoc_ky'] > student['so_hoc_ky'] or rng.random() < self.missing_rate:
+                continue
+            mean = base - self.difficulty[course['ma_mh']]
+            diem_cc = min(10, max(0, round(rng.gauss(mean + 1.5, 1.0))))
+            yield course['ma_mh'], diem_cc, _quarter_score(rng.gauss(mean, 1.2)), _quarter_score(rng.gauss(mean - 0.3, 1.5))
+
+
+def ensure_synthetic_courses(courses):
+    """Thêm các môn chưa có; trả về (số môn đã thêm, danh mục đọc lại từ CSDL kèm trọng số điểm)."""
+    codes = [course['ma_mh'] for course in courses]
+    existing = set(db.session.execute(select(MonHoc.ma_mh).where(MonHoc.ma_mh.in_(codes))).scalars())
+    new_courses = [course for course in courses if course['ma_mh'] not in existing]
+    if new_courses:
+        db.session.execute(insert(MonHoc.__table__), new_courses)
+    rows = db.session.execute(
+        select(MonHoc.ma_mh, MonHoc.hoc_ky, MonHoc.trong_so_cc, MonHoc.trong_so_gk, MonHoc.trong_so_ck)
+        .where(MonHoc.ma_mh.in_(codes))
+    ).all()
+    catalogue = [{'ma_mh': row.ma_mh, 'hoc_ky': row.hoc_ky,
+                  'weights': (row.trong_so_cc, row.trong_so_gk, row.trong_so_ck)} for row in rows]
+    return len(new_courses), catalogue
+
+
+def seed_synthetic_database(students, grades, password, chunk_size=SYNTHETIC_CHUNK_SIZE, progress=None):
+    """
+    Ghi SV giả lập (iterable từ iter_synthetic_students) cùng tài khoản và điểm vào CSDL bằng
+    INSERT hàng loạt theo lô, commit sau mỗi lô. Mọi tài khoản dùng chung một chuỗi băm của
+    password (băm một lần). Dừng nếu mã SV đã tồn tại. GPA tổng hợp được dựng lại một lần ở cuối.
+    Trả về (số SV, số bản ghi điểm).
+    """
+    password_hash = hash_passwords_bulk([password])[0]
+    weights = {course['ma_mh']: course.get('weights', DEFAULT_GRADE_WEIGHTS) for course in grades.courses}
+    student_count = result_count = 0
+    for chunk in iter_chunks(students, chunk_size):
+        ids = [student['ma_sv'] for student in chunk]
+        existing = db.session.execute(select(TaiKhoan.username).where(TaiKhoan.username.in_(ids)).limit(1)).scalar()
+        if existing:
+            db.session.rollback()
+            raise ValueError(f'Mã SV "{existing}" đã tồn tại (dùng --id-offset để sinh mã khác).')
+
+        db.session.execute(insert(TaiKhoan.__table__), [
+            {'username': ma_sv, 'password': password_hash, 'vai_tro': VaiTroEnum.SINHVIEN} for ma_sv in ids
+        ])
+        db.session.execute(insert(SinhVien.__table__), [
+            {key: student[key] for key in ('ma_sv', 'ho_ten', 'lop', 'khoa', 'email', 'location', 'ngay_sinh')}
+            for student in chunk
+        ])
+        result_rows = []
+        for student in chunk:
+            for ma_mh, diem_cc, diem_gk, diem_ck in grades.for_student(student):
+                diem_tong_ket, diem_chu = tinh_diem_tong_ket(diem_cc, diem_gk, diem_ck, weights[ma_mh])
+                result_rows.append({
+                    'ma_sv': student['ma_sv'], 'ma_mh': ma_mh, 'diem_chuyen_can': diem_cc, 'diem_giua_ky': diem_gk,
+                    'diem_cuoi_ky': diem_ck, 'diem_tong_ket': diem_tong_ket, 'diem_chu': diem_chu
+                })
+        for batch in iter_chunks(result_rows, IMPORT_CHUNK_SIZE):
+            db.session.execute(insert(KetQua.__table__), batch)
+        db.session.commit()
+
+        student_count += len(chunk)
+        result_count += len(result_rows)
+        if progress is not None:
+            progress(student_count, result_count)
+
+    rebuild_gpa_aggregates()
+    db.session.commit()
+    return student_count, result_count
+
+
+class ImportFileWriter:
+    """Ghi tuần tự một tệp nhập liệu .csv (UTF-8 có BOM) hoặc .xlsx (openpyxl write-only) theo từng dòng."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.rows = 0
+        if path.endswith('.csv'):
+            self._file = open(path, 'w', encoding='utf-8-sig', newline='')
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(columns)
+        else:
+            from openpyxl import Workbook
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet('Sheet1')
+            self._sheet.append(list(columns))
+
+    def writerow(self, row):
+        if self.path.endswith('.csv'):
+            self._csv.writerow(row)
+        else:
+            self._sheet.append(list(row))
+        self.rows += 1
+
+    def close(self):
+        if self.path.endswith('.csv'):
+            self._file.close()
+        else:
+            self._workbook.save(self.path)
+
+
+def write_synthetic_files(output_dir, fmt, students, grades, courses, password, progress=None):
+    """
+    Ghi tệp sẵn sàng để nhập qua web: sinh_vien.<fmt> (cột như DS.csv), mon_hoc.<fmt> (danh mục,
+    tham khảo) và diem/<mã môn>.<fmt> cho từng môn (cột như Nhap_Diem_Thi.xlsx).
+    Sinh và ghi theo luồng trong một lượt. Trả về (số SV, số bản ghi điểm).
+    """
+    os.makedirs(os.path.join(output_dir, 'diem'), exist_ok=True)
+    course_writer = ImportFileWriter(os.path.join(output_dir, f'mon_hoc.{fmt}'), ('ma_mh', 'ten_mh', 'so_tin_chi', 'hoc_ky'))
+    for course in courses:
+        course_writer.writerow([course['ma_mh'], course['ten_mh'], course['so_tin_chi'], course['hoc_ky']])
+    course_writer.close()
+
+    student_writer = ImportFileWriter(os.path.join(output_dir, f'sinh_vien.{fmt}'), SYNTHETIC_STUDENT_COLUMNS)
+    grade_writers = {
+        course['ma_mh']: ImportFileWriter(
+            os.path.join(output_dir, 'diem', f"{course['ma_mh']}.{fmt}"),
+            ['ma_sinh_vien'] + [col for col, _ in GRADE_IMPORT_COLUMNS]
+        )
+        for course in courses
+    }
+    result_count = 0
+    try:
+        for student in students:
+            student_writer.writerow([
+                student['ma_sv'], student['ho_ten'], password, 'SINHVIEN', student['email'],
+                student['location'], student['lop'], student['khoa'], student['ngay_sinh'].isoformat()
+            ])
+            for ma_mh, diem_cc, diem_gk, diem_ck in grades.for_student(student):
+                grade_writers[ma_mh].writerow([student['ma_sv'], diem_cc, diem_gk, diem_ck])
+                result_count += 1
+            if progress is not None and student_writer.rows % SYNTHETIC_CHUNK_SIZE == 0:
+                progress(student_writer.rows, result_count)
+    finally:
+        for writer in [student_writer, *grade_writers.values()]:
+            writer.close()
+    return student_writer.rows, result_count
+
+
+@app.cli.command('seed-synthetic')
+@click.option('--students', default=10000, show_default=True, type=click.IntRange(1), help='Số sinh viên cần sinh.')
+@click.option('--cohorts', default=4, show_default=True, type=click.IntRange(1, 8),
+              help='Số khóa; khóa cũ nhất đã học 8 học kỳ, mỗi khóa sau ít hơn 2 học kỳ.')
+@click.option('--first-cohort', default=22, show_default=True, type=click.IntRange(0, 99),
+              help='Khóa cũ nhất (22 -> lớp D22CQ..., mã SV B22DC...).')
+@click.option('--class-size', default=60, show_default=True, type=click.IntRange(1), help='Sĩ số mỗi lớp.')
+@click.option('--courses-per-semester', default=5, show_default=True, type=click.IntRange(1, 50))
+@click.option('--missing-rate', default=0.02, show_default=True, type=click.FloatRange(0, 1),
+              help='Tỉ lệ môn SV đã học nhưng chưa có điểm.')
+@click.option('--password', default='12345', show_default=True, help='Mật khẩu chung của SV giả lập.')
+@click.option('--id-offset', default=0, show_default=True, type=click.IntRange(0),
+              help='Cộng thêm vào số thứ tự trong mã SV (sinh thêm dữ liệu mà không trùng mã).')
+@click.option('--seed', default=2024, show_default=True, help='Cùng seed cho cùng dữ liệu.')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=None,
+              help='Ghi ra tệp nhập liệu thay vì ghi thẳng vào CSDL.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'xlsx']), default='csv', show_default=True,
+              help='Định dạng tệp khi dùng --output-dir.')
+@click.option('--courses-only', is_flag=True, help='Chỉ thêm danh mục môn học vào CSDL (trước khi nhập các tệp điểm).')
+def seed_synthetic_command(students, cohorts, first_cohort, class_size, courses_per_semester, missing_rate,
+                           password, id_offset, seed, output_dir, fmt, courses_only):
+    """Sinh dữ liệu giả lập quy mô trường (SV, lớp, môn, điểm) vào CSDL hoặc ra tệp XLSX/CSV để nhập."""
+    courses = synthetic_course_catalogue(courses_per_semester)
+    if courses_only:
+        added, _ = ensure_synthetic_courses(courses)
+        db.session.commit()
+        click.echo(f"Đã thêm {added} môn học ({len(courses) - added} môn đã có).")
+        return
+
+    started = time.perf_counter()
+
+    def progress(student_count, result_count):
+        click.echo(f"  {student_count}/{students} SV, {result_count} bản ghi điểm ({time.perf_counter() - started:.0f} s)")
+
+    student_rows = iter_synthetic_students(students, seed, first_cohort, cohorts, class_size, id_offset)
+    if output_dir:
+        if fmt == 'xlsx' and students > XLSX_MAX_DATA_ROWS:
+            raise click.ClickException(f"Một sheet Excel chứa tối đa {XLSX_MAX_DATA_ROWS} dòng; dùng --format csv.")
+        grades = SyntheticGrades(courses, seed, missing_rate)
+        student_count, result_count = write_synthetic_files(
+            output_dir, fmt, student_rows, grades, courses, password, progress
+        )
+        click.echo(f"Đã ghi {student_count} SV và {result_count} bản ghi điểm vào {output_dir} "
+                   f"({time.perf_counter() - started:.1f} s). Tạo môn học bằng --courses-only trước khi nhập điểm.")
+        return
+
+    added, catalogue = ensure_synthetic_courses(courses)
+    try:
+        student_count, result_count = seed_synthetic_database(
+            student_rows, SyntheticGrades(catalogue, seed, missing_rate), password, progress=progress
+        )
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f"Đã thêm {student_count} SV, {result_count} bản ghi điểm, {added} môn học mới "
+               f"({time.perf_counter() - started:.1f} s).")
+
+
+mark_startup_phase('routes')
+if os.getenv('STARTUP_TIMING') == '1':
+    print('[Startup] ' + ', '.join(f'{name}={ms}ms' for name, ms in STARTUP_TIMINGS.items()))
+
+
+# --- 6. KHỞI CHẠY ỨNG DỤNG ---
 if __name__ == '__main__':
     with app.app_context():
-        # Tạo tất cả các bảng nếu chưa tồn tại
-        db.create_all()
-        ensure_teacher_profile_columns()
+        # Tạo bảng / cập nhật schema theo các migration còn thiếu
+        apply_migrations()
         
         # === CẬP NHẬT LOGIC TẠO TÀI KHOẢN MẪU ===
         if not TaiKhoan.query.filter_by(username='giaovien01').first():
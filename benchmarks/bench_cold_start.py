@@ -0,0 +1,110 @@
+"""
+Benchmark: thời gian khởi động nguội (import api.index -> phản hồi đầu tiên).
+
+Chạy:  python benchmarks/bench_cold_start.py --runs 7
+Mỗi lần đo là một tiến trình Python mới: import ứng dụng, GET /login, đăng nhập
+rồi mở dashboard. Dùng bản sao tạm của qlsv.db (không đụng tới file gốc); lần
+chạy đầu tiên để migrate/seed CSDL tạm và không được tính.
+Thêm --max-ms N để thoát với mã lỗi khi trung vị tới phản hồi đầu tiên vượt N ms.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SEED = r'''
+import sys
+sys.path.insert(0, sys.argv[1])
+import api.index as qlsv
+with qlsv.app.app_context():
+    if not qlsv.db.session.get(qlsv.TaiKhoan, 'bench_gv'):
+        gv = qlsv.TaiKhoan(username='bench_gv', vai_tro=qlsv.VaiTroEnum.GIAOVIEN)
+        gv.set_password('bench')
+        qlsv.db.session.add(gv)
+        qlsv.db.session.add(qlsv.GiaoVien(ma_gv='bench_gv', ho_ten='Bench', email='bench_gv@example.com'))
+    if not qlsv.db.session.get(qlsv.TaiKhoan, 'BENCHSV01'):
+        sv = qlsv.TaiKhoan(username='BENCHSV01', vai_tro=qlsv.VaiTroEnum.SINHVIEN)
+        sv.set_password('bench')
+        qlsv.db.session.add(sv)
+        qlsv.db.session.add(qlsv.SinhVien(ma_sv='BENCHSV01', ho_ten='Bench', lop='BENCH'))
+    qlsv.db.session.commit()
+'''
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import api.index as qlsv
+imported = time.perf_counter()
+client = qlsv.app.test_client()
+assert client.get('/login').status_code == 200
+first_response = time.perf_counter()
+username = 'bench_gv' if sys.argv[2] == 'teacher' else 'BENCHSV01'
+client.post('/login', data={'username': username, 'password': 'bench'})
+dashboard = 'admin_dashboard' if sys.argv[2] == 'teacher' else 'student_dashboard'
+with qlsv.app.test_request_context():
+    path = qlsv.url_for(dashboard)
+assert client.get(path).status_code == 200
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (first_response - started) * 1000,
+    'dashboard_ms': (finished - started) * 1000,
+    'heavy_modules': sorted(m for m in ('pandas', 'numpy', 'openpyxl') if m in sys.modules),
+    'phases': getattr(qlsv, 'STARTUP_TIMINGS', {}),
+}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--role', choices=['student', 'teacher'], default='student')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Ngưỡng trung vị (ms) tới phản hồi đầu tiên; vượt quá thì trả mã lỗi 1.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='qlsv_cold_')
+    db_path = os.path.join(workdir, 'qlsv.db')
+    shutil.copy(os.path.join(PROJECT_ROOT, 'qlsv.db'), db_path)
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path)
+
+    try:
+        subprocess.run([sys.executable, '-c', SEED, PROJECT_ROOT], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        samples = []
+        for _ in range(args.runs):
+            result = subprocess.run([sys.executable, '-c', PROBE, PROJECT_ROOT, args.role], env=env,
+                                    check=True, capture_output=True, text=True)
+            samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'Giai đoạn':<24} {'Trung vị (ms)':>14} {'Min (ms)':>10} {'Max (ms)':>10}")
+    for key, label in (('import_ms', 'import api.index'),
+                       ('first_response_ms', 'GET /login'),
+                       ('dashboard_ms', f'dashboard ({args.role})')):
+        values = [s[key] for s in samples]
+        print(f"{label:<24} {statistics.median(values):>14.1f} {min(values):>10.1f} {max(values):>10.1f}")
+
+    phases = samples[-1]['phases']
+    if phases:
+        print('Các giai đoạn khởi động (lần đo cuối):')
+        for name, ms in phases.items():
+            print(f"  {name:<22} {ms:>8.1f} ms")
+    print(f"Module nặng đã nạp: {', '.join(samples[-1]['heavy_modules']) or '(không có)'}")
+
+    median_first = statistics.median(s['first_response_ms'] for s in samples)
+    if args.max_ms is not None and median_first > args.max_ms:
+        print(f"Vượt ngưỡng: {median_first:.1f} ms > {args.max_ms:.1f} ms")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
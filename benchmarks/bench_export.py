@@ -0,0 +1,82 @@
+"""
+Benchmark: bộ nhớ đỉnh (tracemalloc) và thời gian khi xuất file điểm theo số dòng.
+
+Chạy:  python benchmarks/bench_export.py --rows 10000 50000 --formats xlsx csv
+Dùng một file SQLite tạm (không đụng tới qlsv.db). Xuất theo luồng nên bộ nhớ đỉnh
+gần như không đổi khi số dòng tăng (phần còn lại là file kết quả trong SpooledTemporaryFile,
+tối đa EXPORT_SPOOL_MAX_SIZE). tracemalloc làm chậm đáng kể nên thời gian chỉ để so sánh tương đối.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+COURSES = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--formats', nargs='+', default=['xlsx', 'csv'])
+    args = parser.parse_args()
+
+    db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    db_file.close()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_file.name
+    sys.path.insert(0, PROJECT_ROOT)
+
+    from sqlalchemy import insert
+    import api.index as qlsv
+
+    app, db = qlsv.app, qlsv.db
+    rng = random.Random(2024)
+
+    with app.app_context():
+        db.session.execute(insert(qlsv.MonHoc.__table__), [
+            {'ma_mh': f'MH{j:02d}', 'ten_mh': f'Môn {j}', 'so_tin_chi': 3, 'hoc_ky': 1 + j % 8} for j in range(COURSES)
+        ])
+        seeded = 0
+        print(f"{'Số dòng':>8} {'Định dạng':>9} {'Bộ nhớ đỉnh (MB)':>17} {'Thời gian (s)':>14} {'Kích thước (MB)':>16}")
+        for target in sorted(args.rows):
+            # Mỗi SV có điểm đủ COURSES môn -> thêm SV cho tới khi đạt số dòng mong muốn
+            new_students = [f'SV{i:07d}' for i in range(seeded // COURSES, target // COURSES)]
+            db.session.execute(insert(qlsv.TaiKhoan.__table__), [
+                {'username': ma_sv, 'password': '-', 'vai_tro': qlsv.VaiTroEnum.SINHVIEN} for ma_sv in new_students
+            ])
+            db.session.execute(insert(qlsv.SinhVien.__table__), [
+                {'ma_sv': ma_sv, 'ho_ten': f'Sinh viên {ma_sv}', 'lop': f'L{int(ma_sv[2:]) % 50:02d}'}
+                for ma_sv in new_students
+            ])
+            grades = []
+            for ma_sv in new_students:
+                for j in range(COURSES):
+                    cc, gk, ck = rng.randint(0, 10), rng.randint(0, 10), rng.randint(0, 10)
+                    tk, chu = qlsv.tinh_diem_tong_ket(cc, gk, ck)
+                    grades.append({'ma_sv': ma_sv, 'ma_mh': f'MH{j:02d}', 'diem_chuyen_can': cc,
+                                   'diem_giua_ky': gk, 'diem_cuoi_ky': ck, 'diem_tong_ket': tk, 'diem_chu': chu})
+            for batch in qlsv.iter_chunks(grades, 10000):
+                db.session.execute(insert(qlsv.KetQua.__table__), batch)
+            db.session.commit()
+            seeded = target
+
+            for fmt in args.formats:
+                tracemalloc.start()
+                started = time.perf_counter()
+                output, _ = qlsv.build_grades_export('all', 'all', fmt)
+                elapsed = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                output.seek(0, os.SEEK_END)
+                size = output.tell()
+                output.close()
+                print(f"{target:>8} {fmt:>9} {peak / 2**20:>17.1f} {elapsed:>14.2f} {size / 2**20:>16.1f}")
+
+    os.unlink(db_file.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Benchmark: chuyển điểm hệ 10 -> điểm chữ / hệ 4 bằng vòng lặp Python so với NumPy (np.searchsorted).
+
+Chạy:  python benchmarks/bench_grading_scale.py --scores 1000000
+Chỉ đo thời gian; kiểm tra Python / NumPy / SQL cho cùng kết quả nằm ở benchmarks/check_grading_scale.py.
+"""
+import argparse
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scores', type=int, default=1000000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, PROJECT_ROOT)
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    import numpy as np
+    import api.index as qlsv
+
+    scores = np.round(np.random.default_rng(2024).uniform(0, 10, args.scores), 2)
+    score_list = scores.tolist()
+
+    started = time.perf_counter()
+    letters = [qlsv.convert_10_to_letter(x) for x in score_list]
+    points = [qlsv.convert_10_to_4_scale(x) for x in score_list]
+    python_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bulk_letters, bulk_points = qlsv.convert_scores_bulk(scores)
+    numpy_s = time.perf_counter() - started
+
+    assert list(bulk_letters) == letters and bulk_points.tolist() == points
+    print(f"{'Cách chuyển':<28} {'Thời gian (s)':>14}")
+    print(f"{'Python từng điểm':<28} {python_s:>14.3f}")
+    print(f"{'NumPy searchsorted':<28} {numpy_s:>14.3f}")
+    print(f"{args.scores} điểm, nhanh hơn {python_s / numpy_s:.1f} lần")
+
+
+if __name__ == '__main__':
+    main()
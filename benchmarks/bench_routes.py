@@ -0,0 +1,321 @@
+"""
+Benchmark: độ trễ p50/p95/p99, số truy vấn SQL mỗi request và RSS đỉnh của các route chính.
+
+Chạy:  python benchmarks/bench_routes.py --students 5000 --repeat 30 --output bench.json
+So sánh với lần đo trước (ví dụ ở commit khác):
+       python benchmarks/bench_routes.py --baseline bench.json --fail-on-regression
+Tạo một trường giả lập (bộ sinh của `flask seed-synthetic`, thêm thông báo) trong file SQLite tạm (không đụng tới qlsv.db),
+rồi gọi các route thật qua Flask test client: đăng nhập, trang SV, quản lý SV / điểm, lưu điểm,
+mọi báo cáo /admin/reports/*, nhập và xuất file. Mặc định cache giữ nguyên giữa các lần gọi
+(giống khi chạy thật); --cold-cache xóa mọi cache trước mỗi request.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PASSWORD = 'bench'
+
+def peak_rss_mb():
+    """RSS đỉnh của tiến trình từ lúc khởi động (ru_maxrss: KB trên Linux, byte trên macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_university(qlsv, args):
+    """
+    Nạp dữ liệu bằng bộ sinh của `flask seed-synthetic` (SV, lớp, môn, điểm), thêm tài khoản giáo viên
+    và thông báo cho từng lớp; trả về danh sách lớp, môn và SV theo lớp.
+    """
+    from sqlalchemy import insert, select
+
+    db = qlsv.db
+    _, catalogue = qlsv.ensure_synthetic_courses(qlsv.synthetic_course_catalogue(args.courses_per_semester))
+    students = qlsv.iter_synthetic_students(args.students, args.seed, class_size=args.class_size)
+    qlsv.seed_synthetic_database(students, qlsv.SyntheticGrades(catalogue, args.seed), PASSWORD)
+
+    teacher = qlsv.TaiKhoan(username='bench_gv', vai_tro=qlsv.VaiTroEnum.GIAOVIEN)
+    teacher.set_password(PASSWORD)
+    db.session.add(teacher)
+    db.session.add(qlsv.GiaoVien(ma_gv='bench_gv', ho_ten='Giảng viên Benchmark'))
+    students_by_class = {}
+    for ma_sv, lop in db.session.execute(select(qlsv.SinhVien.ma_sv, qlsv.SinhVien.lop).order_by(qlsv.SinhVien.ma_sv)):
+        students_by_class.setdefault(lop, []).append(ma_sv)
+    classes = sorted(students_by_class)
+    db.session.execute(insert(qlsv.ThongBao.__table__), [
+        {'tieu_de': f'Thông báo {k}', 'noi_dung': 'Nội dung thông báo', 'ma_gv': 'bench_gv', 'lop_nhan': lop}
+        for lop in classes for k in range(3)
+    ])
+    db.session.commit()
+    courses = [course['ma_mh'] for course in sorted(catalogue, key=lambda course: (course['hoc_ky'], course['ma_mh']))]
+    return classes, courses, students_by_class
+
+
+def csv_upload(rows, filename):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return (io.BytesIO(buffer.getvalue().encode('utf-8')), filename)
+
+
+def build_scenarios(classes, courses, students_by_class, rng):
+    """(tên, vai trò, hàm tạo request) — hàm nhận số thứ tự lần gọi, trả về (method, path, kwargs cho test client)."""
+    lop, ma_mh = classes[0], courses[0]
+    sample_students = [ma_sv for lop_students in students_by_class.values() for ma_sv in lop_students[:1]]
+
+    def get(path):
+        return lambda i: ('GET', path, {})
+
+    def save_grades(i):
+        form = {'lop': lop, 'ma_mh': ma_mh}
+        for ma_sv in students_by_class[lop]:
+            form[f'diem_cc_{ma_sv}'] = str(rng.randint(0, 10))
+            form[f'diem_gk_{ma_sv}'] = str(rng.randint(0, 10))
+            form[f'diem_ck_{ma_sv}'] = str(rng.randint(0, 10))
+        return 'POST', '/admin/grades/save', {'data': form}
+
+    def import_grades(i):
+        rows = [['ma_sinh_vien', 'diem_chuyen_can', 'diem_giua_ky', 'diem_cuoi_ky']]
+        rows += [[ma_sv, rng.randint(0, 10), rng.randint(0, 10), rng.randint(0, 10)] for ma_sv in students_by_class[lop]]
+        return 'POST', '/admin/grades/import', {'data': {'ma_mh': courses[1], 'file': csv_upload(rows, 'diem.csv')},
+                                                'content_type': 'multipart/form-data'}
+
+    def import_students(i):
+        rows = [['ma_sinh_vien', 'ten_sinh_vien', 'password', 'role', 'lop', 'khoa']]
+        rows += [[f'BENCHNEW{i:04d}{k:03d}', 'Sinh viên Mới', PASSWORD, 'SINHVIEN', 'D25CQCN99-B', 'CNTT'] for k in range(50)]
+        return 'POST', '/admin/import_students', {'data': {'file': csv_upload(rows, 'sv.csv')},
+                                                  'content_type': 'multipart/form-data'}
+
+    def export_grades(fmt, export_lop, export_mh):
+        return lambda i: ('POST', '/admin/export/perform', {'data': {'lop': export_lop, 'ma_mh': export_mh, 'format': fmt}})
+
+    def student_page(path):
+        return lambda i: ('GET', path, {'student': sample_students[i % len(sample_students)]})
+
+    return [
+        ('login', None, lambda i: ('POST', '/login', {'data': {
+            'username': sample_students[i % len(sample_students)], 'password': PASSWORD}})),
+        ('student_dashboard', 'student', student_page('/student/dashboard')),
+        ('student_grades', 'student', student_page('/student/grades')),
+        ('admin_dashboard', 'admin', get('/admin/dashboard')),
+        ('admin_manage_students', 'admin', get('/admin/students')),
+        ('admin_manage_students_search', 'admin', get('/admin/students?ho_ten=nguyen%20van')),
+        ('admin_manage_students_lop', 'admin', get(f'/admin/students?lop={lop}')),
+        ('admin_manage_grades', 'admin', get(f'/admin/grades?lop={lop}&ma_mh={ma_mh}')),
+        ('admin_enter_grades', 'admin', get(f'/admin/grades/enter/{lop}/{ma_mh}')),
+        ('admin_save_grades', 'admin', save_grades),
+        ('report_high_gpa', 'admin', get('/admin/reports/high_gpa')),
+        ('report_high_gpa_top_k', 'admin', get('/admin/reports/high_gpa?threshold=&partition=lop&top_k=3')),
+        ('report_missing_grade', 'admin', get(f'/admin/reports/missing_grade?ma_mh={ma_mh}')),
+        ('report_missing_grade_matrix', 'admin', get('/admin/reports/missing_grade/matrix')),
+        ('report_class_gpa', 'admin', get(f'/admin/reports/class_gpa?lop={lop}')),
+        ('report_faculty_gpa', 'admin', get('/admin/reports/faculty_gpa')),
+        ('report_score_distribution', 'admin', get(f'/admin/reports/score_distribution?ma_mh={ma_mh}')),
+        ('report_score_distribution_compare', 'admin', get(
+            '/admin/reports/score_distribution/compare?' + '&'.join(f'ma_mh={c}' for c in courses[:5]))),
+        ('import_grades_csv', 'admin', import_grades),
+        ('import_students_csv', 'admin', import_students),
+        ('export_grades_class_xlsx', 'admin', export_grades('xlsx', lop, ma_mh)),
+        ('export_grades_all_csv', 'admin', export_grades('csv', 'all', 'all')),
+        ('export_students_xlsx', 'admin', get('/admin/export_students_excel')),
+    ]
+
+
+def percentile(sorted_values, pct):
+    """Phân vị nội suy tuyến tính trên danh sách đã sắp xếp."""
+    position = (len(sorted_values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def run_scenarios(qlsv, scenarios, args):
+    from sqlalchemy import event
+
+    app, db = qlsv.app, qlsv.db
+    with app.app_context():
+        engine = db.engine
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *a, **kw: statements.append(1))
+
+    admin = app.test_client()
+    admin.post('/login', data={'username': 'bench_gv', 'password': PASSWORD})
+    student_clients = {}
+
+    def student_client(ma_sv):
+        if ma_sv not in student_clients:
+            client = app.test_client()
+            client.post('/login', data={'username': ma_sv, 'password': PASSWORD})
+            student_clients[ma_sv] = client
+        return student_clients[ma_sv]
+
+    results = {}
+    for name, role, build in scenarios:
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        timings, queries, statuses = [], [], set()
+        for i in range(args.warmup + args.repeat):
+            method, path, kwargs = build(i)
+            ma_sv = kwargs.pop('student', None)
+            if role == 'admin':
+                client = admin
+            elif role == 'student':
+                client = student_client(ma_sv)
+            else:
+                client = app.test_client()
+            if args.cold_cache:
+                for cache in qlsv.CACHES.values():
+                    cache.clear()
+
+            statements.clear()
+            started = time.perf_counter()
+            response = client.open(path, method=method, **kwargs)
+            response.get_data() # Đọc hết phản hồi dạng luồng (xuất file)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            response.close()
+            if response.status_code not in (200, 302):
+                raise SystemExit(f"{name}: {method} {path} trả về {response.status_code}")
+            if i >= args.warmup:
+                timings.append(elapsed_ms)
+                queries.append(len(statements))
+                statuses.add(response.status_code)
+
+        timings.sort()
+        results[name] = {
+            'method': method,
+            'path': path,
+            'samples': len(timings),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+            'status': sorted(statuses),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+        row = results[name]
+        print(f"{name:<36} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+              f"{row['queries_median']:>8g} {row['queries_max']:>8} {row['peak_rss_mb']:>9.1f}")
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold, min_delta_ms):
+    """
+    In chênh lệch p95 / số truy vấn so với baseline; trả về danh sách kịch bản chậm đi quá ngưỡng
+    (cả tương đối lẫn tuyệt đối, để route vài ms không bị báo nhầm vì nhiễu) hoặc chạy nhiều SQL hơn.
+    """
+    regressions = []
+    print(f"\nSo với baseline {baseline['meta'].get('revision') or '?'} ({baseline['meta'].get('created')}):")
+    print(f"{'Kịch bản':<36} {'p95 cũ':>9} {'p95 mới':>9} {'Chênh':>8} {'SQL cũ':>7} {'SQL mới':>8}")
+    for name, row in results.items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            print(f"{name:<36} {'(mới)':>9} {row['p95_ms']:>9.1f}")
+            continue
+        change = (row['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+        slower = change > threshold and row['p95_ms'] - old['p95_ms'] > min_delta_ms
+        flag = ''
+        if slower or row['queries_median'] > old['queries_median']:
+            flag = '  <-- CHẬM HƠN' if slower else '  <-- NHIỀU SQL HƠN'
+            regressions.append(name)
+        print(f"{name:<36} {old['p95_ms']:>9.1f} {row['p95_ms']:>9.1f} {change:>+8.0%} "
+              f"{old['queries_median']:>7g} {row['queries_median']:>8g}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--class-size', type=int, default=60)
+    parser.add_argument('--courses-per-semester', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--only', nargs='*', help='Chỉ chạy các kịch bản có tên chứa một trong các chuỗi này')
+    parser.add_argument('--cold-cache', action='store_true')
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--output', help='Ghi kết quả ra file JSON (dùng làm baseline cho lần sau)')
+    parser.add_argument('--baseline', help='File JSON của lần đo trước để so sánh')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Ngưỡng p95 chậm đi (0.2 = 20%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help='Bỏ qua chênh lệch p95 nhỏ hơn (ms)')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    db_file.close()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_file.name
+    os.environ.setdefault('JOB_INLINE_WORKER', '0')
+    sys.path.insert(0, PROJECT_ROOT)
+
+    import api.index as qlsv
+
+    app = qlsv.app
+    app.config['BULK_BCRYPT_LOG_ROUNDS'] = 4
+    rng = random.Random(args.seed)
+    rss_before = peak_rss_mb()
+
+    with app.app_context():
+        started = time.perf_counter()
+        classes, courses, students_by_class = seed_university(qlsv, args)
+        seed_s = time.perf_counter() - started
+        result_count = qlsv.db.session.query(qlsv.KetQua).count()
+    print(f"Dữ liệu: {args.students} SV, {len(classes)} lớp, {len(courses)} môn, "
+          f"{result_count} điểm (nạp trong {seed_s:.1f} s)")
+
+    print(f"{'Kịch bản':<36} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'SQL TV':>8} {'SQL max':>8} {'RSS (MB)':>9}")
+    results = run_scenarios(qlsv, build_scenarios(classes, courses, students_by_class, rng), args)
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'dataset': {'students': args.students, 'class_size': args.class_size,
+                        'courses_per_semester': args.courses_per_semester, 'results': result_count, 'seed': args.seed},
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'cold_cache': args.cold_cache,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'rss_before_seed_mb': round(rss_before, 1),
+        },
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả vào {args.output}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('dataset') != report['meta']['dataset']:
+            print("Cảnh báo: baseline dùng bộ dữ liệu khác, so sánh chỉ mang tính tham khảo")
+        regressions = compare_with_baseline(results, baseline, args.threshold, args.min_delta_ms)
+
+    os.unlink(db_file.name)
+    if regressions and args.fail_on_regression:
+        print(f"Chậm đi / nhiều SQL hơn: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark: số câu truy vấn SQL và thời gian của admin_save_grades theo sĩ số lớp.
+
+Chạy:  python benchmarks/bench_save_grades.py --sizes 20 200 1000
+Dùng một file SQLite tạm (không đụng tới qlsv.db). Số truy vấn ghi/đọc điểm giữ
+nguyên khi sĩ số lớp tăng; chỉ phần cập nhật GPA tổng hợp tăng thêm 4 câu cho mỗi
+GPA_REFRESH_CHUNK_SIZE sinh viên.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def build_form(lop, ma_mh, ma_sv_list, rng):
+    form = {'lop': lop, 'ma_mh': ma_mh}
+    for ma_sv in ma_sv_list:
+        form[f'diem_cc_{ma_sv}'] = str(rng.randint(0, 10))
+        form[f'diem_gk_{ma_sv}'] = str(rng.randint(0, 10))
+        form[f'diem_ck_{ma_sv}'] = str(rng.randint(0, 10))
+    return form
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 1000])
+    args = parser.parse_args()
+
+    db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    db_file.close()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_file.name
+    sys.path.insert(0, PROJECT_ROOT)
+
+    from sqlalchemy import event, insert
+    import api.index as qlsv
+
+    app, db = qlsv.app, qlsv.db
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    rng = random.Random(2024)
+
+    with app.app_context():
+        admin = qlsv.TaiKhoan(username='bench_gv', vai_tro=qlsv.VaiTroEnum.GIAOVIEN)
+        admin.set_password('bench')
+        db.session.add(admin)
+        db.session.add(qlsv.MonHoc(ma_mh='BENCH01', ten_mh='Benchmark', so_tin_chi=3, hoc_ky=1))
+        for size in args.sizes:
+            lop = f'BENCH{size}'
+            ids = [f'{lop}X{i:05d}' for i in range(size)]
+            db.session.execute(insert(qlsv.TaiKhoan.__table__), [
+                {'username': ma_sv, 'password': '-', 'vai_tro': qlsv.VaiTroEnum.SINHVIEN} for ma_sv in ids
+            ])
+            db.session.execute(insert(qlsv.SinhVien.__table__), [
+                {'ma_sv': ma_sv, 'ho_ten': ma_sv, 'lop': lop} for ma_sv in ids
+            ])
+        db.session.commit()
+        engine = db.engine
+
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench_gv', 'password': 'bench'})
+
+    print(f"{'Sĩ số':>8} {'Lần lưu':>10} {'Số truy vấn':>12} {'Thời gian (ms)':>15}")
+    for size in args.sizes:
+        lop = f'BENCH{size}'
+        ids = [f'{lop}X{i:05d}' for i in range(size)]
+        # Lần 1: toàn bộ là INSERT; lần 2: toàn bộ là UPDATE
+        for label in ('insert', 'update'):
+            form = build_form(lop, 'BENCH01', ids, rng)
+            statements.clear()
+            started = time.perf_counter()
+            response = client.post('/admin/grades/save', data=form)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            assert response.status_code == 302, response.status_code
+            print(f'{size:>8} {label:>10} {len(statements):>12} {elapsed_ms:>15.1f}')
+
+    os.remove(db_file.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: tìm sinh viên theo họ tên / mã SV bằng FTS5 so với ILIKE '%...%'.
+
+Chạy:  python benchmarks/bench_student_search.py --students 100000
+Dùng một file SQLite tạm (không đụng tới qlsv.db). Mỗi truy vấn được đo nhiều lần,
+in thời gian trung vị (ms) và số kết quả của từng cách tìm.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+HO = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng', 'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương']
+DEM = ['Văn', 'Thị', 'Hữu', 'Đức', 'Minh', 'Ngọc', 'Thanh', 'Quốc', 'Gia', 'Thu']
+TEN = ['An', 'Bình', 'Cường', 'Dũng', 'Đạt', 'Giang', 'Hà', 'Hải', 'Hường', 'Khánh', 'Linh', 'Long',
+       'Mai', 'Nam', 'Ngân', 'Phúc', 'Quân', 'Sơn', 'Thảo', 'Trang', 'Tuấn', 'Vy', 'Yến']
+
+QUERIES = [
+    ('ho_ten', 'dang duc dat'),
+    ('ho_ten', 'huong'),
+    ('ho_ten', 'nguyen thi'),
+    ('ma_sv', 'B21DCCN01'),
+]
+
+
+def median_ms(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    db_file.close()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_file.name
+    sys.path.insert(0, PROJECT_ROOT)
+
+    from sqlalchemy import insert
+    import api.index as qlsv
+
+    app, db = qlsv.app, qlsv.db
+    rng = random.Random(2024)
+
+    with app.app_context():
+        ids = [f'B{21 + i % 4}DCCN{i:06d}' for i in range(args.students)]
+        started = time.perf_counter()
+        for offset in range(0, len(ids), 10000):
+            batch = ids[offset:offset + 10000]
+            db.session.execute(insert(qlsv.TaiKhoan.__table__), [
+                {'username': ma_sv, 'password': '-', 'vai_tro': qlsv.VaiTroEnum.SINHVIEN} for ma_sv in batch
+            ])
+            db.session.execute(insert(qlsv.SinhVien.__table__), [
+                {'ma_sv': ma_sv, 'ho_ten': f'{rng.choice(HO)} {rng.choice(DEM)} {rng.choice(TEN)}',
+                 'lop': f'D{21 + i % 4}CQCN{i % 20:02d}-B', 'khoa': 'CNTT'}
+                for i, ma_sv in enumerate(batch, start=offset)
+            ])
+        db.session.commit()
+        print(f"Nạp {args.students} SV (kèm trigger FTS5): {time.perf_counter() - started:.1f} s")
+
+        def run(field, keyword):
+            conditions = qlsv.student_search_conditions(**{f'search_{field}': keyword})
+            return qlsv.SinhVien.query.filter(*conditions).order_by(qlsv.SinhVien.ma_sv).limit(50).all()
+
+        print(f"{'Truy vấn':<26} {'FTS5 (ms)':>10} {'Kết quả':>8} {'ILIKE (ms)':>11} {'Kết quả':>8}")
+        for field, keyword in QUERIES:
+            qlsv._student_search_ready = True
+            fts_ms, fts_rows = median_ms(lambda: run(field, keyword), args.repeat)
+            qlsv._student_search_ready = False
+            like_ms, like_rows = median_ms(lambda: run(field, keyword), args.repeat)
+            print(f"{field + '=' + keyword:<26} {fts_ms:>10.2f} {len(fts_rows):>8} {like_ms:>11.2f} {len(like_rows):>8}")
+
+        qlsv._student_search_ready = True
+        ranked_ms, ranked = median_ms(lambda: qlsv.search_students('dang duc dat', 20), args.repeat)
+        print(f"search_students('dang duc dat') xếp hạng bm25: {ranked_ms:.2f} ms, {len(ranked)} kết quả")
+
+    os.unlink(db_file.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Kiểm tra bảng điểm dạng rộng: mỗi SV có điểm đúng một dòng, kể cả SV chưa có lớp (lop NULL).
+
+Chạy:  python benchmarks/check_gradebook_export.py [--students 60]
+Dùng một file SQLite tạm (không đụng tới qlsv.db): nửa số SV không có lớp, mỗi SV có điểm 1-3 môn
+(một số môn chưa có điểm tổng kết). So sánh số dòng của file CSV dạng rộng với số mã SV khác nhau
+trong bảng điểm dạng dài; sai khác -> mã lỗi 1.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+COURSES = 4
+
+
+def seed(qlsv, students):
+    from sqlalchemy import insert
+
+    db = qlsv.db
+    db.session.execute(insert(qlsv.MonHoc.__table__), [
+        {'ma_mh': f'MH{j}', 'ten_mh': f'Môn {j}', 'so_tin_chi': 3, 'hoc_ky': 1 + j % 3} for j in range(COURSES)
+    ])
+    ma_sv_list = [f'SV{i:04d}' for i in range(students)]
+    db.session.execute(insert(qlsv.TaiKhoan.__table__), [
+        {'username': ma_sv, 'password': '-', 'vai_tro': qlsv.VaiTroEnum.SINHVIEN} for ma_sv in ma_sv_list
+    ])
+    db.session.execute(insert(qlsv.SinhVien.__table__), [
+        {'ma_sv': ma_sv, 'ho_ten': f'Sinh viên {ma_sv}', 'lop': None if i % 2 else 'L1'}
+        for i, ma_sv in enumerate(ma_sv_list)
+    ])
+    db.session.commit()
+    for i, ma_sv in enumerate(ma_sv_list):
+        for j in range(1 + i % 3):
+            result = qlsv.KetQua(ma_sv=ma_sv, ma_mh=f'MH{j}', diem_chuyen_can=5, diem_giua_ky=6,
+                                 diem_cuoi_ky=None if (i + j) % 5 == 0 else 7)
+            result.calculate_final_score()
+            db.session.add(result)
+    db.session.commit()
+
+
+def csv_data_rows(output):
+    output.seek(0)
+    rows = list(csv.reader(io.TextIOWrapper(output, encoding='utf-8-sig')))
+    return rows[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=60)
+    args = parser.parse_args()
+
+    db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    db_file.close()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_file.name
+    sys.path.insert(0, PROJECT_ROOT)
+    import api.index as qlsv
+
+    try:
+        with qlsv.app.app_context():
+            seed(qlsv, args.students)
+            long_rows = csv_data_rows(qlsv.build_grades_export('all', 'all', 'csv')[0])
+            wide_rows = csv_data_rows(qlsv.build_gradebook_export('all', 'all', 'csv')[0])
+    finally:
+        os.unlink(db_file.name)
+
+    students = {row[0] for row in long_rows}
+    wide_students = [row[1] for row in wide_rows]
+    if len(wide_rows) != len(students) or set(wide_students) != students:
+        missing = sorted(students - set(wide_students))
+        print(f"Dạng rộng có {len(wide_rows)} dòng, dạng dài có {len(students)} SV; thiếu: {missing[:20]}")
+        raise SystemExit(1)
+    without_class = sum(1 for row in wide_rows if not row[0])
+    print(f"Dạng rộng khớp: {len(wide_rows)} SV ({without_class} SV chưa có lớp), {len(long_rows)} dòng dạng dài")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Kiểm tra thang điểm: ba cách chuyển đổi sinh từ cùng bảng GRADE_SCALE / GPA_CLASSES phải cho kết quả giống nhau:
+hàm Python từng điểm, convert_scores_bulk / count_* (NumPy) và biểu thức SQL CASE (chạy trên SQLite trong bộ nhớ).
+
+Chạy:  python benchmarks/check_grading_scale.py [--samples 500] [--seed 2024]
+Dữ liệu kiểm tra gồm các ngưỡng, giá trị sát ngưỡng, biên 0/10, điểm trống và điểm ngẫu nhiên;
+chạy trong khoảng một giây, sai khác -> mã lỗi 1. Nên chạy sau mỗi lần sửa thang điểm.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def check_samples(qlsv, rng, count):
+    """Ngưỡng, ngưỡng ± epsilon, biên 0/10, điểm trống và các điểm ngẫu nhiên (làm tròn 2 chữ số như khi lưu)."""
+    samples = [None, 0.0, 10.0, -0.01, 10.01]
+    for threshold in [row[0] for row in qlsv.GRADE_SCALE] + [row[0] for row in qlsv.GPA_CLASSES]:
+        samples += [threshold, threshold - 0.01, threshold + 0.01,
+                    math.nextafter(threshold, -math.inf), math.nextafter(threshold, math.inf)]
+    samples += [round(rng.uniform(0, 10), 2) for _ in range(count)]
+    samples += [rng.uniform(0, 10) for _ in range(count)]
+    return samples
+
+
+def check_agreement(qlsv, samples):
+    from sqlalchemy import create_engine, select, literal, Float, union_all
+
+    python_letters = [qlsv.convert_10_to_letter(x) for x in samples]
+    python_points = [qlsv.convert_10_to_4_scale(x) for x in samples]
+    numpy_letters, numpy_points = qlsv.convert_scores_bulk(samples)
+
+    engine = create_engine('sqlite://')
+    with engine.connect() as conn:
+        sql_rows = []
+        for offset in range(0, len(samples), 400): # Giới hạn số tham số của SQLite
+            rows = union_all(*[
+                select(literal(i, type_=Float).label('i'), literal(x, type_=Float).label('diem'))
+                for i, x in enumerate(samples[offset:offset + 400], start=offset)
+            ]).subquery()
+            sql_rows += conn.execute(
+                select(qlsv.diem_chu_case(rows.c.diem), qlsv.diem_he_4_case(rows.c.diem)).order_by(rows.c.i)
+            ).all()
+
+    mismatches = []
+    for i, x in enumerate(samples):
+        got = (python_letters[i], numpy_letters[i], sql_rows[i][0],
+               python_points[i], float(numpy_points[i]), sql_rows[i][1])
+        if not (got[0] == got[1] == got[2] and got[3] == got[4] == got[5]):
+            mismatches.append((x, got))
+
+    python_classes = {}
+    for x in samples:
+        if x is not None:
+            label = qlsv.classify_gpa_10(x)
+            python_classes[label] = python_classes.get(label, 0) + 1
+    numpy_classes = {label: n for label, n in qlsv.count_gpa_classes(samples).items() if n}
+    if python_classes != numpy_classes:
+        mismatches.append(('xếp loại', (python_classes, numpy_classes)))
+
+    python_letter_counts = {}
+    for letter in python_letters:
+        if letter is not None:
+            python_letter_counts[letter] = python_letter_counts.get(letter, 0) + 1
+    numpy_letter_counts = {k: n for k, n in qlsv.count_letter_grades(samples).items() if n}
+    if python_letter_counts != numpy_letter_counts:
+        mismatches.append(('đếm điểm chữ', (python_letter_counts, numpy_letter_counts)))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=500, help='Số điểm ngẫu nhiên (mỗi loại) thêm vào các ngưỡng.')
+    parser.add_argument('--seed', type=int, default=2024)
+    args = parser.parse_args()
+
+    sys.path.insert(0, PROJECT_ROOT)
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    import api.index as qlsv
+
+    samples = check_samples(qlsv, random.Random(args.seed), args.samples)
+    mismatches = check_agreement(qlsv, samples)
+    if mismatches:
+        for x, got in mismatches[:20]:
+            print(f"Lệch tại {x!r}: {got}")
+        print(f"Python / NumPy / SQL không khớp: {len(mismatches)} trường hợp")
+        raise SystemExit(1)
+    print(f"Python / NumPy / SQL khớp trên {len(samples)} điểm (gồm ngưỡng và giá trị sát ngưỡng)")
+
+
+if __name__ == '__main__':
+    main()